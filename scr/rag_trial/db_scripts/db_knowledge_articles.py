@@ -3,6 +3,7 @@ Database helper functions for knowledge_articles.db
 Simple CRUD operations for managing knowledge articles.
 """
 
+import sys
 import sqlite3
 from pathlib import Path
 
@@ -79,13 +80,16 @@ def retrieve_kb(kb_id):
     return None
 
 
-def update_kb(kb_id, **kwargs):
+def update_kb(kb_id, sync_vector_store=True, **kwargs):
     """
     Update a knowledge article by its KB_Article_ID.
     Accepts any column names dynamically.
 
     Args:
         kb_id (str): KB_Article_ID to update
+        sync_vector_store (bool): Re-embed the KB article in the vector store
+            afterwards (or remove it, if it is no longer searchable), so
+            searches never return its old text
         **kwargs: Column names and values to update (any columns in the table)
 
     Returns:
@@ -125,6 +129,8 @@ def update_kb(kb_id, **kwargs):
 
         if success:
             print(f"✓ Updated KB article '{kb_id}'")
+            if sync_vector_store:
+                _sync_vector_store(kb_id)
         return success
 
     except Exception as e:
@@ -133,6 +139,23 @@ def update_kb(kb_id, **kwargs):
         return False
 
 
+def _sync_vector_store(kb_id):
+    """
+    Bring the vector store in line with the updated KB article.
+
+    Imported lazily, because the self-healing pipeline imports this module.
+    A failure is reported but does not undo the database update.
+    """
+    scripts_dir = str(Path(__file__).parent.parent / "scripts")
+    if scripts_dir not in sys.path:
+        sys.path.append(scripts_dir)
+    try:
+        from self_healing_pipeline import sync_knowledge_article
+        sync_knowledge_article(kb_id)
+    except Exception as e:
+        print(f"Warning: KB article '{kb_id}' updated, but its vector was not: {e}")
+
+
 def insert_kb(**kwargs):
     """
     Insert a new knowledge article into the database.
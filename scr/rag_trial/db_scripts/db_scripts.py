@@ -3,6 +3,7 @@ Database helper functions for scripts.db
 Simple CRUD operations for managing scripts.
 """
 
+import sys
 import sqlite3
 from pathlib import Path
 
@@ -82,13 +83,15 @@ def retrieve_script(script_id):
     return None
 
 
-def update_script(script_id, **kwargs):
+def update_script(script_id, sync_vector_store=True, **kwargs):
     """
     Update a script by its Script_ID.
     Accepts any column names dynamically.
 
     Args:
         script_id (str): Script_ID to update
+        sync_vector_store (bool): Re-embed the script in the vector store
+            afterwards, so searches never return its old text
         **kwargs: Column names and values to update (any columns in the table)
 
     Returns:
@@ -128,6 +131,8 @@ def update_script(script_id, **kwargs):
 
         if success:
             print(f"✓ Updated script '{script_id}'")
+            if sync_vector_store:
+                _sync_vector_store(script_id)
         return success
 
     except Exception as e:
@@ -136,6 +141,23 @@ def update_script(script_id, **kwargs):
         return False
 
 
+def _sync_vector_store(script_id):
+    """
+    Bring the vector store in line with the updated script.
+
+    Imported lazily, because the self-healing pipeline imports this module.
+    A failure is reported but does not undo the database update.
+    """
+    scripts_dir = str(Path(__file__).parent.parent / "scripts")
+    if scripts_dir not in sys.path:
+        sys.path.append(scripts_dir)
+    try:
+        from self_healing_pipeline import sync_script
+        sync_script(script_id)
+    except Exception as e:
+        print(f"Warning: script '{script_id}' updated, but its vector was not: {e}")
+
+
 def insert_script(**kwargs):
     """
     Insert a new script into the database.
@@ -0,0 +1,149 @@
+"""
+Recall vs Size Benchmark for Reduced-Dimension Embeddings
+Compares storing embeddings at 256/512/1024 dimensions (API `dimensions`
+truncation or a PCA projection) against the full 1536-dimension vectors,
+offline, from the stored full vectors (no API calls)
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import faiss
+
+sys.path.append(str(Path(__file__).parent))
+
+from vectorstore import (
+    DEFAULT_VECTOR_STORE_PATH, INDEX_TYPES, VECTORS_FILENAME, REDUCTION_METHODS,
+    build_index, fit_pca, read_current_generation, generation_path, truncate_embeddings
+)
+
+
+def parse_args(argv=None):
+    """Parse benchmark command line options."""
+    parser = argparse.ArgumentParser(
+        description="Measure recall@k and index size at reduced embedding dimensions")
+    parser.add_argument('--vectors', default=None,
+                        help="Full-dimension vectors (.npy) to benchmark (default: "
+                             "vectors.npy of the current vector store generation)")
+    parser.add_argument('--dims', default='256,512,1024',
+                        help="Comma-separated target dimensions (default: 256,512,1024)")
+    parser.add_argument('--methods', default=','.join(REDUCTION_METHODS),
+                        help="Comma-separated reduction methods: api (truncate and "
+                             "re-normalize, as the API's `dimensions` option does) "
+                             "and/or pca (default: api,pca)")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat',
+                        help="Index built at each dimension (default: flat)")
+    parser.add_argument('--k', type=int, default=10,
+                        help="k for recall@k (default: 10)")
+    parser.add_argument('--queries', type=int, default=200,
+                        help="Held-out queries (default: 200)")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="Random seed for the query sample (default: 42)")
+    return parser.parse_args(argv)
+
+
+def load_full_vectors(path=None):
+    """Load the full-dimension vectors to benchmark."""
+    if path is None:
+        current = read_current_generation(DEFAULT_VECTOR_STORE_PATH)
+        path = generation_path(DEFAULT_VECTOR_STORE_PATH, current) / VECTORS_FILENAME
+    vectors = np.load(path)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def reduce(vectors, dimension, method):
+    """Reduce the full vectors to dimension with the given method."""
+    if method == 'api':
+        return truncate_embeddings(vectors, dimension)
+    return fit_pca(vectors, dimension).apply(vectors)
+
+
+def measure(vectors, truth, query_ids, k, index_type):
+    """
+    Search an index built from vectors and score it against the truth.
+
+    Args:
+        vectors: Stored vectors (one per document)
+        truth: Exact full-dimension neighbours of each query, self excluded
+        query_ids: Ids of the documents used as queries
+        k: Number of neighbours compared
+        index_type: Index type to build
+
+    Returns:
+        dict with recall_at_k, ms_per_query and index_bytes
+    """
+    index, _ = build_index(vectors, index_type=index_type)
+    queries = vectors[query_ids]
+
+    start = time.perf_counter()
+    _, found_ids = index.search(queries, k + 1)
+    ms = (time.perf_counter() - start) * 1000 / len(query_ids)
+
+    hits = 0
+    for qid, expected, found in zip(query_ids, truth, found_ids):
+        found = [i for i in found if i != qid and i >= 0][:k]
+        hits += len(set(expected) & set(found))
+
+    return {
+        'recall_at_k': hits / (k * len(query_ids)),
+        'ms_per_query': ms,
+        'index_bytes': faiss.serialize_index(index).nbytes
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    dims = [int(d) for d in args.dims.split(',') if d]
+    methods = [m for m in args.methods.split(',') if m]
+    for method in methods:
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"Unknown reduction method: {method}")
+
+    vectors = load_full_vectors(args.vectors)
+    n_vectors, full_dimension = vectors.shape
+    k = min(args.k, n_vectors - 1)
+    rng = np.random.default_rng(args.seed)
+    query_ids = rng.choice(n_vectors, size=min(args.queries, n_vectors), replace=False)
+    print(f"Loaded {n_vectors} vectors of dimension {full_dimension}; "
+          f"{len(query_ids)} held-out queries, k={k}, index={args.index_type}")
+
+    # Ground truth: exact neighbours at the full dimension
+    exact = faiss.IndexFlatL2(full_dimension)
+    exact.add(vectors)
+    _, exact_ids = exact.search(vectors[query_ids], k + 1)
+    truth = [[i for i in ids if i != qid][:k] for qid, ids in zip(query_ids, exact_ids)]
+
+    results = [(full_dimension, 'full',
+                measure(vectors, truth, query_ids, k, args.index_type))]
+    for dimension in dims:
+        if dimension >= full_dimension:
+            print(f"⚠ Skipping {dimension}: not below the full dimension {full_dimension}")
+            continue
+        for method in methods:
+            if method == 'pca' and n_vectors < dimension:
+                print(f"⚠ Skipping pca at {dimension}: needs at least {dimension} vectors")
+                continue
+            reduced = reduce(vectors, dimension, method)
+            results.append((dimension, method,
+                            measure(reduced, truth, query_ids, k, args.index_type)))
+
+    full_bytes = results[0][2]['index_bytes']
+    print(f"\n{'Dimension':>9}  {'Method':<6}  {f'Recall@{k}':>9}  "
+          f"{'Index MB':>8}  {'Size':>6}  {'ms/query':>8}")
+    print("-" * 58)
+    for dimension, method, result in results:
+        print(f"{dimension:>9}  {method:<6}  {result['recall_at_k']:>9.4f}  "
+              f"{result['index_bytes'] / (1024*1024):>8.2f}  "
+              f"{result['index_bytes'] / full_bytes:>6.1%}  "
+              f"{result['ms_per_query']:>8.3f}")
+
+    print("\nRecall is against exact search on the full-dimension vectors. Build a "
+          "reduced store with: python scripts/ingest_data.py --dimension N "
+          "[--reduction api|pca]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Offline Retrieval Benchmark
+Builds a vector store per index type from final_ver3.xlsx (or synthetic
+tickets) with the deterministic hashing embedder, runs a fixed query set
+through query_vectorstore and ClassificationAgent._retrieve_similar_documents,
+and reports p50/p95/p99 latency, QPS and recall@k. No OpenAI calls.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import contextlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+import ingest_data
+from vectorstore import INDEX_TYPES, RETRIEVAL_MODES
+from query_vectorstore import query_vectorstore
+from classification_agent import ClassificationAgent
+
+ENTRY_POINTS = ('query_vectorstore', 'agent')
+
+# Vocabulary for synthetic tickets, shaped like final_ver3.xlsx
+SYNTHETIC_PRODUCTS = [
+    'ExampleCo PropertySuite Affordable', 'ExampleCo PropertySuite Commercial',
+    'ExampleCo Resident Portal'
+]
+SYNTHETIC_TOPICS = {
+    'Advance Property Date': [
+        ('date advance fails for {site}', 'backend voucher reference invalid during month end close'),
+        ('cannot advance property date at {site}', 'open move out certification blocks the date advance'),
+        ('date advance stuck processing for {site}', 'pending rent roll job locks the property date'),
+    ],
+    'Certifications': [
+        ('annual recertification missing income for {site}', 'household income verification not attached to the certification'),
+        ('move in certification rejected at {site}', 'unit number mismatch between certification and lease'),
+        ('interim certification will not finalize for {site}', 'required signature date missing on the 50059 form'),
+    ],
+    'HAP / Voucher Processing': [
+        ('HAP voucher total incorrect for {site}', 'assistance payment miscalculated after a retroactive adjustment'),
+        ('voucher submission failed for {site}', 'contract number expired on the voucher header'),
+    ],
+    'TRACS File': [
+        ('TRACS file transmission error at {site}', 'MAT record field length exceeds the TRACS specification'),
+        ('TRACS file rejected by contract administrator for {site}', 'duplicate tenant record in the MAT10 section'),
+    ],
+    'General': [
+        ('user cannot log in to {site}', 'password reset email blocked by the spam filter'),
+        ('report export times out for {site}', 'large date range exceeds the report row limit'),
+        ('resident ledger balance wrong at {site}', 'late fee posted twice by the nightly batch'),
+    ],
+}
+SYNTHETIC_SITES = [
+    'Oak Ridge Apartments', 'Maple Court', 'Riverside Senior Housing', 'Pine Hill Villas',
+    'Harbor View Homes', 'Cedar Park Residences', 'Willow Creek Commons', 'Sunset Terrace'
+]
+SYNTHETIC_FIXES = [
+    'Cleared the blocking record and re-ran the process',
+    'Corrected the configuration and asked the site to retry',
+    'Applied the data fix script and verified with the customer',
+    'Escalated to tier 3 who patched the record in the backend',
+]
+
+
+def parse_args(argv=None):
+    """Parse benchmark command line options."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark retrieval latency and recall offline, per index type")
+    parser.add_argument('--data', default=None,
+                        help="Ticket export (.xlsx or .csv), e.g. data/final_ver3.xlsx "
+                             "(default: synthetic tickets)")
+    parser.add_argument('--synthetic', type=int, default=2000,
+                        help="Number of synthetic tickets when --data is not given "
+                             "(default: 2000)")
+    parser.add_argument('--index-types', default=','.join(INDEX_TYPES),
+                        help="Comma-separated index types to build (default: all)")
+    parser.add_argument('--entry-points', default=','.join(ENTRY_POINTS),
+                        help="Comma-separated code paths to time: query_vectorstore, "
+                             "agent (default: both)")
+    parser.add_argument('--mode', choices=RETRIEVAL_MODES, default='vector',
+                        help="Retrieval mode passed to both entry points (default: vector)")
+    parser.add_argument('--queries', default=None,
+                        help="File with one query per line (default: queries derived "
+                             "from the tickets, each with a known source ticket)")
+    parser.add_argument('--n-queries', type=int, default=200,
+                        help="Derived queries (default: 200)")
+    parser.add_argument('--k', type=int, default=10,
+                        help="Results per query, k for recall@k (default: 10)")
+    parser.add_argument('--warmup', type=int, default=10,
+                        help="Untimed queries before each run (default: 10)")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="Random seed for synthetic data and queries (default: 42)")
+    parser.add_argument('--keep', default=None,
+                        help="Directory to keep the built stores in (default: a "
+                             "temporary directory, removed afterwards)")
+    return parser.parse_args(argv)
+
+
+def make_synthetic_tickets(n, seed=42):
+    """
+    Generate n support tickets with the final_ver3.xlsx columns.
+
+    Returns:
+        pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    categories = list(SYNTHETIC_TOPICS)
+    rows = []
+    for i in range(n):
+        category = categories[rng.integers(len(categories))]
+        subject, root_cause = SYNTHETIC_TOPICS[category][
+            rng.integers(len(SYNTHETIC_TOPICS[category]))]
+        site = SYNTHETIC_SITES[rng.integers(len(SYNTHETIC_SITES))]
+        unit = int(rng.integers(100, 999))
+        subject = subject.format(site=site)
+        rows.append({
+            'Ticket_Number': f"CS-{i + 1:08d}",
+            'Product_x': SYNTHETIC_PRODUCTS[rng.integers(len(SYNTHETIC_PRODUCTS))],
+            'Category_x': category,
+            'Issue_Summary': f"{subject} unit {unit}",
+            'Subject': subject.capitalize(),
+            'Description': f"Customer at {site} reports {subject} for unit {unit}; "
+                           f"{root_cause}.",
+            'Resolution': SYNTHETIC_FIXES[rng.integers(len(SYNTHETIC_FIXES))],
+            'Root_Cause': root_cause,
+            'Tags_generated_kb': category.lower().replace(' / ', ','),
+            'Priority': ['Low', 'Medium', 'High', 'Critical'][rng.integers(4)],
+            'Answer_Type': ['SEED_KB', 'Script', 'Mixed'][rng.integers(3)],
+        })
+    return pd.DataFrame(rows)
+
+
+def make_query_set(df, n, seed=42):
+    """
+    Derive queries from tickets: each keeps ~70% of a ticket's issue words.
+
+    Returns:
+        list: (query, index of the source ticket) pairs
+    """
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(df), size=min(n, len(df)), replace=False)
+    queries = []
+    for idx in ids:
+        row = df.iloc[int(idx)]
+        words = f"{row.get('Issue_Summary', '')} {row.get('Description', '')}".split()
+        keep = [w for w in words if rng.random() < 0.7] or words
+        queries.append((' '.join(keep), int(idx)))
+    return queries
+
+
+def build_store(data_path, store_path, index_type):
+    """Ingest data_path into store_path with the hashing embedder."""
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        ingest_data.main([
+            '--data', str(data_path), '--vector-store', str(store_path),
+            '--embedder', 'hashing', '--index-type', index_type,
+            # Keep one vector per row so results map back to their source,
+            # even if dedup becomes the default again
+            '--dedup-threshold', '0'
+        ])
+
+
+def run_queries(search, queries, warmup):
+    """
+    Time search(query) for each query, output silenced.
+
+    Returns:
+        (latencies in ms, result indices per query)
+    """
+    latencies, results = [], []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for query in queries[:warmup]:
+            search(query)
+        for query in queries:
+            start = time.perf_counter()
+            documents = search(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([doc['index'] for doc in documents])
+    return np.array(latencies), results
+
+
+def summarize(latencies, results, reference, expected, k):
+    """Latency percentiles, QPS, recall@k against reference and source-ticket hit rate."""
+    summary = {
+        'p50': float(np.percentile(latencies, 50)),
+        'p95': float(np.percentile(latencies, 95)),
+        'p99': float(np.percentile(latencies, 99)),
+        'qps': len(latencies) / (latencies.sum() / 1000),
+        'recall': None,
+        'hit': None
+    }
+    if reference is not None:
+        hits = sum(len(set(r[:k]) & set(ref[:k])) for r, ref in zip(results, reference))
+        total = sum(len(ref[:k]) for ref in reference)
+        summary['recall'] = hits / total if total else None
+    if expected is not None:
+        summary['hit'] = float(np.mean([e in r[:k] for r, e in zip(results, expected)]))
+    return summary
+
+
+def print_report(report, k, mode):
+    """Print one row per index type and entry point."""
+    print(f"\nRetrieval benchmark (mode={mode}, k={k}; recall@{k} is against "
+          f"the flat index through the same entry point)")
+    print(f"{'Index':<6}  {'Entry point':<17}  {'p50 ms':>7}  {'p95 ms':>7}  "
+          f"{'p99 ms':>7}  {'QPS':>7}  {f'Recall@{k}':>9}  {f'Hit@{k}':>6}")
+    print("-" * 82)
+    for (index_type, entry_point), s in report.items():
+        recall = f"{s['recall']:.4f}" if s['recall'] is not None else '-'
+        hit = f"{s['hit']:.3f}" if s['hit'] is not None else '-'
+        print(f"{index_type:<6}  {entry_point:<17}  {s['p50']:>7.2f}  {s['p95']:>7.2f}  "
+              f"{s['p99']:>7.2f}  {s['qps']:>7.1f}  {recall:>9}  {hit:>6}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    index_types = [t for t in args.index_types.split(',') if t]
+    entry_points = [e for e in args.entry_points.split(',') if e]
+    for index_type in index_types:
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+    for entry_point in entry_points:
+        if entry_point not in ENTRY_POINTS:
+            raise ValueError(f"Unknown entry point: {entry_point}")
+    # Recall is measured against exact search, so flat is always built first
+    index_types = ['flat'] + [t for t in index_types if t != 'flat']
+
+    work_dir = Path(args.keep or tempfile.mkdtemp(prefix="retrieval_benchmark_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        if args.data:
+            data_path = args.data
+            df = (pd.read_csv(data_path) if data_path.endswith('.csv')
+                  else pd.read_excel(data_path))
+        else:
+            df = make_synthetic_tickets(args.synthetic, args.seed)
+            data_path = work_dir / "synthetic_tickets.csv"
+            df.to_csv(data_path, index=False)
+        print(f"Corpus: {len(df)} tickets from {args.data or 'synthetic data'}")
+
+        if args.queries:
+            with open(args.queries) as f:
+                queries = [line.strip() for line in f if line.strip()]
+            expected = None
+        else:
+            pairs = make_query_set(df, args.n_queries, args.seed)
+            queries = [query for query, _ in pairs]
+            expected = [idx for _, idx in pairs]
+        print(f"Queries: {len(queries)} (mode={args.mode}, k={args.k})")
+
+        report, reference = {}, {}
+        for index_type in index_types:
+            store_path = work_dir / f"store_{index_type}"
+            print(f"Building {index_type} index...")
+            build_store(data_path, store_path, index_type)
+
+            searches = {}
+            if 'query_vectorstore' in entry_points:
+                # Both entry points pick the hashing embedder from metadata['model']
+                searches['query_vectorstore'] = lambda q: query_vectorstore(
+                    q, args.k, mode=args.mode, vector_store_path=store_path)
+            if 'agent' in entry_points:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    agent = ClassificationAgent(store_path)
+                searches['agent'] = lambda q: agent._retrieve_similar_documents(
+                    q, top_k=args.k, mode=args.mode)
+
+            for entry_point, search in searches.items():
+                latencies, results = run_queries(search, queries, args.warmup)
+                if index_type == 'flat':
+                    reference[entry_point] = results
+                report[(index_type, entry_point)] = summarize(
+                    latencies, results, reference.get(entry_point), expected, args.k)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report, args.k, args.mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Bulk Backlog Triage
+Classifies every pending ticket in realpage.db in one batched run:
+batched embeddings, one matrix search, concurrent LLM calls, and
+relevancy_score / reference_articles written back to each ticket
+"""
+
+import sys
+import json
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Add parent directory to path for db_scripts import
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from db_scripts.db_ticket import get_tickets_by_status, update_ticket
+from classification_agent import ClassificationAgent, DEFAULT_JUDGE_MODE, JUDGE_MODES
+from vectorstore import parse_mode_arg
+
+# Long transcripts are cut so a single ticket cannot exceed the embedding
+# model's input limit
+MAX_QUERY_CHARS = 6000
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def build_ticket_query(ticket):
+    """
+    Build the search query for a ticket.
+
+    Uses the subject and description when present, then the issue
+    summary, then the (truncated) transcript.
+
+    Args:
+        ticket: Ticket row from get_tickets_by_status
+
+    Returns:
+        str: Query text, or '' if the ticket has no usable text
+    """
+    parts = [ticket.get(field) for field in ('subject', 'description')]
+    parts = [str(part).strip() for part in parts if part and str(part).strip()]
+    if not parts and ticket.get('issue_summary'):
+        parts = [str(ticket['issue_summary']).strip()]
+    if not parts and ticket.get('transcript'):
+        parts = [str(ticket['transcript']).strip()]
+    return "\n".join(parts)[:MAX_QUERY_CHARS]
+
+
+def _reference_articles(results):
+    """Compact reference list stored in ticket.reference_articles."""
+    references = []
+    for result in results:
+        rag = result['RAG_response']
+        references.append({
+            'refered_ticket_id': rag['refered_ticket_id'],
+            'answer_type': rag['answer_type'],
+            'kb_id': rag['resolution']['reference_article']['kb_id'],
+            'script_id': rag['resolution']['reference_article']['script_id'],
+            'relevancy_score': rag['resolution']['relevancy_score'],
+            'similarity_score': rag['metadata']['similarity_score'],
+            'rrf_score': rag['metadata'].get('rrf_score')
+        })
+    return references
+
+
+def score_ticket(agent, ticket, query, retrieved_docs, judge_mode=DEFAULT_JUDGE_MODE):
+    """
+    Run the LLM steps of classify_query for one ticket.
+
+    Args:
+        agent: ClassificationAgent
+        ticket: Ticket row
+        query: Query text used for retrieval
+        retrieved_docs: Documents retrieved for the query
+        judge_mode: 'per-document' or 'batched' relevancy judging
+
+    Returns:
+        List of formatted results, one per retrieved document
+    """
+    generated_response = agent._generate_llm_response(query, retrieved_docs)
+
+    # Tickets already run concurrently, so each ticket judges sequentially
+    relevancy_results = agent._score_documents(
+        query, generated_response, retrieved_docs, concurrency=1, judge_mode=judge_mode)
+    return [agent._format_output(query, doc, generated_response, relevancy_result,
+                                 ticket['ticket_id'])
+            for doc, relevancy_result in zip(retrieved_docs, relevancy_results)]
+
+
+def triage_backlog(agent=None, status='pending', top_k=3, batch_size=100,
+                   max_workers=DEFAULT_MAX_WORKERS, dry_run=False, mode='vector',
+                   judge_mode=DEFAULT_JUDGE_MODE):
+    """
+    Classify all tickets with a given status and write the scores back.
+
+    Args:
+        agent: ClassificationAgent to use (created if not given)
+        status: Ticket status to triage
+        top_k: Documents retrieved and scored per ticket
+        batch_size: Queries per embeddings API call
+        max_workers: Tickets whose LLM steps run concurrently
+        dry_run: Score tickets without updating the database
+        mode: Retrieval mode: 'vector', 'hybrid' (vector + BM25) or
+            'lexical' (BM25 only, no embedding calls)
+        judge_mode: 'per-document' (one judge call per document) or
+            'batched' (one call scoring a ticket's documents)
+
+    Returns:
+        dict: ticket id -> list of formatted results
+    """
+    if judge_mode not in JUDGE_MODES:
+        raise ValueError(f"Unknown judge mode: {judge_mode}")
+    start = time.time()
+    tickets = get_tickets_by_status(status)
+    print(f"Found {len(tickets)} '{status}' tickets")
+
+    queries = [build_ticket_query(ticket) for ticket in tickets]
+    skipped = [t['ticket_id'] for t, q in zip(tickets, queries) if not q]
+    if skipped:
+        print(f"⚠ Skipping {len(skipped)} tickets with no text: {', '.join(skipped)}")
+    tickets = [t for t, q in zip(tickets, queries) if q]
+    queries = [q for q in queries if q]
+    if not tickets:
+        return {}
+
+    agent = agent or ClassificationAgent()
+
+    # Step 1: Embed the whole backlog in batches
+    embeddings = None
+    if mode != 'lexical':
+        print(f"Step 1: Embedding {len(queries)} queries ({batch_size} per call)...")
+        embeddings = agent._create_query_embeddings(queries, batch_size=batch_size)
+
+    # Step 2: One matrix search for all tickets
+    print(f"Step 2: Searching the vector store ({mode})...")
+    if mode == 'vector':
+        distances, indices = agent.vector_store.search(embeddings, top_k)
+        retrieved = [agent._build_documents(indices[i], distances[i])
+                     for i in range(len(tickets))]
+    else:
+        scores, indices = agent.vector_store.hybrid_search(
+            embeddings, queries, top_k, mode=mode)
+        retrieved = [agent._build_documents(indices[i], scores[i], fused=True)
+                     for i in range(len(tickets))]
+    print(f"✓ Retrieved documents in {time.time() - start:.1f}s\n")
+
+    # Step 3: LLM generation and judging, several tickets at a time
+    print(f"Step 3: Scoring tickets ({max_workers} concurrent)...")
+    triaged = {}
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(score_ticket, agent, ticket, query, docs, judge_mode): ticket
+            for ticket, query, docs in zip(tickets, queries, retrieved)
+            if docs
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            ticket = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"  ⚠ {ticket['ticket_id']}: {e}")
+                continue
+
+            triaged[ticket['id']] = results
+            score = results[0]['RAG_response']['resolution']['relevancy_score']
+            print(f"  [{n}/{len(futures)}] {ticket['ticket_id']}: score {score}")
+
+            # Database writes stay on this thread
+            if not dry_run:
+                update_ticket(
+                    ticket['id'],
+                    relevancy_score=score,
+                    reference_articles=json.dumps(_reference_articles(results)))
+
+    print(f"\n✓ Triaged {len(triaged)} tickets in {time.time() - start:.1f}s"
+          + (f" ({failed} failed)" if failed else "")
+          + (" (dry run, database not updated)" if dry_run else ""))
+    return triaged
+
+
+def main():
+    """CLI entry point for bulk triage."""
+    if '--help' in sys.argv or '-h' in sys.argv:
+        print("Usage: python bulk_triage.py [top_k] [--status=STATUS] "
+              "[--workers=N] [--batch-size=N] [--mode=MODE] [--judge=MODE] [--dry-run]")
+        print("\nOptions:")
+        print("  top_k: Documents retrieved and scored per ticket (default: 3)")
+        print("  --status: Ticket status to triage (default: pending)")
+        print(f"  --workers: Tickets scored concurrently (default: {DEFAULT_MAX_WORKERS})")
+        print("  --batch-size: Queries per embeddings call (default: 100)")
+        print("  --mode: vector (default), hybrid or lexical (no embedding calls)")
+        print("  --judge: per-document (default) or batched (one judge call per ticket)")
+        print("  --dry-run: Score without writing to realpage.db")
+        sys.exit(0)
+
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:]
+                   if arg.startswith('--') and '=' in arg)
+    positional = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+
+    triage_backlog(
+        status=options.get('status', 'pending'),
+        top_k=int(positional[0]) if positional else 3,
+        batch_size=int(options.get('batch-size', 100)),
+        max_workers=int(options.get('workers', DEFAULT_MAX_WORKERS)),
+        dry_run='--dry-run' in sys.argv,
+        mode=parse_mode_arg(sys.argv[1:]),
+        judge_mode=options.get('judge', DEFAULT_JUDGE_MODE)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,99 +7,223 @@ from db_scripts.db_ticket import last_row_db
 import os
 import sys
 import json
-import numpy as np
-import faiss
-import pickle
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from openai import OpenAI
+from openai import OpenAI, APIError
 from dotenv import load_dotenv
 
 # Add parent directory to path for db_scripts import
 sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from vectorstore import get_vector_store, parse_filter_args, parse_mode_arg
+from query_router import route_query
+from embeddings import (
+    MAX_BATCH_INPUTS, embed_for_store, embed_query_for_store, get_embedding_client,
+    provider_for_model
+)
 
 # Load environment variables
 load_dotenv()
 
+# Metadata columns used by generation, scoring, output and self-healing
+# (the full Transcript is never needed, so it is not read)
+RETRIEVAL_COLUMNS = [
+    'Ticket_Number', 'Conversation_ID', 'Channel', 'Agent_Name', 'Product_x',
+    'Category_x', 'Issue_Summary', 'Sentiment', 'Priority', 'Tier',
+    'Module_generated_kb', 'Subject', 'Description', 'Resolution', 'Root_Cause',
+    'Tags_generated_kb', 'KB_Article_ID_x', 'Script_ID',
+    'Generated_KB_Article_ID', 'Source_ID', 'Answer_Type', 'Created_Date'
+]
+
+# LLM-as-judge calls in flight at once per query
+DEFAULT_JUDGE_CONCURRENCY = int(os.getenv('JUDGE_CONCURRENCY', 5))
+
+# 'per-document': one judge call per retrieved document;
+# 'batched': one structured-output call scoring all of them
+JUDGE_MODES = ('per-document', 'batched')
+DEFAULT_JUDGE_MODE = os.getenv('JUDGE_MODE', 'per-document')
+
+# Score used when the judge's answer cannot be parsed
+UNPARSED_JUDGE_RESULT = {
+    "score": 50,
+    "relevancy_points": 20,
+    "accuracy_points": 20,
+    "completeness_points": 10,
+    "reasoning": "Unable to parse judge response"
+}
+
+JUDGE_SCORE_FIELDS = {
+    "score": {"type": "integer", "description": "Total score (0-100)"},
+    "relevancy_points": {"type": "integer", "description": "Score for relevancy (0-40)"},
+    "accuracy_points": {"type": "integer", "description": "Score for accuracy (0-40)"},
+    "completeness_points": {"type": "integer", "description": "Score for completeness (0-20)"},
+    "reasoning": {"type": "string", "description": "Brief explanation of the score"}
+}
+
+# Structured output for the batched judge: one score object per document
+BATCHED_JUDGE_SCHEMA = {
+    "name": "relevancy_scores",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "scores": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "document": {"type": "integer", "description": "Document number"},
+                        **JUDGE_SCORE_FIELDS
+                    },
+                    "required": ["document", *JUDGE_SCORE_FIELDS],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["scores"],
+        "additionalProperties": False
+    }
+}
+
 
 class ClassificationAgent:
     """
     Agent for classifying and scoring support ticket relevancy using LLM-as-judge.
     """
 
-    def __init__(self, vector_store_path="vector_store"):
+    def __init__(self, vector_store_path="vector_store", client=None,
+                 embedding_client=None):
         """
         Initialize the classification agent.
 
         Args:
             vector_store_path: Path to the FAISS vector store directory
+            client: OpenAI client for generation and judging (default: one
+                created from OPENAI_API_KEY)
+            embedding_client: Client for query embeddings (default: the
+                provider the vector store was built with, see
+                embeddings.get_embedding_client)
         """
-        self.api_key = os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError(
-                "OPENAI_API_KEY not found in environment variables")
-
-        self.client = OpenAI(api_key=self.api_key)
         self.vector_store_path = Path(
             __file__).parent.parent / vector_store_path
 
-        # Load FAISS index and metadata
+        # Attach to the shared FAISS index and metadata
         self._load_vector_store()
 
+        if client is None:
+            self.api_key = os.getenv('OPENAI_API_KEY')
+            if self.api_key:
+                client = OpenAI(api_key=self.api_key)
+            elif provider_for_model(self.vector_store.model) == 'openai':
+                raise ValueError(
+                    "OPENAI_API_KEY not found in environment variables")
+            else:
+                # Offline store: retrieval works, LLM steps need a key
+                print("⚠ OPENAI_API_KEY not set; retrieval only")
+
+        self.client = client
+        self.embedding_client = get_embedding_client(
+            self.vector_store.model, embedding_client or client)
+
     def _load_vector_store(self):
-        """Load the FAISS index and metadata."""
-        # Resolve vector_store_path relative to script location
-        if not Path(self.vector_store_path).is_absolute():
-            # Go to rag_trial directory
-            base_path = Path(__file__).parent.parent
-            self.vector_store_path = base_path / self.vector_store_path
+        """
+        Attach to the shared vector store (loaded once per process).
 
-        index_path = self.vector_store_path / "faiss_index.bin"
-        metadata_path = self.vector_store_path / "metadata.pkl"
+        The store is memory-mapped and read-only, so startup does not wait
+        on deserializing the index and workers share its pages.
+        """
+        self.vector_store = get_vector_store(self.vector_store_path, mmap=True)
 
-        if not index_path.exists():
-            raise FileNotFoundError(f"FAISS index not found at {index_path}")
-        if not metadata_path.exists():
-            raise FileNotFoundError(f"Metadata not found at {metadata_path}")
+        print(f"✓ Using vector store with {self.vector_store.ntotal} documents")
+        print(f"✓ Using model: {self.vector_store.model}")
 
-        self.index = faiss.read_index(str(index_path))
+    def _create_query_embedding(self, query_text):
+        """Create embedding for the query text, coalesced with concurrent queries."""
+        return embed_query_for_store(self.embedding_client, self.vector_store, query_text)
 
-        with open(metadata_path, 'rb') as f:
-            self.metadata = pickle.load(f)
+    def _create_query_embeddings(self, query_texts, batch_size=MAX_BATCH_INPUTS):
+        """
+        Create embeddings for many query texts, at most batch_size texts per API call.
 
-        print(f"✓ Loaded vector store with {self.index.ntotal} documents")
-        print(
-            f"✓ Using model: {self.metadata.get('model', 'text-embedding-3-small')}")
+        Returns:
+            np.ndarray of shape (len(query_texts), dimension)
+        """
+        return embed_for_store(self.embedding_client, self.vector_store, query_texts, batch_size)
 
-    def _create_query_embedding(self, query_text):
-        """Create embedding for the query text."""
-        response = self.client.embeddings.create(
-            input=[query_text],
-            model=self.metadata.get('model', 'text-embedding-3-small')
-        )
-        return np.array([response.data[0].embedding], dtype=np.float32)
+    def _build_documents(self, indices, distances, fused=False):
+        """
+        Fetch the retrieved documents for one row of search results.
 
-    def _retrieve_similar_documents(self, query_text, top_k=5):
-        """Retrieve the most similar documents from the vector store."""
-        query_embedding = self._create_query_embedding(query_text)
-        distances, indices = self.index.search(query_embedding, top_k)
+        Args:
+            indices: Vector ids for one query (-1 entries are skipped)
+            distances: Matching distances, or fused scores if fused=True
+            fused: Results come from hybrid_search. Fused scores rank
+                documents but are not similarities, so they go in
+                rrf_score and distance / similarity_score are None
 
-        results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            doc_data = self.metadata['dataframe'][idx]
-            text = self.metadata['texts'][idx]
+        Returns:
+            List of document dicts (index, distance, similarity_score,
+            rrf_score, data, text)
+        """
+        hits = [(idx, distance) for idx, distance in zip(indices, distances) if idx >= 0]
+        rows = self.vector_store.get_rows(
+            [idx for idx, _ in hits], columns=RETRIEVAL_COLUMNS)
 
+        results = []
+        for (idx, distance), doc_data in zip(hits, rows):
             results.append({
                 'index': int(idx),
-                'distance': float(distance),
+                'distance': None if fused else float(distance),
                 # Convert distance to similarity
-                'similarity_score': 1 / (1 + float(distance)),
+                'similarity_score': None if fused else 1 / (1 + float(distance)),
+                'rrf_score': float(distance) if fused else None,
                 'data': doc_data,
-                'text': text
+                'text': self.vector_store.get_text(idx)
             })
 
         return results
 
+    def _retrieve_similar_documents(self, query_text, top_k=5, filters=None, mode='vector'):
+        """
+        Retrieve the most similar documents from the vector store.
+
+        Args:
+            query_text: User query
+            top_k: Number of documents to retrieve
+            filters: Metadata filters, e.g. {'Product_x': '...',
+                'Answer_Type': ['KB', 'Script']}; only matching documents
+                are searched
+            mode: 'vector' (embedding search), 'hybrid' (embedding + BM25
+                keyword search, fused; opt-in) or 'lexical' (BM25 only, no
+                embedding call). If the embedding call fails, retrieval
+                falls back to 'lexical'.
+
+        A query that is only ticket numbers, Script_IDs or KB_Article_IDs
+        is answered by direct lookup, without an embedding call.
+        """
+        routed = route_query(self.vector_store, query_text, columns=RETRIEVAL_COLUMNS)
+        if routed is not None:
+            return routed
+
+        query_embedding = None
+        if mode != 'lexical':
+            try:
+                query_embedding = self._create_query_embedding(query_text)
+            except APIError as e:
+                print(f"⚠ Embedding failed ({e}); using keyword search only")
+                mode = 'lexical'
+
+        if mode == 'vector':
+            distances, indices = self.vector_store.search(
+                query_embedding, top_k, filters=filters)
+            return self._build_documents(indices[0], distances[0])
+
+        scores, indices = self.vector_store.hybrid_search(
+            query_embedding, [query_text], top_k, filters=filters, mode=mode)
+        return self._build_documents(indices[0], scores[0], fused=True)
+
     def _generate_llm_response(self, query, retrieved_docs):
         """
         Generate a response using LLM based on retrieved context.
@@ -202,13 +326,104 @@ Respond ONLY with the JSON object, no other text."""
             return result
         except json.JSONDecodeError:
             # Fallback if JSON parsing fails
-            return {
-                "score": 50,
-                "relevancy_points": 20,
-                "accuracy_points": 20,
-                "completeness_points": 10,
-                "reasoning": "Unable to parse judge response"
-            }
+            return dict(UNPARSED_JUDGE_RESULT)
+
+    def _calculate_relevancy_scores_batched(self, query, generated_response, resolutions):
+        """
+        Score every resolution in one LLM-as-judge call.
+
+        Sends the query and generated response once with all resolutions,
+        using the same rubric as _calculate_relevancy_score, and asks for
+        a structured list of score objects.
+
+        Args:
+            query: Original user query
+            generated_response: LLM-generated response
+            resolutions: Actual resolutions of the retrieved tickets
+
+        Returns:
+            List of dictionaries with score (0-100) and reasoning, one per
+            resolution, in order
+        """
+        documents = "\n\n".join(
+            f"DOCUMENT {i} RESOLUTION: {resolution}"
+            for i, resolution in enumerate(resolutions, 1))
+
+        judge_prompt = f"""You are an expert judge evaluating the quality and relevancy of a generated support response.
+
+USER QUERY: {query}
+
+GENERATED RESPONSE: {generated_response}
+
+ACTUAL RESOLUTIONS OF {len(resolutions)} RETRIEVED TICKETS:
+
+{documents}
+
+Evaluate the generated response against each document's resolution separately, on these criteria:
+1. Relevancy: How well does it address the user's query? (0-40 points)
+2. Accuracy: How closely does it match that document's resolution? (0-40 points)
+3. Completeness: Does it provide actionable information? (0-20 points)
+
+Return one score object per document, with its document number, "score" (total 0-100), "relevancy_points", "accuracy_points", "completeness_points" and a brief "reasoning"."""
+
+        response = self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You are an expert evaluator. Score every document independently."},
+                {"role": "user", "content": judge_prompt}
+            ],
+            response_format={"type": "json_schema", "json_schema": BATCHED_JUDGE_SCHEMA},
+            temperature=0.1,
+            max_tokens=300 * len(resolutions)
+        )
+
+        try:
+            scores = json.loads(response.choices[0].message.content)['scores']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            scores = []
+        by_document = {score.get('document'): score for score in scores
+                       if isinstance(score, dict)}
+        results = []
+        for i in range(1, len(resolutions) + 1):
+            score = by_document.get(i)
+            if score is None:
+                # Fallback if the judge skipped this document
+                results.append(dict(UNPARSED_JUDGE_RESULT))
+                continue
+            score = dict(score)
+            score.pop('document', None)
+            results.append(score)
+        return results
+
+    def _score_documents(self, query, generated_response, retrieved_docs,
+                         concurrency=DEFAULT_JUDGE_CONCURRENCY, judge_mode=DEFAULT_JUDGE_MODE):
+        """
+        Judge every retrieved document's resolution.
+
+        Args:
+            query: Original user query
+            generated_response: LLM-generated response
+            retrieved_docs: Documents to score
+            concurrency: Per-document judge calls in flight at once
+                (1: sequential)
+            judge_mode: 'per-document' (one call per document, run
+                concurrently) or 'batched' (one call for all documents)
+
+        Returns:
+            List of relevancy results, in retrieved_docs order
+        """
+        if judge_mode not in JUDGE_MODES:
+            raise ValueError(f"Unknown judge mode: {judge_mode}")
+        resolutions = [doc['data'].get('Resolution', 'N/A') for doc in retrieved_docs]
+        if judge_mode == 'batched' and resolutions:
+            return self._calculate_relevancy_scores_batched(
+                query, generated_response, resolutions)
+        score = lambda resolution: self._calculate_relevancy_score(
+            query, generated_response, resolution)
+        if concurrency <= 1 or len(resolutions) <= 1:
+            return [score(resolution) for resolution in resolutions]
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(resolutions))) as executor:
+            return list(executor.map(score, resolutions))
 
     def _format_output(self, query, retrieved_doc, generated_response, relevancy_result, new_ticket_id):
         """
@@ -272,6 +487,7 @@ Respond ONLY with the JSON object, no other text."""
                 "metadata": {
                     "similarity_score": retrieved_doc['similarity_score'],
                     "distance": retrieved_doc['distance'],
+                    "rrf_score": retrieved_doc.get('rrf_score'),
                     "priority": str(data.get('Priority', 'N/A')),
                     "sentiment": str(data.get('Sentiment', 'N/A')),
                     "channel": str(data.get('Channel', 'N/A'))
@@ -281,7 +497,9 @@ Respond ONLY with the JSON object, no other text."""
 
         return output
 
-    def classify_query(self, query, top_k=3, return_all=False):
+    def classify_query(self, query, top_k=3, return_all=False, filters=None, mode='vector',
+                       judge_concurrency=DEFAULT_JUDGE_CONCURRENCY,
+                       judge_mode=DEFAULT_JUDGE_MODE):
         """
         Main classification method: retrieve, generate, and score.
 
@@ -289,6 +507,12 @@ Respond ONLY with the JSON object, no other text."""
             query: User query text
             top_k: Number of similar documents to retrieve
             return_all: If True, return results for all top_k documents
+            filters: Metadata filters restricting retrieval, e.g.
+                {'Product_x': '...', 'Answer_Type': ['KB', 'Script']}
+            mode: Retrieval mode: 'vector', 'hybrid' or 'lexical'
+            judge_concurrency: Relevancy judge calls run at once
+            judge_mode: 'per-document' (one judge call per document) or
+                'batched' (one call scoring all documents)
 
         Returns:
             List of formatted results (or single result if return_all=False)
@@ -298,6 +522,9 @@ Respond ONLY with the JSON object, no other text."""
         print(f"{'='*80}")
         print(f"Query: {query}")
         print(f"Top K: {top_k}")
+        print(f"Retrieval: {mode}")
+        if filters:
+            print(f"Filters: {filters}")
         print(f"{'='*80}\n")
 
         # Generate new ticket ID
@@ -306,7 +533,8 @@ Respond ONLY with the JSON object, no other text."""
 
         # Step 1: Retrieve similar documents
         print("Step 1: Retrieving similar documents...")
-        retrieved_docs = self._retrieve_similar_documents(query, top_k)
+        retrieved_docs = self._retrieve_similar_documents(
+            query, top_k, filters=filters, mode=mode)
         print(f"✓ Retrieved {len(retrieved_docs)} documents\n")
 
         # Step 2: Generate LLM response
@@ -316,18 +544,16 @@ Respond ONLY with the JSON object, no other text."""
 
         # Step 3: Score each retrieved document
         print("Step 3: Calculating relevancy scores (LLM-as-judge)...")
-        results = []
-
-        for i, doc in enumerate(retrieved_docs, 1):
-            print(f"  Scoring document {i}/{len(retrieved_docs)}...")
-
-            resolution = doc['data'].get('Resolution', 'N/A')
-            relevancy_result = self._calculate_relevancy_score(
-                query,
-                generated_response,
-                resolution
-            )
+        if judge_mode == 'batched':
+            print(f"  Scoring {len(retrieved_docs)} documents in one call...")
+        else:
+            print(f"  Scoring {len(retrieved_docs)} documents "
+                  f"({min(judge_concurrency, len(retrieved_docs))} concurrent)...")
+        relevancy_results = self._score_documents(
+            query, generated_response, retrieved_docs, judge_concurrency, judge_mode)
 
+        results = []
+        for doc, relevancy_result in zip(retrieved_docs, relevancy_results):
             formatted_output = self._format_output(
                 query,
                 doc,
@@ -351,25 +577,49 @@ def main():
     """CLI entry point for classification agent."""
     if len(sys.argv) < 2:
         print(
-            "Usage: python classification_agent.py 'your query here' [top_k] [--all]")
+            "Usage: python classification_agent.py 'your query here' [top_k] [--all] [filters]")
         print("\nExamples:")
         print("  python classification_agent.py 'login issues' 3")
         print("  python classification_agent.py 'certification problems' 5 --all")
+        print("  python classification_agent.py 'date advance fails' 3 --answer-type=KB,Script")
+        print("  python classification_agent.py 'error 0x80070005 on posting' 3 --mode=lexical")
         print("\nOptions:")
         print("  top_k: Number of similar documents to retrieve (default: 1)")
         print("  --all: Return results for all top_k documents (default: top 1 only)")
+        print("  --product=NAME, --category=NAME, --answer-type=NAME[,NAME...]:")
+        print("      Only search documents with matching metadata")
+        print("  --mode=vector|hybrid|lexical: Embedding search (default), embedding +")
+        print("      keyword search fused, or keyword search only")
+        print(f"  --judge-concurrency=N: Relevancy judge calls run at once "
+              f"(default: {DEFAULT_JUDGE_CONCURRENCY})")
+        print("  --judge=per-document|batched: One judge call per document (default)")
+        print("      or one call scoring all documents")
         sys.exit(1)
 
-    query = sys.argv[1]
-    top_k = int(sys.argv[2]) if len(
-        sys.argv) > 2 and sys.argv[2] != '--all' else 1
+    positional = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    query = positional[0]
+    top_k = int(positional[1]) if len(positional) > 1 else 1
     return_all = '--all' in sys.argv
+    filters = parse_filter_args(sys.argv[1:])
+    mode = parse_mode_arg(sys.argv[1:])
+    judge_concurrency = DEFAULT_JUDGE_CONCURRENCY
+    judge_mode = DEFAULT_JUDGE_MODE
+    for arg in sys.argv[1:]:
+        if arg.startswith('--judge-concurrency='):
+            judge_concurrency = int(arg.split('=', 1)[1])
+        elif arg.startswith('--judge='):
+            judge_mode = arg.split('=', 1)[1]
+    if judge_mode not in JUDGE_MODES:
+        print(f"Unknown judge mode: {judge_mode} (choose from {', '.join(JUDGE_MODES)})")
+        sys.exit(1)
 
     # Initialize agent
     agent = ClassificationAgent()
 
     # Classify query
-    results = agent.classify_query(query, top_k=top_k, return_all=return_all)
+    results = agent.classify_query(
+        query, top_k=top_k, return_all=return_all, filters=filters, mode=mode,
+        judge_concurrency=judge_concurrency, judge_mode=judge_mode)
 
     # Pretty print results
     print(f"\n{'='*80}")
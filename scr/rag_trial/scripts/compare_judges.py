@@ -0,0 +1,144 @@
+"""
+Judge Mode Comparison
+Scores the same retrieved documents with the per-document judge (one
+gpt-4o-mini call per document) and the batched judge (one structured-output
+call per query), and reports score agreement, requests, tokens and latency
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# Add parent directory to path for db_scripts import
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from classification_agent import ClassificationAgent, DEFAULT_JUDGE_CONCURRENCY, JUDGE_MODES
+from vectorstore import RETRIEVAL_MODES
+
+DEFAULT_QUERIES = [
+    "date advance fails with backend voucher reference invalid",
+    "annual recertification missing household income",
+    "HAP voucher total incorrect after retroactive adjustment",
+    "TRACS file rejected by contract administrator",
+    "user cannot log in after password reset",
+]
+
+
+class UsageRecorder:
+    """Client wrapper counting chat completion requests and tokens."""
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        response = self._client.chat.completions.create(**kwargs)
+        usage = getattr(response, 'usage', None)
+        with self._lock:
+            self.requests += 1
+            self.tokens += getattr(usage, 'total_tokens', 0) or 0
+        return response
+
+
+def parse_args(argv=None):
+    """Parse comparison command line options."""
+    parser = argparse.ArgumentParser(
+        description="Compare per-document and batched LLM-as-judge relevancy scores")
+    parser.add_argument('--queries', default=None,
+                        help="File with one query per line (default: a few built-in "
+                             "support queries)")
+    parser.add_argument('--k', type=int, default=5,
+                        help="Documents retrieved and scored per query (default: 5)")
+    parser.add_argument('--mode', choices=RETRIEVAL_MODES, default='vector',
+                        help="Retrieval mode (default: vector)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_JUDGE_CONCURRENCY,
+                        help="Per-document judge calls in flight at once "
+                             f"(default: {DEFAULT_JUDGE_CONCURRENCY})")
+    return parser.parse_args(argv)
+
+
+def rank_agreement(a, b):
+    """Spearman correlation of two score lists (None when either is constant)."""
+    if len(a) < 2 or np.std(a) == 0 or np.std(b) == 0:
+        return None
+    ranks_a = np.argsort(np.argsort(a))
+    ranks_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = DEFAULT_QUERIES
+
+    agent = ClassificationAgent()
+    client = agent.client
+    totals = {mode: {'requests': 0, 'tokens': 0, 'seconds': 0.0} for mode in JUDGE_MODES}
+    diffs, agreements, same_top = [], [], []
+
+    for n, query in enumerate(queries, 1):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            docs = agent._retrieve_similar_documents(query, top_k=args.k, mode=args.mode)
+            if not docs:
+                continue
+            generated_response = agent._generate_llm_response(query, docs)
+
+        scores = {}
+        for judge_mode in JUDGE_MODES:
+            recorder = UsageRecorder(client)
+            agent.client = recorder
+            start = time.perf_counter()
+            try:
+                results = agent._score_documents(
+                    query, generated_response, docs, args.concurrency, judge_mode)
+            finally:
+                agent.client = client
+            totals[judge_mode]['seconds'] += time.perf_counter() - start
+            totals[judge_mode]['requests'] += recorder.requests
+            totals[judge_mode]['tokens'] += recorder.tokens
+            scores[judge_mode] = [float(result.get('score', 0)) for result in results]
+
+        per_doc, batched = scores['per-document'], scores['batched']
+        diffs.extend(abs(a - b) for a, b in zip(per_doc, batched))
+        agreement = rank_agreement(per_doc, batched)
+        if agreement is not None:
+            agreements.append(agreement)
+        same_top.append(int(np.argmax(per_doc)) == int(np.argmax(batched)))
+        print(f"[{n}/{len(queries)}] {query[:60]}")
+        print(f"    per-document: {per_doc}")
+        print(f"    batched:      {batched}")
+
+    if not same_top:
+        print("⚠ No documents retrieved for any query")
+        return
+
+    print(f"\n{'Judge mode':<13}  {'Requests':>8}  {'Tokens':>8}  {'s/query':>8}")
+    print("-" * 44)
+    for judge_mode, total in totals.items():
+        print(f"{judge_mode:<13}  {total['requests']:>8}  {total['tokens']:>8}  "
+              f"{total['seconds'] / len(same_top):>8.2f}")
+
+    print(f"\nAgreement over {len(same_top)} queries, {len(diffs)} documents:")
+    print(f"  Mean absolute score difference: {np.mean(diffs):.1f} points")
+    print(f"  Scores within 10 points: {np.mean([d <= 10 for d in diffs]):.1%}")
+    if agreements:
+        print(f"  Mean rank correlation (Spearman): {np.mean(agreements):.3f}")
+    print(f"  Same top-scored document: {np.mean(same_top):.1%}")
+
+
+if __name__ == "__main__":
+    main()
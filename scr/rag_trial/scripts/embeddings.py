@@ -0,0 +1,1051 @@
+"""
+Embedding Helpers
+Create embeddings the way a vector store expects them: the model it was
+built with, the same output dimensions and the same PCA reduction; a
+persistent cache so no text is embedded twice; and a deterministic
+offline embedder for benchmarks
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import inspect
+import sqlite3
+import hashlib
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from tqdm import tqdm
+
+# Exact token counts when tiktoken is installed (optional)
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# CPU-local embedding models, for the 'local' provider (optional)
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+sys.path.append(str(Path(__file__).parent))
+
+from vectorstore import DEFAULT_VECTOR_STORE_PATH
+
+# Embedding cache shared by ingest, self-healing updates and queries
+EMBEDDING_CACHE_FILENAME = "embedding_cache.db"
+DEFAULT_CACHE_MAX_MB = 512
+# Evict down to this fraction of the limit, so eviction is not run on every put
+CACHE_EVICT_TARGET = 0.9
+# Variables per SQLite statement stay below the default limit
+CACHE_LOOKUP_CHUNK = 500
+# A hit refreshes its entry's last-used time only if it is older than this
+CACHE_TOUCH_INTERVAL = 60
+
+# Concurrent embedding requests; budgets default to the OpenAI tier-1
+# limits for text-embedding-3-small and can be raised per account
+DEFAULT_EMBED_CONCURRENCY = int(os.getenv('OPENAI_EMBED_CONCURRENCY', 8))
+DEFAULT_EMBED_RPM = int(os.getenv('OPENAI_EMBED_RPM', 3000))
+DEFAULT_EMBED_TPM = int(os.getenv('OPENAI_EMBED_TPM', 1000000))
+MAX_RATE_LIMIT_RETRIES = 6
+
+# Concurrent single-query embeddings are held this long and sent together
+DEFAULT_COALESCE_WAIT_MS = float(os.getenv('QUERY_EMBED_COALESCE_MS', 5))
+
+# OpenAI embeddings request limits: tokens per input text, inputs and
+# tokens per request
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300000
+# Texts over MAX_INPUT_TOKENS are cut to their first window, or embedded
+# in windows whose embeddings are averaged
+OVERLENGTH_MODES = ('truncate', 'chunk')
+# Token estimate without tiktoken; conservative (English averages ~4
+# characters per token) so estimated limits are not exceeded
+CHARS_PER_TOKEN = 3
+
+# Embedding providers, chosen with EMBEDDING_PROVIDER at ingest. A store
+# records its provider in metadata['model'] ("text-embedding-3-small",
+# "hashing-1536" or "local:<model dir name>"); queries and adds always use
+# the provider the store was built with
+EMBEDDING_PROVIDERS = ('openai', 'hashing', 'local')
+DEFAULT_OPENAI_MODEL = "text-embedding-3-small"
+# Full output size of the OpenAI models, recorded when a store asks the
+# API for shorter vectors
+OPENAI_MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+LOCAL_MODEL_PREFIX = "local:"
+DEFAULT_LOCAL_MODEL_DIR = Path(__file__).parent.parent / "models"
+
+# Deterministic offline embedder (benchmarks and tests without the API)
+HASHING_MODEL = "hashing-1536"
+HASHING_DIMENSION = 1536
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+class HashingEmbeddingClient:
+    """
+    Stand-in for the OpenAI client that embeds text by feature hashing.
+
+    Unigrams and bigrams are hashed (blake2b, so results do not depend on
+    PYTHONHASHSEED) into a signed bag-of-features vector, normalized to
+    unit length like OpenAI embeddings. Texts sharing words are close, so
+    retrieval behaves sensibly, at no cost and with no network. Exposes
+    client.embeddings.create(input=..., model=..., dimensions=...) so it
+    can be passed wherever an OpenAI client is expected.
+    """
+
+    # Hashing is cheaper than a cache lookup
+    cacheable = False
+
+    def __init__(self, dimension=HASHING_DIMENSION):
+        self.dimension = dimension
+        self.embedding_model = f"hashing-{dimension}"
+        self.embeddings = self
+
+    def create(self, input, model=HASHING_MODEL, dimensions=None):
+        """Embed a list of texts; the response mirrors the OpenAI SDK's."""
+        if isinstance(input, str):
+            input = [input]
+        dimension = dimensions or self.dimension
+        return SimpleNamespace(
+            model=model,
+            data=[SimpleNamespace(index=i, embedding=hash_embedding(text, dimension).tolist())
+                  for i, text in enumerate(input)])
+
+
+class LocalEmbeddingClient:
+    """
+    OpenAI-compatible client for a sentence-transformers model on disk.
+
+    Runs on CPU with no network, for air-gapped ingest and queries. The
+    model directory is e.g. a saved all-MiniLM-L6-v2; its embeddings are
+    normalized to unit length like OpenAI's.
+    """
+
+    # Embedding on the local CPU is free and needs no network, so queries
+    # skip the coalescer and embeddings are not written to the cache
+    cacheable = False
+
+    def __init__(self, model_path):
+        if SentenceTransformer is None:
+            raise ImportError(
+                "The local embedding provider requires sentence-transformers "
+                "(pip install sentence-transformers)")
+        self.model_path = Path(model_path)
+        if not self.model_path.exists():
+            raise FileNotFoundError(f"Local embedding model not found at {self.model_path}")
+        self.model = SentenceTransformer(str(self.model_path), device='cpu')
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.embedding_model = f"{LOCAL_MODEL_PREFIX}{self.model_path.name}"
+        self.embeddings = self
+
+    def create(self, input, model=None, dimensions=None):
+        """Embed a list of texts; the response mirrors the OpenAI SDK's."""
+        if isinstance(input, str):
+            input = [input]
+        vectors = self.model.encode(list(input), normalize_embeddings=True,
+                                    convert_to_numpy=True).astype(np.float32)
+        if dimensions:
+            vectors = vectors[:, :dimensions]
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return SimpleNamespace(
+            model=self.embedding_model,
+            data=[SimpleNamespace(index=i, embedding=vector.tolist())
+                  for i, vector in enumerate(vectors)])
+
+
+def model_dimension(client, model):
+    """
+    Full output dimension of an embedding model, without calling it.
+
+    Args:
+        client: Embedding client (hashing and local clients know theirs)
+        model: Model name
+
+    Returns:
+        int: Dimension, or None for an unknown OpenAI model
+    """
+    return getattr(client, 'dimension', None) or OPENAI_MODEL_DIMENSIONS.get(model)
+
+
+def provider_for_model(model):
+    """Embedding provider ('openai', 'hashing' or 'local') recorded as model."""
+    if model.startswith(LOCAL_MODEL_PREFIX):
+        return 'local'
+    if re.fullmatch(r'hashing-\d+', model):
+        return 'hashing'
+    return 'openai'
+
+
+_local_clients = {}
+_local_clients_lock = threading.Lock()
+
+
+def _local_client(model_path):
+    """Load a local model once per process."""
+    key = Path(model_path).resolve()
+    with _local_clients_lock:
+        if key not in _local_clients:
+            _local_clients[key] = LocalEmbeddingClient(key)
+        return _local_clients[key]
+
+
+def create_embedding_client(provider=None, local_model=None):
+    """
+    Create the embedding client for a new store.
+
+    Args:
+        provider: 'openai', 'hashing' or 'local' (default:
+            $EMBEDDING_PROVIDER or 'openai')
+        local_model: Model directory for 'local' (default:
+            $EMBEDDING_LOCAL_MODEL)
+
+    Returns:
+        (client, model): model is the identity to record in metadata['model']
+    """
+    provider = provider or os.getenv('EMBEDDING_PROVIDER', 'openai')
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider {provider!r}; "
+                         f"expected one of {EMBEDDING_PROVIDERS}")
+    if provider == 'hashing':
+        client = HashingEmbeddingClient()
+        return client, client.embedding_model
+    if provider == 'local':
+        local_model = local_model or os.getenv('EMBEDDING_LOCAL_MODEL')
+        if not local_model:
+            raise ValueError("The local embedding provider needs a model directory "
+                             "(--local-model or EMBEDDING_LOCAL_MODEL)")
+        client = _local_client(local_model)
+        return client, client.embedding_model
+
+    # Imported here so offline providers work without the OpenAI SDK
+    from openai import OpenAI
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    return OpenAI(api_key=api_key), DEFAULT_OPENAI_MODEL
+
+
+_embedding_clients = {}
+_embedding_clients_lock = threading.Lock()
+
+
+def get_embedding_client(model, client=None):
+    """
+    Embedding client for a store built with model (its metadata['model']).
+
+    Clients created here are shared per model for the life of the process,
+    so per-call callers (e.g. embed_for_store(None, ...) once per ticket)
+    reuse one HTTP connection pool instead of building a client each time.
+
+    Args:
+        model: Store's embedding model / provider identity
+        client: Client the caller already has; an OpenAI client is reused
+            for OpenAI-built stores, a provider client must match model
+
+    Returns:
+        Client with embeddings.create()
+
+    Raises:
+        ValueError: If client embeds with a different provider or model
+    """
+    provider = provider_for_model(model)
+    if client is not None:
+        client_model = getattr(client, 'embedding_model', None)
+        if client_model is not None and client_model != model:
+            raise ValueError(
+                f"Embedding client produces {client_model} embeddings but the vector "
+                f"store was built with {model}; embeddings from different providers "
+                f"cannot be mixed")
+        if client_model is not None or provider == 'openai':
+            return client
+
+    with _embedding_clients_lock:
+        client = _embedding_clients.get(model)
+        if client is None:
+            client = _new_embedding_client(model, provider)
+            _embedding_clients[model] = client
+    return client
+
+
+def _new_embedding_client(model, provider):
+    """Create the client for get_embedding_client()."""
+    if provider == 'hashing':
+        return HashingEmbeddingClient(int(model.split('-')[1]))
+    if provider == 'local':
+        name = model[len(LOCAL_MODEL_PREFIX):]
+        local_model = os.getenv('EMBEDDING_LOCAL_MODEL')
+        if not local_model or Path(local_model).name != name:
+            local_model = Path(os.getenv('EMBEDDING_LOCAL_MODEL_DIR', DEFAULT_LOCAL_MODEL_DIR)) / name
+        return _local_client(local_model)
+    return create_embedding_client('openai')[0]
+
+
+def hash_embedding(text, dimension=HASHING_DIMENSION):
+    """
+    Feature-hashing embedding of one text.
+
+    Args:
+        text: Text to embed
+        dimension: Output dimension
+
+    Returns:
+        np.ndarray of shape (dimension,), unit length (zero for empty text)
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(dimension, dtype=np.float32)
+    for feature in features:
+        h = int.from_bytes(
+            hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+        vector[h % dimension] += 1.0 if (h >> 63) else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by sha256(model, dimensions, text).
+
+    Float32 vectors are stored as blobs in a SQLite table. Hits refresh a
+    last-used timestamp (at most every CACHE_TOUCH_INTERVAL seconds per
+    entry), and when the table outgrows max_bytes the least recently used
+    entries are evicted. The total size is kept up to date by triggers,
+    so puts never scan the table. WAL journaling lets any number of
+    processes read and write the same cache file; each thread keeps one
+    connection open.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        """
+        Open (and create if needed) the cache.
+
+        Args:
+            path: SQLite file (default: $EMBEDDING_CACHE_PATH or
+                vector_store/embedding_cache.db)
+            max_bytes: Size bound for cached vectors (default:
+                $EMBEDDING_CACHE_MAX_MB or 512 MB)
+        """
+        self.path = Path(path or os.getenv('EMBEDDING_CACHE_PATH')
+                         or Path(DEFAULT_VECTOR_STORE_PATH) / EMBEDDING_CACHE_FILENAME)
+        if max_bytes is None:
+            max_bytes = float(os.getenv('EMBEDDING_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB)) * 1024 * 1024
+        self.max_bytes = int(max_bytes)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+
+        conn = self._connect()
+        # One transaction, so the size counter starts in step with the table
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    dimension INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used "
+                         "ON embeddings(last_used)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_info (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                INSERT OR IGNORE INTO cache_info (key, value)
+                SELECT 'bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS embeddings_bytes_insert AFTER INSERT ON embeddings
+                BEGIN
+                    UPDATE cache_info SET value = value + LENGTH(NEW.vector) WHERE key = 'bytes';
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS embeddings_bytes_delete AFTER DELETE ON embeddings
+                BEGIN
+                    UPDATE cache_info SET value = value - LENGTH(OLD.vector) WHERE key = 'bytes';
+                END
+            """)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _connect(self):
+        """Get this thread's connection (sqlite3 connections are per-thread)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model, dimensions, text):
+        """Content address of one text's embedding."""
+        return hashlib.sha256(f"{model}\0{dimensions or ''}\0{text}".encode()).digest()
+
+    def get_many(self, model, dimensions, texts):
+        """
+        Look up cached embeddings.
+
+        Args:
+            model: Embedding model
+            dimensions: Requested output dimensions (None: full)
+            texts: Texts to look up
+
+        Returns:
+            dict: Position in texts -> np.ndarray, for the hits only
+        """
+        keys = [self.key(model, dimensions, text) for text in texts]
+        found = {}
+        stale = []
+        now = time.time()
+        conn = self._connect()
+        for i in range(0, len(keys), CACHE_LOOKUP_CHUNK):
+            chunk = list(set(keys[i:i + CACHE_LOOKUP_CHUNK]))
+            placeholders = ','.join('?' * len(chunk))
+            for key, vector, last_used in conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})",
+                    chunk):
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+                if now - last_used >= CACHE_TOUCH_INTERVAL:
+                    stale.append(key)
+        # Recency only matters at eviction granularity, so a hot entry is
+        # written at most once per CACHE_TOUCH_INTERVAL
+        if stale:
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                             [(now, key) for key in stale])
+            conn.commit()
+        return {i: found[key] for i, key in enumerate(keys) if key in found}
+
+    def put_many(self, model, dimensions, texts, embeddings):
+        """
+        Store embeddings, then evict least recently used entries if the
+        cache is over its size bound.
+
+        Args:
+            model: Embedding model
+            dimensions: Requested output dimensions (None: full)
+            texts: Embedded texts
+            embeddings: Array of shape (len(texts), dimension)
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        now = time.time()
+        conn = self._connect()
+        # A key is a content address: an existing entry already holds the
+        # same vector, so it is kept as is
+        conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, model, dimension, vector, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(self.key(model, dimensions, text), model, embedding.shape[0],
+              embedding.tobytes(), now)
+             for text, embedding in zip(texts, embeddings)])
+        conn.commit()
+        self._evict(conn)
+
+    def total_bytes(self):
+        """Bytes of cached vectors (maintained by triggers, no table scan)."""
+        return self._connect().execute(
+            "SELECT value FROM cache_info WHERE key = 'bytes'").fetchone()[0]
+
+    def _evict(self, conn):
+        """Drop least recently used entries until under CACHE_EVICT_TARGET of max_bytes."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * CACHE_EVICT_TARGET)
+        cursor = conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        evict = []
+        for key, size in cursor:
+            evict.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", evict)
+        conn.commit()
+
+    def stats(self):
+        """Entries and bytes per model."""
+        return {model: {'entries': n, 'bytes': size}
+                for model, n, size in self._connect().execute(
+                    "SELECT model, COUNT(*), SUM(LENGTH(vector)) FROM embeddings "
+                    "GROUP BY model")}
+
+    def clear(self):
+        """Remove every cached embedding."""
+        conn = self._connect()
+        conn.execute("DELETE FROM embeddings")
+        conn.commit()
+        conn.execute("VACUUM")
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path=None):
+    """
+    Get the shared EmbeddingCache for a file, opening it on first use.
+
+    Args:
+        path: Cache file (default: see EmbeddingCache)
+
+    Returns:
+        EmbeddingCache
+    """
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = EmbeddingCache(path)
+            _caches[path] = cache
+    return cache
+
+
+_tokenizers = {}
+
+
+def get_tokenizer(model):
+    """
+    tiktoken encoding for a model, or None if tiktoken is not installed or
+    its encoding files cannot be loaded (e.g. offline).
+    """
+    if model not in _tokenizers:
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                print(f"⚠ tiktoken encoding unavailable ({e.__class__.__name__}); "
+                      f"estimating tokens from text length")
+        _tokenizers[model] = encoding
+    return _tokenizers[model]
+
+
+def count_tokens(text, model=None):
+    """Tokens in a text: exact with tiktoken, otherwise a conservative estimate."""
+    encoding = get_tokenizer(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text, max_tokens, model=None):
+    """
+    Split a text into consecutive windows of at most max_tokens tokens.
+
+    Returns:
+        list: Window texts, in order
+    """
+    encoding = get_tokenizer(model)
+    if encoding is None:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens])
+            for i in range(0, len(tokens), max_tokens)]
+
+
+def pack_batches(token_counts, max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+    """
+    Group inputs, in order, into requests of at most max_inputs inputs and
+    max_tokens tokens.
+
+    Args:
+        token_counts: Tokens of each input (each at most max_tokens)
+        max_inputs: Inputs per request
+        max_tokens: Tokens per request
+
+    Returns:
+        list: Lists of input positions, one per request
+    """
+    batches, current, current_tokens = [], [], 0
+    for i, n_tokens in enumerate(token_counts):
+        if current and (len(current) >= max_inputs or current_tokens + n_tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets for concurrent calls.
+
+    Both are token buckets refilled continuously and holding at most one
+    minute of budget. A 429 response pauses all callers via pause().
+    """
+
+    def __init__(self, rpm=DEFAULT_EMBED_RPM, tpm=DEFAULT_EMBED_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        """Wait until one request of tokens tokens fits both budgets, then spend it."""
+        tokens = min(tokens, self.tpm)
+        # Waiters queue on the lock, so budget is granted in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+                    wait = max((1 - self._requests) * 60 / self.rpm,
+                               (tokens - self._tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller for seconds (after a 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def _retry_after(error, attempt):
+    """Seconds to back off after a 429: the server's Retry-After, else exponential with jitter."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(60, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+async def _embed_batches_async(client, batches, batch_tokens, model, kwargs, concurrency,
+                               limiter, on_batch=None):
+    """
+    Embed batches with up to concurrency requests in flight.
+
+    On a 429 every caller pauses for the back-off and the in-flight limit
+    is halved; it grows back by one after each limit's worth of successes.
+
+    Returns:
+        list: Embeddings per batch, in batch order
+    """
+    results = [None] * len(batches)
+    state = {'limit': concurrency, 'in_flight': 0, 'successes': 0}
+    slots = asyncio.Condition()
+    create = client.embeddings.create
+    is_async = inspect.iscoroutinefunction(create)
+    # A synchronous client's calls run on threads, one per request in flight
+    executor = None if is_async else ThreadPoolExecutor(max_workers=concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def embed(i, batch):
+        tokens = batch_tokens[i]
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            async with slots:
+                await slots.wait_for(lambda: state['in_flight'] < state['limit'])
+                state['in_flight'] += 1
+            try:
+                await limiter.acquire(tokens)
+                if is_async:
+                    response = await create(input=batch, model=model, **kwargs)
+                else:
+                    response = await loop.run_in_executor(executor, functools.partial(
+                        create, input=batch, model=model, **kwargs))
+            except Exception as e:
+                if getattr(e, 'status_code', None) != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    print(f"Error processing batch {i}: {e}")
+                    raise
+                limiter.pause(_retry_after(e, attempt))
+                async with slots:
+                    state['limit'] = max(1, state['limit'] // 2)
+                    state['successes'] = 0
+                continue
+            finally:
+                async with slots:
+                    state['in_flight'] -= 1
+                    slots.notify_all()
+
+            async with slots:
+                state['successes'] += 1
+                if state['limit'] < concurrency and state['successes'] >= state['limit']:
+                    state['limit'] += 1
+                    state['successes'] = 0
+                    slots.notify_all()
+            results[i] = np.array([item.embedding for item in response.data], dtype=np.float32)
+            if on_batch:
+                on_batch(i, results[i])
+            return
+
+    tasks = [asyncio.create_task(embed(i, batch)) for i, batch in enumerate(batches)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+    return results
+
+
+def _run_coroutine(coroutine):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    asyncio.run() refuses to start while this thread's event loop is
+    running (create_embeddings called from async code, e.g. a web
+    handler or a notebook), so the coroutine then gets its own loop in a
+    worker thread, and this call blocks until it is done.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-loop") as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def create_embeddings(client, texts, model, dimensions=None, batch_size=MAX_BATCH_INPUTS,
+                      cache=None, progress=False, concurrency=DEFAULT_EMBED_CONCURRENCY,
+                      rpm=DEFAULT_EMBED_RPM, tpm=DEFAULT_EMBED_TPM,
+                      max_batch_tokens=MAX_BATCH_TOKENS, overlength='chunk'):
+    """
+    Embed texts with the OpenAI embeddings API.
+
+    Texts found in the embedding cache are not sent, nor are repeats
+    within texts; new embeddings are added to the cache. The rest are
+    packed in order into requests of at most batch_size texts and
+    max_batch_tokens tokens. A text over the model's MAX_INPUT_TOKENS is
+    truncated, or (overlength='chunk') embedded in token windows whose
+    embeddings are averaged by token count and re-normalized, so one
+    long row never fails a request. When there is more than one request,
+    up to concurrency are kept in flight (asyncio) within the rpm/tpm
+    budgets, backing off on 429 responses; the output order is always
+    the input order.
+
+    Args:
+        client: OpenAI or AsyncOpenAI client
+        texts: Texts to embed
+        model: Embedding model
+        dimensions: Output dimensions to request (text-embedding-3
+            models only); None for the model's full output
+        batch_size: Maximum texts per API call
+        cache: EmbeddingCache to use (default: the shared cache); False
+            disables caching
+        progress: Show a progress bar over the API batches
+        concurrency: Maximum requests in flight (1: one after another)
+        rpm: Requests-per-minute budget
+        tpm: Tokens-per-minute budget
+        max_batch_tokens: Maximum tokens per API call
+        overlength: 'truncate' or 'chunk'
+
+    Returns:
+        np.ndarray of shape (len(texts), dimension)
+    """
+    if overlength not in OVERLENGTH_MODES:
+        raise ValueError(f"overlength must be one of {OVERLENGTH_MODES}")
+    texts = list(texts)
+    if cache is None and getattr(client, 'cacheable', True):
+        cache = get_embedding_cache()
+
+    cached = {}
+    if cache:
+        try:
+            cached = cache.get_many(model, dimensions, texts)
+        except sqlite3.Error as e:
+            print(f"⚠ Embedding cache unavailable: {e}")
+            cache = None
+
+    # Embed each distinct uncached text once, over-length ones as windows
+    missing = list(dict.fromkeys(t for i, t in enumerate(texts) if i not in cached))
+    pieces, owners, piece_tokens = [], [], []
+    n_overlength = 0
+    for j, text in enumerate(missing):
+        n_tokens = count_tokens(text, model)
+        if n_tokens <= MAX_INPUT_TOKENS:
+            windows, window_tokens = [text], [n_tokens]
+        else:
+            n_overlength += 1
+            windows = split_by_tokens(text, MAX_INPUT_TOKENS, model)
+            if overlength == 'truncate':
+                windows = windows[:1]
+            window_tokens = [count_tokens(window, model) for window in windows]
+        pieces.extend(windows)
+        owners.extend([j] * len(windows))
+        piece_tokens.extend(window_tokens)
+    if n_overlength:
+        print(f"⚠ {n_overlength} texts over {MAX_INPUT_TOKENS} tokens "
+              f"{'truncated' if overlength == 'truncate' else 'embedded in chunks'}")
+
+    batches = pack_batches(piece_tokens, batch_size, max_batch_tokens)
+    batch_texts = [[pieces[p] for p in batch] for batch in batches]
+    batch_tokens = [sum(piece_tokens[p] for p in batch) for batch in batches]
+    n_pieces = np.bincount(owners, minlength=len(missing)) if owners else []
+    kwargs = {'dimensions': dimensions} if dimensions else {}
+    bar = tqdm(total=len(batches), desc="Creating embeddings") if progress else None
+
+    def on_batch(i, batch_embeddings):
+        # Cache as we go, so a failed run keeps the batches it paid for
+        # (texts embedded in chunks are cached once all chunks are done)
+        if cache:
+            whole = [(missing[owners[p]], embedding)
+                     for p, embedding in zip(batches[i], batch_embeddings)
+                     if n_pieces[owners[p]] == 1]
+            try:
+                if whole:
+                    cache.put_many(model, dimensions, *zip(*whole))
+            except sqlite3.Error as e:
+                print(f"⚠ Could not update the embedding cache: {e}")
+        if bar is not None:
+            bar.update(1)
+
+    try:
+        if (len(batches) > 1 and concurrency > 1) or inspect.iscoroutinefunction(
+                client.embeddings.create):
+            results = _run_coroutine(_embed_batches_async(
+                client, batch_texts, batch_tokens, model, kwargs, concurrency,
+                RateLimiter(rpm, tpm), on_batch))
+        else:
+            results = []
+            for i, batch in enumerate(batch_texts):
+                try:
+                    response = client.embeddings.create(input=batch, model=model, **kwargs)
+                except Exception as e:
+                    print(f"Error processing batch {i}: {e}")
+                    raise
+                results.append(np.array([item.embedding for item in response.data],
+                                        dtype=np.float32))
+                on_batch(i, results[-1])
+    finally:
+        if bar is not None:
+            bar.close()
+
+    # Reassemble per text; chunked texts get the token-weighted mean
+    piece_embeddings = {}
+    for batch, batch_embeddings in zip(batches, results):
+        piece_embeddings.update(zip(batch, batch_embeddings))
+    new = {}
+    chunked = []
+    for p, j in enumerate(owners):
+        text = missing[j]
+        if n_pieces[j] == 1:
+            new[text] = piece_embeddings[p]
+        elif text not in new:
+            ids = range(p, p + n_pieces[j])
+            weights = np.array([piece_tokens[q] for q in ids], dtype=np.float32)
+            mean = np.average([piece_embeddings[q] for q in ids], axis=0, weights=weights)
+            new[text] = (mean / (np.linalg.norm(mean) or 1)).astype(np.float32)
+            chunked.append(text)
+    if cache and chunked:
+        try:
+            cache.put_many(model, dimensions, chunked, [new[text] for text in chunked])
+        except sqlite3.Error as e:
+            print(f"⚠ Could not update the embedding cache: {e}")
+
+    if progress:
+        print(f"Embedded {len(missing)} texts in {len(batches)} requests"
+              + (f"; {len(cached)} of {len(texts)} texts were cached" if cache else ""))
+    return np.array([cached[i] if i in cached else new[text] for i, text in enumerate(texts)],
+                    dtype=np.float32)
+
+
+def embed_for_store(client, store, texts, batch_size=MAX_BATCH_INPUTS):
+    """
+    Embed query or document texts for searching / adding to a vector store.
+
+    The store's own provider is always used (see get_embedding_client),
+    so a store is never searched or extended with another model's vectors.
+
+    Args:
+        client: OpenAI client to reuse for OpenAI-built stores, a provider
+            client, or None
+        store: VectorStore the embeddings are for
+        texts: Texts to embed
+        batch_size: Maximum texts per API call
+
+    Returns:
+        np.ndarray of shape (len(texts), store.dimension)
+    """
+    client = get_embedding_client(store.model, client)
+    embeddings = create_embeddings(
+        client, texts, store.model, store.embedding_dimensions, batch_size)
+    return store.reduce_embeddings(embeddings)
+
+
+class EmbeddingCoalescer:
+    """
+    Micro-batches concurrent query embeddings into one API call.
+
+    The first caller to arrive becomes the leader: it waits up to max_wait
+    seconds (less if max_batch texts queue up), takes every text queued by
+    then and embeds them with one create_embeddings call; the other
+    callers block on futures until their rows come back. Under high QPS
+    this turns N one-item requests into one N-item request. Cached texts
+    return at once without queuing.
+    """
+
+    def __init__(self, client, model, dimensions=None,
+                 max_wait=DEFAULT_COALESCE_WAIT_MS / 1000, max_batch=MAX_BATCH_INPUTS):
+        """
+        Args:
+            client: Embedding client
+            model: Embedding model
+            dimensions: Output dimensions to request (None: full)
+            max_wait: Seconds the leader waits for more texts
+            max_batch: Texts that trigger a flush without waiting
+        """
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.stats = {'texts': 0, 'cached': 0, 'flushes': 0}
+        self._pending = []
+        self._leader = False
+        self._full = threading.Event()
+        self._lock = threading.Lock()
+
+    def embed(self, texts):
+        """
+        Embed texts, sharing an API call with concurrent callers.
+
+        Returns:
+            np.ndarray of shape (len(texts), dimension)
+        """
+        texts = list(texts)
+        cache = get_embedding_cache() if getattr(self.client, 'cacheable', True) else None
+        cached = {}
+        if cache:
+            try:
+                cached = cache.get_many(self.model, self.dimensions, texts)
+            except sqlite3.Error as e:
+                print(f"⚠ Embedding cache unavailable: {e}")
+
+        futures = {}
+        with self._lock:
+            self.stats['texts'] += len(texts)
+            self.stats['cached'] += len(cached)
+            for i, text in enumerate(texts):
+                if i not in cached:
+                    futures[i] = Future()
+                    self._pending.append((text, futures[i]))
+            leader = bool(futures) and not self._leader
+            if leader:
+                self._leader = True
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+
+        if leader:
+            self._full.wait(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leader = False
+                self._full.clear()
+                self.stats['flushes'] += 1
+            self._flush(batch)
+
+        return np.array([cached[i] if i in cached else futures[i].result()
+                         for i in range(len(texts))], dtype=np.float32)
+
+    def _flush(self, batch):
+        """Embed the queued texts in one call and hand each caller its row."""
+        try:
+            embeddings = create_embeddings(
+                self.client, [text for text, _ in batch], self.model, self.dimensions)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+def get_embedding_coalescer(client, model, dimensions=None):
+    """
+    Get the shared EmbeddingCoalescer for a model, creating it on first use.
+
+    Args:
+        client: Embedding client (later callers share the first one's)
+        model: Embedding model
+        dimensions: Output dimensions to request (None: full)
+
+    Returns:
+        EmbeddingCoalescer
+    """
+    key = (model, dimensions)
+    with _coalescers_lock:
+        coalescer = _coalescers.get(key)
+        if coalescer is None:
+            coalescer = EmbeddingCoalescer(client, model, dimensions)
+            _coalescers[key] = coalescer
+    return coalescer
+
+
+def embed_query_for_store(client, store, text):
+    """
+    Embed one query for a vector store, coalesced with concurrent queries.
+
+    Args:
+        client: See embed_for_store
+        store: VectorStore the query searches
+        text: Query text
+
+    Returns:
+        np.ndarray of shape (1, store.dimension)
+    """
+    client = get_embedding_client(store.model, client)
+    if not getattr(client, 'cacheable', True):
+        # Hashing and local embedders are cheaper than the coalescing wait
+        return embed_for_store(client, store, [text])
+    coalescer = get_embedding_coalescer(client, store.model, store.embedding_dimensions)
+    return store.reduce_embeddings(coalescer.embed([text]))
+
+
+if __name__ == "__main__":
+    cache = get_embedding_cache()
+    if '--clear' in sys.argv:
+        cache.clear()
+        print(f"✓ Cleared {cache.path}")
+    else:
+        print(f"Embedding cache: {cache.path} (limit {cache.max_bytes / (1024*1024):.0f} MB)")
+        for model, info in cache.stats().items():
+            print(f"  - {model}: {info['entries']} embeddings, "
+                  f"{info['bytes'] / (1024*1024):.2f} MB")
@@ -1,16 +1,83 @@
 import os
 import sys
+import argparse
+from pathlib import Path
 import pandas as pd
-import numpy as np
 import faiss
-import pickle
-from openai import OpenAI
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from vectorstore import (
+    INDEX_TYPES, COMPRESSED_INDEX_TYPES, DEFAULT_RERANK_FACTOR, SHARD_BY_OPTIONS,
+    DEFAULT_DEDUP_THRESHOLD, SUGGESTED_DEDUP_THRESHOLD, collapse_near_duplicates,
+    REDUCTION_METHODS, fit_pca,
+    INDEX_FILENAME, VECTORS_FILENAME, SHARDS_DIRNAME, PCA_FILENAME, build_index,
+    build_sharded_index,
+    evaluate_recall, save_vectors, new_generation_path, publish_generation,
+    prune_generations
+)
+from metadata_store import create_metadata_store, METADATA_DB_FILENAME
+from embeddings import (
+    EMBEDDING_PROVIDERS, DEFAULT_EMBED_CONCURRENCY, DEFAULT_EMBED_RPM, DEFAULT_EMBED_TPM,
+    MAX_BATCH_INPUTS, MAX_BATCH_TOKENS, OVERLENGTH_MODES, EmbeddingCache, create_embeddings,
+    create_embedding_client, get_embedding_cache, model_dimension
+)
+
 # Load environment variables
 load_dotenv()
 
+# Embeddings of an unfinished ingest, in the vector store directory
+CHECKPOINT_FILENAME = "ingest_checkpoint.db"
+
+
+class IngestCheckpoint(EmbeddingCache):
+    """
+    Embeddings computed by an ingest run that has not been published yet.
+
+    create_embeddings treats it as its cache: every completed batch is
+    written as soon as it returns, and a re-run looks its rows up here
+    first, so only the batches that never finished are sent again. The
+    entries are the API's own float32 output, so a resumed run builds
+    the same index as an uninterrupted one. Unlike the shared embedding
+    cache nothing is evicted; the file is removed once the new generation
+    is published. Lookups fall through to the shared cache, and new
+    embeddings are written to both.
+    """
+
+    def __init__(self, path, cache=None):
+        """
+        Args:
+            path: Checkpoint file
+            cache: Shared EmbeddingCache to read through / write to (optional)
+        """
+        super().__init__(path, max_bytes=sys.maxsize)
+        self.cache = cache
+
+    def count(self):
+        """Embeddings saved so far."""
+        return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, dimensions, texts):
+        found = super().get_many(model, dimensions, texts)
+        if self.cache:
+            rest = [i for i in range(len(texts)) if i not in found]
+            hits = self.cache.get_many(model, dimensions, [texts[i] for i in rest])
+            found.update({rest[j]: vector for j, vector in hits.items()})
+        return found
+
+    def put_many(self, model, dimensions, texts, embeddings):
+        super().put_many(model, dimensions, texts, embeddings)
+        if self.cache:
+            self.cache.put_many(model, dimensions, texts, embeddings)
+
+    def remove(self):
+        """Delete the checkpoint (after a successful ingest)."""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            path = Path(f"{self.path}{suffix}")
+            if path.exists():
+                os.remove(path)
+
 def create_text_from_row(row):
     """Create a comprehensive text representation from each row for embedding."""
     parts = []
@@ -51,37 +118,133 @@ def create_text_from_row(row):
 
     return "\n".join(parts)
 
-def create_embeddings_batch(texts, client, model="text-embedding-3-small", batch_size=100):
-    """Create embeddings in batches to handle API rate limits."""
-    all_embeddings = []
-
-    for i in tqdm(range(0, len(texts), batch_size), desc="Creating embeddings"):
-        batch = texts[i:i+batch_size]
-        try:
-            response = client.embeddings.create(
-                input=batch,
-                model=model
-            )
-            embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(embeddings)
-        except Exception as e:
-            print(f"Error processing batch {i//batch_size}: {e}")
-            raise
-
-    return np.array(all_embeddings, dtype=np.float32)
-
-def main():
-    # Initialize OpenAI client
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-    client = OpenAI(api_key=api_key)
+def create_embeddings_batch(texts, client, model="text-embedding-3-small",
+                            batch_size=MAX_BATCH_INPUTS, dimensions=None, cache=None,
+                            concurrency=DEFAULT_EMBED_CONCURRENCY, rpm=DEFAULT_EMBED_RPM,
+                            tpm=DEFAULT_EMBED_TPM, max_batch_tokens=MAX_BATCH_TOKENS,
+                            overlength='chunk'):
+    """Create embeddings in batches to handle API rate limits.
+
+    dimensions asks text-embedding-3 models for shorter (re-normalized)
+    embeddings; None returns the model's full output. Texts already in
+    the embedding cache (cache=False disables it) are not re-embedded, so
+    a re-ingest only pays for changed rows. Rows are packed into requests
+    of at most batch_size rows and max_batch_tokens tokens; a row over
+    the model's token limit is truncated or embedded in chunks
+    (overlength). Up to concurrency requests are in flight at once,
+    within the rpm/tpm rate limits.
+    """
+    return create_embeddings(client, texts, model, dimensions=dimensions,
+                             batch_size=batch_size, cache=cache, progress=True,
+                             concurrency=concurrency, rpm=rpm, tpm=tpm,
+                             max_batch_tokens=max_batch_tokens, overlength=overlength)
+
+def parse_args(argv=None):
+    """Parse ingest command line options."""
+    parser = argparse.ArgumentParser(
+        description="Embed final_ver3.xlsx and build the FAISS vector store")
+    parser.add_argument('--data', default="data/final_ver3.xlsx",
+                        help="Ticket export to ingest, .xlsx or .csv "
+                             "(default: data/final_ver3.xlsx)")
+    parser.add_argument('--vector-store', default="vector_store",
+                        help="Vector store directory to publish to (default: vector_store)")
+    parser.add_argument('--embedder', choices=EMBEDDING_PROVIDERS, default=None,
+                        help="Embedding provider: openai (text-embedding-3-small), hashing "
+                             "(deterministic offline feature hashing) or local (a "
+                             "sentence-transformers model on disk, CPU only) "
+                             "(default: $EMBEDDING_PROVIDER or openai)")
+    parser.add_argument('--local-model', default=None,
+                        help="Model directory for --embedder local "
+                             "(default: $EMBEDDING_LOCAL_MODEL)")
+    parser.add_argument('--restart', action='store_true',
+                        help="Discard the checkpoint of an interrupted ingest instead of "
+                             "resuming from it")
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                        help="Re-embed every row instead of reusing cached embeddings")
+    parser.add_argument('--batch-tokens', type=int, default=MAX_BATCH_TOKENS,
+                        help="Tokens packed into one embeddings request; lower it to "
+                             "spread a small ingest over concurrent requests "
+                             f"(default: {MAX_BATCH_TOKENS})")
+    parser.add_argument('--overlength', choices=OVERLENGTH_MODES, default='chunk',
+                        help="Rows over the model's token limit: truncate, or chunk "
+                             "(embed token windows and average them) (default: chunk)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_EMBED_CONCURRENCY,
+                        help="Embedding requests in flight at once "
+                             f"(default: {DEFAULT_EMBED_CONCURRENCY})")
+    parser.add_argument('--rpm', type=int, default=DEFAULT_EMBED_RPM,
+                        help=f"Embedding requests per minute budget (default: {DEFAULT_EMBED_RPM})")
+    parser.add_argument('--tpm', type=int, default=DEFAULT_EMBED_TPM,
+                        help=f"Embedding tokens per minute budget (default: {DEFAULT_EMBED_TPM})")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat',
+                        help="flat (exact), ivf (IVF-Flat), hnsw, sq8 (8-bit scalar "
+                             "quantizer) or ivfpq (IVF + product quantizer) (default: flat)")
+    parser.add_argument('--nlist', type=int, default=None,
+                        help="IVF lists (default: 4*sqrt(n), capped by corpus size)")
+    parser.add_argument('--nprobe', type=int, default=8,
+                        help="IVF lists scanned per query (default: 8)")
+    parser.add_argument('--hnsw-m', type=int, default=32,
+                        help="HNSW neighbours per node (default: 32)")
+    parser.add_argument('--ef-construction', type=int, default=40,
+                        help="HNSW build candidate list size (default: 40)")
+    parser.add_argument('--ef-search', type=int, default=64,
+                        help="HNSW search candidate list size (default: 64)")
+    parser.add_argument('--pq-m', type=int, default=None,
+                        help="IVF-PQ sub-quantizers, must divide the dimension "
+                             "(default: ~24 dims each)")
+    parser.add_argument('--pq-nbits', type=int, default=8,
+                        help="IVF-PQ bits per code (default: 8)")
+    parser.add_argument('--rerank-factor', type=int, default=DEFAULT_RERANK_FACTOR,
+                        help="Candidates per result re-ranked with full vectors for "
+                             f"sq8/ivfpq (default: {DEFAULT_RERANK_FACTOR})")
+    parser.add_argument('--shard-by', choices=['none'] + list(SHARD_BY_OPTIONS),
+                        default='none',
+                        help="Split the index into shards searched in parallel: one "
+                             "per product, or hashed by vector id (default: none)")
+    parser.add_argument('--n-shards', type=int, default=8,
+                        help="Number of shards for --shard-by hash (default: 8)")
+    parser.add_argument('--dedup-threshold', type=float, default=DEFAULT_DEDUP_THRESHOLD,
+                        help="Collapse documents whose embeddings are within this squared "
+                             "L2 distance into one canonical vector; also applied to later "
+                             f"adds, e.g. {SUGGESTED_DEDUP_THRESHOLD}. 0 disables "
+                             f"(default: {DEFAULT_DEDUP_THRESHOLD})")
+    parser.add_argument('--dimension', type=int, default=None,
+                        help="Store embeddings at this reduced dimension, e.g. 256, 512 "
+                             "or 1024 (default: the model's full 1536); see "
+                             "benchmark_dimensions.py for the recall trade-off")
+    parser.add_argument('--reduction', choices=REDUCTION_METHODS, default='api',
+                        help="How to reduce to --dimension: api (request `dimensions` "
+                             "from the embeddings API) or pca (fit a PCA projection on "
+                             "the full embeddings) (default: api)")
+    parser.add_argument('--recall-k', type=int, default=10,
+                        help="k for the recall@k report (default: 10)")
+    parser.add_argument('--recall-queries', type=int, default=200,
+                        help="Held-out queries for the recall report (default: 200)")
+    return parser.parse_args(argv)
+
+
+def print_recall_report(report, index_type):
+    """Print the recall/latency comparison against the flat index."""
+    print(f"\nRecall report ({index_type} vs exact flat search):")
+    print(f"  - Held-out queries: {report['n_queries']}")
+    print(f"  - Recall@{report['k']}: {report['recall_at_k']:.4f}")
+    print(f"  - Flat latency: {report['exact_ms_per_query']:.3f} ms/query")
+    print(f"  - {index_type} latency: {report['index_ms_per_query']:.3f} ms/query")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Initialize the embedding client; model identifies the provider in
+    # metadata['model'] so queries use the same one
+    client, model = create_embedding_client(args.embedder, args.local_model)
 
     # Load the Excel file
     print("Loading Excel file...")
-    data_path = "data/final_ver3.xlsx"
-    df = pd.read_excel(data_path)
+    data_path = args.data
+    if data_path.endswith('.csv'):
+        df = pd.read_csv(data_path)
+    else:
+        df = pd.read_excel(data_path)
     print(f"Loaded {len(df)} rows")
 
     # Create text representations
@@ -91,44 +254,150 @@ def main():
         text = create_text_from_row(row)
         texts.append(text)
 
-    # Create embeddings
-    print(f"Creating embeddings using OpenAI...")
-    embeddings = create_embeddings_batch(texts, client)
+    # Create embeddings, checkpointing completed batches so a failed run
+    # can be resumed by running the same command again
+    print(f"Creating embeddings using {model}...")
+    vector_store_path = args.vector_store
+    api_dimensions = args.dimension if args.reduction == 'api' else None
+    checkpoint = None
+    if getattr(client, 'cacheable', True):
+        checkpoint_path = Path(vector_store_path) / CHECKPOINT_FILENAME
+        if args.restart and checkpoint_path.exists():
+            IngestCheckpoint(checkpoint_path).remove()
+        checkpoint = IngestCheckpoint(
+            checkpoint_path, cache=None if args.no_embedding_cache else get_embedding_cache())
+        if checkpoint.count():
+            print(f"Resuming: {checkpoint.count()} embeddings saved by an interrupted run "
+                  f"(--restart to discard)")
+    try:
+        embeddings = create_embeddings_batch(
+            texts, client, model=model, dimensions=api_dimensions,
+            cache=checkpoint if checkpoint else False,
+            concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm,
+            max_batch_tokens=args.batch_tokens, overlength=args.overlength)
+    except Exception:
+        if checkpoint:
+            print(f"⚠ Ingest interrupted; {checkpoint.count()} embeddings are saved in "
+                  f"{checkpoint.path}. Run the same command again to resume.")
+        raise
     print(f"Created {len(embeddings)} embeddings with dimension {embeddings.shape[1]}")
+    source_dimension = embeddings.shape[1]
+    if api_dimensions:
+        # Full output size of the model, for the record
+        source_dimension = model_dimension(client, model)
+
+    # Project to the reduced dimension (queries go through the same matrix)
+    pca = None
+    if args.dimension and args.reduction == 'pca':
+        print(f"Fitting PCA {source_dimension} -> {args.dimension}...")
+        pca = fit_pca(embeddings, args.dimension)
+        embeddings = pca.apply(embeddings)
+    n_documents = len(embeddings)
+    rows = df.to_dict('records')
+
+    # Collapse near-identical tickets / KB rows into one canonical vector
+    duplicates = []
+    if args.dedup_threshold > 0:
+        embeddings, texts, rows, duplicates = collapse_near_duplicates(
+            embeddings, texts, rows, args.dedup_threshold)
+        print(f"Collapsed {len(duplicates)} near-duplicates "
+              f"(distance < {args.dedup_threshold}); {len(embeddings)} vectors remain")
 
     # Create FAISS index
-    print("Creating FAISS index...")
+    print(f"Creating FAISS index ({args.index_type})...")
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-    print(f"Added {index.ntotal} vectors to index")
+    # Everything is written to a new generation directory; readers keep
+    # using the current one until it is published below
+    generation_path = new_generation_path(vector_store_path)
+    index_kwargs = dict(
+        index_type=args.index_type,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        ef_search=args.ef_search,
+        pq_m=args.pq_m,
+        pq_nbits=args.pq_nbits,
+        rerank_factor=args.rerank_factor
+    )
+    sharded = args.shard_by != 'none'
+    if sharded:
+        index, index_params = build_sharded_index(
+            embeddings, rows, generation_path,
+            shard_by=args.shard_by, n_shards=args.n_shards, **index_kwargs)
+        print(f"Added {index.ntotal} vectors to {len(index.shard_names)} shards")
+        for name, shard in index.manifest['shards'].items():
+            print(f"  - {name}: {shard['count']} vectors")
+    else:
+        index, index_params = build_index(embeddings, **index_kwargs)
+        print(f"Added {index.ntotal} vectors to index")
+    print(f"  Index parameters: {index_params}")
+
+    if args.index_type != 'flat':
+        report = evaluate_recall(
+            index, embeddings, k=args.recall_k, n_queries=args.recall_queries)
+        print_recall_report(report, args.index_type)
+        index_params['recall_report'] = report
+
+    if args.index_type in COMPRESSED_INDEX_TYPES:
+        report = evaluate_recall(
+            index, embeddings, k=args.recall_k, n_queries=args.recall_queries,
+            rerank_factor=args.rerank_factor)
+        print_recall_report(report, f"{args.index_type} + re-rank")
+        index_params['rerank_recall_report'] = report
 
     # Save the index
-    vector_store_path = "vector_store"
-    os.makedirs(vector_store_path, exist_ok=True)
-
-    index_path = os.path.join(vector_store_path, "faiss_index.bin")
-    faiss.write_index(index, index_path)
-    print(f"Saved FAISS index to {index_path}")
-
-    # Save metadata
-    metadata = {
-        'texts': texts,
-        'dataframe': df.to_dict('records'),
-        'model': 'text-embedding-3-small',
+    if sharded:
+        index.save()
+        index_path = generation_path / SHARDS_DIRNAME
+        print(f"Saved {len(index.shard_names)} FAISS shards to {index_path}")
+    else:
+        index_path = generation_path / INDEX_FILENAME
+        faiss.write_index(index, str(index_path))
+        print(f"Saved FAISS index to {index_path}")
+
+    if pca is not None:
+        pca_path = generation_path / PCA_FILENAME
+        faiss.write_VectorTransform(pca, str(pca_path))
+        print(f"Saved PCA projection to {pca_path}")
+
+    # Save full vectors (used to re-rank compressed index results)
+    vectors_path = generation_path / VECTORS_FILENAME
+    save_vectors(embeddings, vectors_path)
+    print(f"Saved full vectors to {vectors_path}")
+
+    # Save metadata (columnar, keyed by vector id)
+    info = {
+        'model': model,
         'dimension': dimension,
-        'total_vectors': len(embeddings)
+        'embedding_dimensions': api_dimensions,
+        'reduction': ({'method': args.reduction, 'source_dimension': source_dimension}
+                      if args.dimension else None),
+        'total_vectors': len(embeddings),
+        'index': index_params,
+        'dedup_threshold': args.dedup_threshold or None
     }
+    if sharded:
+        info['shards'] = index.manifest
 
-    metadata_path = os.path.join(vector_store_path, "metadata.pkl")
-    with open(metadata_path, 'wb') as f:
-        pickle.dump(metadata, f)
+    metadata_path = generation_path / METADATA_DB_FILENAME
+    create_metadata_store(metadata_path, texts, rows, info, duplicates=duplicates)
     print(f"Saved metadata to {metadata_path}")
 
+    # Switch readers to the new generation in one atomic step
+    publish_generation(vector_store_path, generation_path)
+    prune_generations(vector_store_path)
+    print(f"Published generation {generation_path.name}")
+    if checkpoint:
+        checkpoint.remove()
+
     print("\n✓ Ingestion complete!")
-    print(f"  - Total documents: {len(texts)}")
+    print(f"  - Total documents: {n_documents}")
+    print(f"  - Vectors: {len(texts)} ({len(duplicates)} near-duplicates collapsed)")
     print(f"  - Embedding dimension: {dimension}")
+    print(f"  - Index type: {args.index_type}")
     print(f"  - Index file: {index_path}")
+    print(f"  - Vectors file: {vectors_path}")
     print(f"  - Metadata file: {metadata_path}")
 
 if __name__ == "__main__":
@@ -0,0 +1,360 @@
+"""
+Single-Writer Ingestion Queue for the Vector Store
+Producers (self-healing runs in any process) submit rows to a SQLite queue
+and wait for an acknowledgement; exactly one writer applies all vector
+store mutations, in submission order, so no update is lost
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import fcntl
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent))
+
+from vectorstore import (
+    DEFAULT_VECTOR_STORE_PATH, COMPACT_MAX_DELTA, COMPACT_MAX_AGE, get_vector_store
+)
+
+QUEUE_DB_FILENAME = "ingest_queue.db"
+WRITER_LOCK_FILENAME = "writer.lock"
+
+JOB_KINDS = ('add', 'upsert', 'delete')
+DEFAULT_TIMEOUT = 120
+POLL_INTERVAL = 0.05
+
+
+class IngestQueue:
+    """
+    Durable FIFO of vector store mutations, shared by all processes.
+
+    Jobs hold the already-computed embeddings, so the writer only does the
+    cheap, serialized part (append to the delta log and metadata.db).
+    """
+
+    def __init__(self, vector_store_path=None):
+        """
+        Open (and create if needed) the queue.
+
+        Args:
+            vector_store_path: Path to the vector store directory
+        """
+        self.vector_store_path = Path(vector_store_path or DEFAULT_VECTOR_STORE_PATH)
+        self.db_path = self.vector_store_path / QUEUE_DB_FILENAME
+        os.makedirs(self.vector_store_path, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    embeddings BLOB,
+                    dimension INTEGER,
+                    rows TEXT,
+                    texts TEXT,
+                    keys TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    done_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # WAL journal: producers can insert while the writer reads
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def submit(self, kind, embeddings=None, rows=None, texts=None, keys=None):
+        """
+        Add a job to the queue.
+
+        Args:
+            kind: 'add', 'upsert' or 'delete'
+            embeddings: Array of shape (n, dimension) (add/upsert)
+            rows: n metadata rows (add/upsert)
+            texts: n embedded texts (add/upsert)
+            keys: Document keys to delete (delete)
+
+        Returns:
+            int: Job id, to pass to wait()
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        blob, dimension = None, None
+        if embeddings is not None:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if embeddings.ndim == 1:
+                embeddings = embeddings.reshape(1, -1)
+            blob, dimension = embeddings.tobytes(), embeddings.shape[1]
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, embeddings, dimension, rows, texts, keys, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, blob, dimension,
+                 json.dumps(rows, default=str) if rows is not None else None,
+                 json.dumps(texts) if texts is not None else None,
+                 json.dumps(keys) if keys is not None else None,
+                 time.time()))
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def status(self, job_id):
+        """
+        Get a job's state.
+
+        Returns:
+            dict: status ('pending', 'done' or 'failed'), result, error
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise KeyError(f"Unknown ingest job {job_id}")
+        return {'status': row[0],
+                'result': json.loads(row[1]) if row[1] else None,
+                'error': row[2]}
+
+    def wait(self, job_id, timeout=DEFAULT_TIMEOUT):
+        """
+        Block until the writer has applied a job (the acknowledgement).
+
+        Args:
+            job_id: Id returned by submit()
+            timeout: Seconds to wait
+
+        Returns:
+            dict: Result of the vector store call
+
+        Raises:
+            RuntimeError: If the writer failed to apply the job
+            TimeoutError: If no writer applied it in time
+        """
+        deadline = time.time() + timeout
+        while True:
+            state = self.status(job_id)
+            if state['status'] == 'done':
+                return state['result']
+            if state['status'] == 'failed':
+                raise RuntimeError(f"Ingest job {job_id} failed: {state['error']}")
+            if time.time() >= deadline:
+                raise TimeoutError(
+                    f"Ingest job {job_id} not applied after {timeout}s "
+                    f"(is a writer running? python scripts/ingest_queue.py)")
+            time.sleep(POLL_INTERVAL)
+
+    def pending(self):
+        """Pending jobs in submission order, as dicts."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT id, kind, embeddings, dimension, rows, texts, keys "
+                "FROM jobs WHERE status = 'pending' ORDER BY id")
+            jobs = []
+            for job_id, kind, blob, dimension, rows, texts, keys in cursor.fetchall():
+                jobs.append({
+                    'id': job_id,
+                    'kind': kind,
+                    'embeddings': (np.frombuffer(blob, dtype=np.float32).reshape(-1, dimension)
+                                   if blob is not None else None),
+                    'rows': json.loads(rows) if rows else None,
+                    'texts': json.loads(texts) if texts else None,
+                    'keys': json.loads(keys) if keys else None
+                })
+            return jobs
+        finally:
+            conn.close()
+
+    def finish(self, job_id, result=None, error=None):
+        """Record a job's outcome (called by the writer)."""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, done_at = ?, "
+                "embeddings = NULL WHERE id = ?",
+                ('failed' if error else 'done',
+                 json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class IngestWriter:
+    """
+    The only component that mutates the vector store.
+
+    An exclusive lock file guarantees one writer per vector store across
+    all processes on the host. Run it as a service
+    (python scripts/ingest_queue.py), or let submit_and_wait() drain the
+    queue inline when no writer is running. Compaction is a write too, so
+    the writer runs it while holding the lock instead of in the store's
+    background thread. The store refuses add/upsert/delete/compact from a
+    process that does not hold the lock.
+    """
+
+    def __init__(self, vector_store_path=None):
+        self.vector_store_path = Path(vector_store_path or DEFAULT_VECTOR_STORE_PATH)
+        self.queue = IngestQueue(self.vector_store_path)
+        self.store = None
+        self._lock_file = None
+        self._auto_compact = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self, blocking=True):
+        """
+        Take the writer lock.
+
+        Args:
+            blocking: Wait for another writer to exit instead of failing
+
+        Returns:
+            bool: True if this process is now the writer
+        """
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.vector_store_path / WRITER_LOCK_FILENAME, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+
+        # Another process may have written since this process last did
+        self.store = get_vector_store(self.vector_store_path)
+        self._auto_compact = self.store.auto_compact
+        self.store.auto_compact = False
+        self.store.writer = self
+        self.store.sync()
+        return True
+
+    def release(self):
+        """Give up the writer lock and hand compaction back to the store."""
+        if self._lock_file is not None:
+            if self.store.writer is self:
+                self.store.writer = None
+                self.store.auto_compact = self._auto_compact
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def apply(self, job):
+        """Apply one job to the vector store and return its result."""
+        if job['kind'] == 'delete':
+            return {'deleted': self.store.delete(job['keys'])}
+        if job['kind'] == 'upsert':
+            return self.store.upsert(job['embeddings'], job['rows'], job['texts'])
+        total = self.store.add(job['embeddings'], job['rows'], job['texts'])
+        return {'added': len(job['rows']), 'total_vectors': total}
+
+    def drain(self):
+        """
+        Apply every pending job in submission order (writer lock required).
+
+        Returns:
+            int: Number of jobs processed
+        """
+        if self._lock_file is None:
+            raise RuntimeError("drain() requires the writer lock; call acquire() first")
+
+        jobs = self.queue.pending()
+        for job in jobs:
+            try:
+                result = self.apply(job)
+            except Exception as e:
+                print(f"⚠ Ingest job {job['id']} ({job['kind']}) failed: {e}")
+                self.queue.finish(job['id'], error=str(e))
+            else:
+                self.queue.finish(job['id'], result=result)
+
+        if self.store.delta.is_due(COMPACT_MAX_DELTA, COMPACT_MAX_AGE):
+            try:
+                self.store.compact()
+            except Exception as e:
+                # The write-ahead log still holds the vectors; retry next time
+                print(f"⚠ Delta compaction failed: {e}")
+        return len(jobs)
+
+    def run(self, poll_interval=0.2):
+        """Serve the queue until interrupted."""
+        print(f"Waiting for the writer lock on {self.vector_store_path}...")
+        self.acquire()
+        print("✓ Ingest writer running (Ctrl+C to stop)")
+        try:
+            while True:
+                if self.drain() == 0:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\nStopping ingest writer")
+        finally:
+            self.release()
+
+
+def submit_and_wait(kind, embeddings=None, rows=None, texts=None, keys=None,
+                    vector_store_path=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Submit a vector store mutation and wait until it is applied.
+
+    If no writer process holds the lock, this process becomes the writer
+    for as long as it takes to drain the queue (its own job included).
+
+    Args:
+        kind: 'add', 'upsert' or 'delete'
+        embeddings, rows, texts, keys: See IngestQueue.submit()
+        vector_store_path: Path to the vector store directory
+        timeout: Seconds to wait for the acknowledgement
+
+    Returns:
+        dict: Result of the vector store call, e.g. {'added': 1, 'deleted': 0}
+    """
+    writer = IngestWriter(vector_store_path)
+    job_id = writer.queue.submit(kind, embeddings, rows, texts, keys)
+
+    deadline = time.time() + timeout
+    while True:
+        state = writer.queue.status(job_id)
+        if state['status'] != 'pending':
+            break
+        if writer.acquire(blocking=False):
+            try:
+                writer.drain()
+            finally:
+                writer.release()
+            break
+        if time.time() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    return writer.queue.wait(job_id, timeout=max(0, deadline - time.time()))
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    IngestWriter(args[0] if args else None).run()
@@ -1,11 +1,11 @@
 import os
 import sys
-import numpy as np
-import faiss
-import pickle
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from vectorstore import get_vector_store
+from embeddings import embed_for_store
+
 # Load environment variables
 load_dotenv()
 
@@ -79,28 +79,18 @@ def query_vectorstore(query_text, top_k=3):
         print(f"Search Query for Vector DB:")
         print(f"{search_query}\n")
 
-    # Load the FAISS index
-    index_path = "vector_store/faiss_index.bin"
-    index = faiss.read_index(index_path)
-
-    # Load metadata
-    metadata_path = "vector_store/metadata.pkl"
-    with open(metadata_path, 'rb') as f:
-        metadata = pickle.load(f)
+    # Get the shared vector store (loaded once per process)
+    store = get_vector_store()
 
     print(f"{'='*100}")
-    print(f"EMBEDDING MODEL: {metadata['model']}")
+    print(f"EMBEDDING MODEL: {store.model}")
     print(f"{'='*100}\n")
 
     # Create embedding for search query
-    response = client.embeddings.create(
-        input=[search_query],
-        model=metadata['model']
-    )
-    query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
+    query_embedding = embed_for_store(client, store, [search_query])
 
     # Search the index
-    distances, indices = index.search(query_embedding, top_k)
+    distances, indices = store.search(query_embedding, top_k)
 
     # Display results
     print(f"{'='*100}")
@@ -109,7 +99,10 @@ def query_vectorstore(query_text, top_k=3):
 
     results = []
     for i, (idx, distance) in enumerate(zip(indices[0], distances[0])):
-        doc_data = metadata['dataframe'][idx]
+        if idx < 0:
+            continue
+
+        doc_data = store.get_row(idx)
 
         print(f"\n{'#'*100}")
         print(f"RESULT {i+1} - SIMILARITY SCORE: {1 / (1 + distance):.4f} (Distance: {distance:.4f})")
@@ -195,10 +188,13 @@ def query_vectorstore(query_text, top_k=3):
     return results
 
 def main():
+    # Load the vector store once up front; every query reuses it
+    store = get_vector_store()
+
     print("\n" + "="*100)
     print("SUPPORT TICKET SEARCH - INTERACTIVE MODE")
     print("="*100)
-    print("Embedding Model: text-embedding-3-small")
+    print(f"Embedding Model: {store.model}")
     print("Queries with >15 words will be automatically summarized")
     print("="*100 + "\n")
 
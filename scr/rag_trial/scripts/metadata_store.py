@@ -0,0 +1,824 @@
+"""
+Columnar Metadata Store for the Vector Store
+Keeps embedded texts and metadata rows in SQLite, one column per field,
+keyed by vector id so searches fetch only the rows and columns they need
+"""
+
+import re
+import sys
+import json
+import math
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+
+METADATA_DB_FILENAME = "metadata.db"
+LEGACY_METADATA_FILENAME = "metadata.pkl"
+
+# Let SQLite serve reads straight from the OS page cache (shared by all
+# worker processes on the host) instead of private heap buffers
+MMAP_SIZE = 1 << 30
+
+# Columns that get a SQL index (lookups and filters by these are common)
+INDEXED_COLUMNS = (
+    'Ticket_Number', 'Product_x', 'Category_x', 'Answer_Type',
+    'KB_Article_ID_x', 'Script_ID', 'Source_ID'
+)
+
+# Reserved column names used by the store itself
+ID_COLUMN = 'vector_id'
+TEXT_COLUMN = 'embedded_text'
+DOC_KEY_COLUMN = 'doc_key'
+RESERVED_COLUMNS = (ID_COLUMN, TEXT_COLUMN, DOC_KEY_COLUMN)
+
+# Full-text (BM25) index over the embedded texts, kept in sync with
+# documents at insert time
+FTS_TABLE = 'documents_fts'
+
+# Longest lexical query, in distinct terms
+MAX_LEXICAL_TERMS = 64
+
+# A document's stable key names exactly one row. A seed ticket has up to
+# three rows (the ticket itself, its conversation and its script), told
+# apart by Source_ID, the row's own answer id: the ticket row is keyed by
+# the ticket number and the others by "<ticket>/<Source_ID>". Self-healing
+# KB articles and scripts have no ticket and are keyed by the first of
+# DOC_KEY_COLUMNS that is set
+TICKET_COLUMN = 'Ticket_Number'
+ANSWER_ID_COLUMN = 'Source_ID'
+DOC_KEY_COLUMNS = ('KB_Article_ID_x', 'Script_ID')
+
+# Bumped whenever document_key() changes; older stores are re-keyed by
+# _ensure_schema()
+DOC_KEY_VERSION = 2
+
+
+def _quote(name):
+    """Quote a column name for SQL (data columns contain spaces, e.g. 'Unnamed: 0')."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def document_key(row):
+    """
+    Get the stable document key for a metadata row.
+
+    Args:
+        row: Metadata row
+
+    Returns:
+        str: Ticket number, "<ticket>/<answer id>", KB article id or
+            script id, or None
+    """
+    ticket = _key_value(row.get(TICKET_COLUMN))
+    if ticket is not None:
+        answer_id = _key_value(row.get(ANSWER_ID_COLUMN))
+        return ticket if answer_id in (None, ticket) else f"{ticket}/{answer_id}"
+    for column in DOC_KEY_COLUMNS:
+        value = _key_value(row.get(column))
+        if value is not None:
+            return value
+    return None
+
+
+def _key_value(value):
+    """A metadata value as a key part, or None if it is empty."""
+    value = _to_sql_value(value)
+    if value is None or str(value).strip() in ('', 'None'):
+        return None
+    return str(value).strip()
+
+
+def _to_sql_value(value):
+    """Convert a metadata value to a type SQLite can store."""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (bool,)):
+        return int(value)
+    if isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return _to_sql_value(value.item())
+    return str(value)
+
+
+class MetadataStore:
+    """
+    SQLite-backed columnar metadata for the vector store.
+
+    Rows are fetched lazily by vector id, so opening the store costs
+    nothing and a search only reads the top_k rows (and the columns) it
+    returns. Connections are read-only and memory-mapped by default.
+
+    Each row also stores its document key (see document_key()). Deleted
+    or replaced documents keep their rows but get a tombstone, which
+    excludes them from filters and searches. Documents collapsed into a
+    near-identical canonical document have no vector of their own; the
+    duplicates table maps them to the canonical vector id.
+    """
+
+    def __init__(self, db_path, read_only=True):
+        """
+        Open the metadata store.
+
+        Args:
+            db_path: Path to metadata.db
+            read_only: Open connections in read-only, memory-mapped mode
+        """
+        self.db_path = Path(db_path)
+        self.read_only = read_only
+        self._local = threading.local()
+        self._columns = None
+
+        if not self.db_path.exists():
+            raise FileNotFoundError(f"Metadata store not found at {self.db_path}")
+
+    def _connect(self):
+        """Get this thread's connection (sqlite3 connections are per-thread)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            else:
+                conn = sqlite3.connect(self.db_path)
+            conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    @property
+    def columns(self):
+        """Metadata columns stored for every row."""
+        if self._columns is None:
+            self._columns = _data_columns(self._connect())
+        return self._columns
+
+    def clear_cache(self):
+        """Forget the cached column list (another process may have added columns)."""
+        self._columns = None
+
+    def get_info(self):
+        """
+        Get the store-level metadata.
+
+        Returns:
+            dict: model, dimension, total_vectors, index, ...
+        """
+        cursor = self._connect().execute("SELECT key, value FROM store_info")
+        return {key: json.loads(value) for key, value in cursor.fetchall()}
+
+    def count(self):
+        """Number of stored rows."""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def get_rows(self, vector_ids, columns=None):
+        """
+        Fetch metadata rows for a set of vectors.
+
+        Args:
+            vector_ids: Vector ids, e.g. the indices returned by a search
+            columns: Columns to fetch (default: all)
+
+        Returns:
+            list: One dict per id, in the order given (None if not found)
+        """
+        vector_ids = [int(i) for i in vector_ids]
+        if not vector_ids:
+            return []
+
+        columns = [c for c in (columns or self.columns) if c in self.columns]
+        select = ", ".join([ID_COLUMN] + [_quote(c) for c in columns])
+        placeholders = ", ".join("?" for _ in vector_ids)
+        cursor = self._connect().execute(
+            f"SELECT {select} FROM documents WHERE {ID_COLUMN} IN ({placeholders})",
+            vector_ids)
+
+        found = {row[0]: dict(zip(columns, row[1:])) for row in cursor.fetchall()}
+        return [found.get(i) for i in vector_ids]
+
+    def get_row(self, vector_id, columns=None):
+        """
+        Get the metadata row for a vector.
+
+        Args:
+            vector_id: Vector position in the index
+            columns: Columns to fetch (default: all)
+
+        Returns:
+            dict: Metadata row, or None if not found
+        """
+        return self.get_rows([vector_id], columns)[0]
+
+    def get_text(self, vector_id):
+        """
+        Get the embedded text for a vector.
+
+        Args:
+            vector_id: Vector position in the index
+
+        Returns:
+            str: Embedded text, or None if not found
+        """
+        row = self._connect().execute(
+            f"SELECT {TEXT_COLUMN} FROM documents WHERE {ID_COLUMN} = ?",
+            (int(vector_id),)).fetchone()
+        return row[0] if row else None
+
+    def has_tombstones_table(self):
+        """True if the store has been written with delete support."""
+        return self._connect().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tombstones'"
+        ).fetchone() is not None
+
+    def deleted_ids(self):
+        """
+        Get the ids of deleted (tombstoned) vectors.
+
+        Returns:
+            list: Vector ids in ascending order
+        """
+        if not self.has_tombstones_table():
+            return []
+        cursor = self._connect().execute(
+            f"SELECT {ID_COLUMN} FROM tombstones ORDER BY {ID_COLUMN}")
+        return [row[0] for row in cursor.fetchall()]
+
+    def ids_for_keys(self, keys):
+        """
+        Find the live vector ids of documents.
+
+        Args:
+            keys: Document keys (see document_key())
+
+        Returns:
+            list: Vector ids of the documents, excluding deleted ones
+        """
+        keys = [str(k) for k in keys]
+        if not keys or DOC_KEY_COLUMN not in _all_columns(self._connect()):
+            return []
+
+        placeholders = ", ".join("?" for _ in keys)
+        query = (f"SELECT {ID_COLUMN} FROM documents "
+                 f"WHERE {DOC_KEY_COLUMN} IN ({placeholders})")
+        if self.has_tombstones_table():
+            query += f" AND {ID_COLUMN} NOT IN (SELECT {ID_COLUMN} FROM tombstones)"
+        cursor = self._connect().execute(query + f" ORDER BY {ID_COLUMN}", keys)
+        return [row[0] for row in cursor.fetchall()]
+
+    def has_duplicates_table(self):
+        """True if the store records collapsed near-duplicates."""
+        return self._connect().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'duplicates'"
+        ).fetchone() is not None
+
+    def canonical_ids_for_keys(self, keys):
+        """
+        Find the canonical vectors that collapsed documents were mapped to.
+
+        Args:
+            keys: Document keys of collapsed near-duplicates
+
+        Returns:
+            list: Live canonical vector ids (one per matching key)
+        """
+        keys = [str(k) for k in keys]
+        if not keys or not self.has_duplicates_table():
+            return []
+
+        placeholders = ", ".join("?" for _ in keys)
+        query = (f"SELECT canonical_id FROM duplicates "
+                 f"WHERE {DOC_KEY_COLUMN} IN ({placeholders})")
+        if self.has_tombstones_table():
+            query += f" AND canonical_id NOT IN (SELECT {ID_COLUMN} FROM tombstones)"
+        cursor = self._connect().execute(query + " ORDER BY canonical_id", keys)
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_duplicate(self, key):
+        """
+        Get a collapsed near-duplicate by its key.
+
+        Args:
+            key: Document key of the collapsed document
+
+        Returns:
+            dict: canonical_id, distance, text and the document's own row
+                as ingested, or None (also if its canonical vector was
+                deleted)
+        """
+        if not self.has_duplicates_table():
+            return None
+        query = (f"SELECT canonical_id, distance, {TEXT_COLUMN}, row_json "
+                 f"FROM duplicates WHERE {DOC_KEY_COLUMN} = ?")
+        if self.has_tombstones_table():
+            query += f" AND canonical_id NOT IN (SELECT {ID_COLUMN} FROM tombstones)"
+        found = self._connect().execute(
+            query + " ORDER BY rowid DESC LIMIT 1", (str(key),)).fetchone()
+        if found is None:
+            return None
+        canonical_id, distance, text, row_json = found
+        return {'canonical_id': canonical_id, 'distance': distance, 'text': text,
+                'row': json.loads(row_json) if row_json else {}}
+
+    def duplicate_counts(self, vector_ids):
+        """
+        Count the documents collapsed into each vector.
+
+        Args:
+            vector_ids: Canonical vector ids
+
+        Returns:
+            dict: vector id -> number of collapsed duplicates (ids with
+                none are omitted)
+        """
+        vector_ids = [int(i) for i in vector_ids]
+        if not vector_ids or not self.has_duplicates_table():
+            return {}
+        placeholders = ", ".join("?" for _ in vector_ids)
+        cursor = self._connect().execute(
+            f"SELECT canonical_id, COUNT(*) FROM duplicates "
+            f"WHERE canonical_id IN ({placeholders}) GROUP BY canonical_id",
+            vector_ids)
+        return dict(cursor.fetchall())
+
+    def count_duplicates(self):
+        """Number of documents collapsed into canonical vectors."""
+        if not self.has_duplicates_table():
+            return 0
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM duplicates").fetchone()[0]
+
+    def filter_ids(self, filters):
+        """
+        Find the vector ids whose metadata matches all filters.
+
+        Args:
+            filters: Dict of column -> value (equality) or column ->
+                list/tuple/set of values (IN)
+
+        Returns:
+            list: Matching vector ids in ascending order
+        """
+        clauses, params = self._filter_clauses(filters)
+        if clauses is None:
+            return []
+
+        where = " AND ".join(clauses) or "1"
+        cursor = self._connect().execute(
+            f"SELECT {ID_COLUMN} FROM documents WHERE {where} ORDER BY {ID_COLUMN}",
+            params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def _filter_clauses(self, filters):
+        """
+        SQL conditions for metadata filters, excluding deleted rows.
+
+        Returns:
+            Tuple (clauses, params); clauses is None if nothing can match
+        """
+        clauses = []
+        params = []
+        for column, value in (filters or {}).items():
+            if column not in self.columns:
+                raise ValueError(f"Unknown metadata column for filter: {column}")
+            if isinstance(value, (list, tuple, set)):
+                values = [_to_sql_value(v) for v in value]
+                if not values:
+                    return None, None
+                placeholders = ", ".join("?" for _ in values)
+                clauses.append(f"{_quote(column)} IN ({placeholders})")
+                params.extend(values)
+            else:
+                clauses.append(f"{_quote(column)} = ?")
+                params.append(_to_sql_value(value))
+
+        if self.has_tombstones_table():
+            clauses.append(f"{ID_COLUMN} NOT IN (SELECT {ID_COLUMN} FROM tombstones)")
+        return clauses, params
+
+    def has_lexical_index(self):
+        """True if the store has a full-text index over the embedded texts."""
+        return self._connect().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (FTS_TABLE,)).fetchone() is not None
+
+    def lexical_search(self, query_text, k, filters=None):
+        """
+        Rank documents by BM25 against the query's terms.
+
+        Any term may match; documents matching more (and rarer) terms rank
+        higher, so exact error strings and product names score well.
+
+        Args:
+            query_text: Query text
+            k: Number of results
+            filters: Metadata filters (see filter_ids())
+
+        Returns:
+            list: (vector_id, bm25) tuples, best first (lower bm25 is
+                better); empty if the store has no lexical index
+        """
+        terms = list(dict.fromkeys(re.findall(r'\w+', query_text.lower())))
+        if not terms or not self.has_lexical_index():
+            return []
+        match = " OR ".join('"' + term + '"' for term in terms[:MAX_LEXICAL_TERMS])
+
+        clauses, params = self._filter_clauses(filters)
+        if clauses is None:
+            return []
+        where = "".join(f" AND {clause}" for clause in clauses)
+        cursor = self._connect().execute(
+            f"SELECT {ID_COLUMN}, bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN documents ON {ID_COLUMN} = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH ?{where} ORDER BY rank LIMIT ?",
+            [match] + params + [int(k)])
+        return cursor.fetchall()
+
+    def value_counts(self, column, limit=None):
+        """
+        Count rows per distinct value of a column (NULL and '' excluded).
+
+        Args:
+            column: Metadata column name
+            limit: Return only the most common values (optional)
+
+        Returns:
+            list: (value, count) tuples, most common first
+        """
+        if column not in self.columns:
+            return []
+        query = (f"SELECT {_quote(column)}, COUNT(*) AS n FROM documents "
+                 f"WHERE {_quote(column)} IS NOT NULL AND {_quote(column)} != '' "
+                 f"GROUP BY {_quote(column)} ORDER BY n DESC")
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return self._connect().execute(query).fetchall()
+
+    def add(self, start_id, texts, rows, info=None, duplicates=None):
+        """
+        Append rows for newly added vectors.
+
+        Args:
+            start_id: Vector id of the first new row
+            texts: Embedded texts
+            rows: Metadata rows
+            info: Store-level metadata to update (optional)
+            duplicates: (canonical_id, distance, text, row) tuples for
+                documents collapsed into existing vectors (optional)
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            _ensure_schema(conn)
+            _insert_documents(conn, start_id, texts, rows)
+            if duplicates:
+                _insert_duplicates(conn, duplicates)
+            if info:
+                _write_info(conn, info)
+            conn.commit()
+        finally:
+            conn.close()
+        self._columns = None
+
+    def ensure_schema(self):
+        """Upgrade an older store in place (document keys, deletes, lexical index)."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            _ensure_schema(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def copy_to(self, db_path):
+        """
+        Write a consistent copy of the database (SQLite online backup).
+
+        Args:
+            db_path: Path of the copy
+        """
+        db_path = Path(db_path)
+        tmp_path = db_path.with_name(db_path.name + ".tmp")
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        tmp_path.replace(db_path)
+
+    def delete(self, vector_ids):
+        """
+        Tombstone vectors so they are no longer returned.
+
+        Args:
+            vector_ids: Vector ids to delete
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            _ensure_schema(conn)
+            conn.executemany(
+                f"INSERT OR IGNORE INTO tombstones ({ID_COLUMN}) VALUES (?)",
+                ((int(i),) for i in vector_ids))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def remove_duplicates(self, keys):
+        """
+        Forget collapsed near-duplicates (e.g. before re-adding or deleting them).
+
+        Args:
+            keys: Document keys
+
+        Returns:
+            int: Number of duplicate entries removed
+        """
+        keys = [str(k) for k in keys]
+        if not keys or not self.has_duplicates_table():
+            return 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            placeholders = ", ".join("?" for _ in keys)
+            cursor = conn.execute(
+                f"DELETE FROM duplicates WHERE {DOC_KEY_COLUMN} IN ({placeholders})", keys)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def move_duplicates(self, from_ids, to_id):
+        """
+        Re-point duplicates of replaced vectors to the replacement.
+
+        Args:
+            from_ids: Canonical vector ids being tombstoned
+            to_id: Vector id now representing the same document
+        """
+        from_ids = [int(i) for i in from_ids]
+        if not from_ids or not self.has_duplicates_table():
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            placeholders = ", ".join("?" for _ in from_ids)
+            conn.execute(
+                f"UPDATE duplicates SET canonical_id = ? WHERE canonical_id IN ({placeholders})",
+                [int(to_id)] + from_ids)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def set_info(self, info):
+        """
+        Update store-level metadata.
+
+        Args:
+            info: Keys and values to write to store_info
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            _write_info(conn, info)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _all_columns(conn):
+    cursor = conn.execute("PRAGMA table_info(documents)")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _data_columns(conn):
+    return [c for c in _all_columns(conn) if c not in RESERVED_COLUMNS]
+
+
+def _ensure_schema(conn):
+    """Add document keys, tombstones, duplicates and the lexical index to older stores."""
+    if DOC_KEY_COLUMN not in _all_columns(conn):
+        conn.execute(f"ALTER TABLE documents ADD COLUMN {DOC_KEY_COLUMN} TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_doc_key ON documents({DOC_KEY_COLUMN})")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS tombstones (
+            {ID_COLUMN} INTEGER PRIMARY KEY
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS duplicates (
+            {DOC_KEY_COLUMN} TEXT,
+            canonical_id INTEGER NOT NULL,
+            distance REAL,
+            {TEXT_COLUMN} TEXT,
+            row_json TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_duplicates_key ON duplicates({DOC_KEY_COLUMN})")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_canonical ON duplicates(canonical_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT)")
+    version = conn.execute(
+        "SELECT value FROM store_info WHERE key = 'doc_key_version'").fetchone()
+    if version is None or json.loads(version[0]) != DOC_KEY_VERSION:
+        _rekey(conn)
+    _ensure_lexical_index(conn)
+
+
+def _rekey(conn):
+    """Recompute document keys written by an earlier version of document_key()."""
+    columns = [c for c in (TICKET_COLUMN, ANSWER_ID_COLUMN) + DOC_KEY_COLUMNS
+               if c in _data_columns(conn)]
+    if columns:
+        cursor = conn.execute(
+            f"SELECT {ID_COLUMN}, {', '.join(_quote(c) for c in columns)} FROM documents")
+        conn.executemany(
+            f"UPDATE documents SET {DOC_KEY_COLUMN} = ? WHERE {ID_COLUMN} = ?",
+            [(document_key(dict(zip(columns, values))), vector_id)
+             for vector_id, *values in cursor.fetchall()])
+    cursor = conn.execute("SELECT rowid, row_json FROM duplicates")
+    conn.executemany(
+        f"UPDATE duplicates SET {DOC_KEY_COLUMN} = ? WHERE rowid = ?",
+        [(document_key(json.loads(row_json or '{}')), rowid)
+         for rowid, row_json in cursor.fetchall()])
+    _write_info(conn, {'doc_key_version': DOC_KEY_VERSION})
+
+
+def _ensure_lexical_index(conn):
+    """Create the FTS5 index over the embedded texts, indexing existing rows."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone():
+        return
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"{TEXT_COLUMN}, content='documents', content_rowid='{ID_COLUMN}')")
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: vector search still works
+        print(f"⚠ Lexical index not available: {e}")
+        return
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _insert_documents(conn, start_id, texts, rows):
+    """Insert rows, adding a column for any field not seen before."""
+    columns = _data_columns(conn)
+    for row in rows:
+        for key in row:
+            if key not in columns and key not in RESERVED_COLUMNS:
+                conn.execute(f"ALTER TABLE documents ADD COLUMN {_quote(key)}")
+                columns.append(key)
+
+    names = ", ".join(
+        [ID_COLUMN, TEXT_COLUMN, DOC_KEY_COLUMN] + [_quote(c) for c in columns])
+    placeholders = ", ".join("?" for _ in range(len(columns) + 3))
+    conn.executemany(
+        f"INSERT INTO documents ({names}) VALUES ({placeholders})",
+        (
+            [start_id + offset, text, document_key(row)]
+            + [_to_sql_value(row.get(c)) for c in columns]
+            for offset, (text, row) in enumerate(zip(texts, rows))
+        )
+    )
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone():
+        conn.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, {TEXT_COLUMN}) VALUES (?, ?)",
+            ((start_id + offset, text) for offset, text in enumerate(texts)))
+
+
+def _insert_duplicates(conn, duplicates):
+    """Record documents collapsed into canonical vectors."""
+    conn.executemany(
+        f"INSERT INTO duplicates ({DOC_KEY_COLUMN}, canonical_id, distance, "
+        f"{TEXT_COLUMN}, row_json) VALUES (?, ?, ?, ?, ?)",
+        (
+            (document_key(row), int(canonical_id), float(distance), text,
+             json.dumps({k: _to_sql_value(v) for k, v in row.items()}, default=str))
+            for canonical_id, distance, text, row in duplicates
+        )
+    )
+
+
+def _write_info(conn, info):
+    conn.executemany(
+        "INSERT OR REPLACE INTO store_info (key, value) VALUES (?, ?)",
+        ((key, json.dumps(value, default=str)) for key, value in info.items())
+    )
+
+
+def create_metadata_store(db_path, texts, rows, info, duplicates=None):
+    """
+    Write a new metadata.db, replacing any existing one.
+
+    Args:
+        db_path: Path to metadata.db
+        texts: Embedded texts, in vector order
+        rows: Metadata rows, in vector order
+        info: Store-level metadata (model, dimension, ...)
+        duplicates: (canonical_id, distance, text, row) tuples for
+            near-duplicate documents collapsed at ingest (optional)
+
+    Returns:
+        Path: Path to the written database
+    """
+    db_path = Path(db_path)
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("""
+            CREATE TABLE store_info (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        conn.execute(f"""
+            CREATE TABLE documents (
+                {ID_COLUMN} INTEGER PRIMARY KEY,
+                {TEXT_COLUMN} TEXT,
+                {DOC_KEY_COLUMN} TEXT
+            )
+        """)
+        _ensure_schema(conn)
+        _insert_documents(conn, 0, texts, rows)
+        if duplicates:
+            _insert_duplicates(conn, duplicates)
+        for column in _data_columns(conn):
+            if column in INDEXED_COLUMNS:
+                conn.execute(
+                    f"CREATE INDEX {_quote('idx_' + column)} "
+                    f"ON documents({_quote(column)})")
+        _write_info(conn, info)
+        conn.commit()
+    finally:
+        conn.close()
+
+    tmp_path.replace(db_path)
+    return db_path
+
+
+def needs_migration(vector_store_path):
+    """
+    Check whether a vector store still has to be migrated from metadata.pkl.
+
+    True if the pickle exists and metadata.db is missing or uses the
+    earlier single-blob row layout.
+    """
+    vector_store_path = Path(vector_store_path)
+    if not (vector_store_path / LEGACY_METADATA_FILENAME).exists():
+        return False
+
+    db_path = vector_store_path / METADATA_DB_FILENAME
+    if not db_path.exists():
+        return True
+
+    conn = sqlite3.connect(db_path)
+    try:
+        return 'row_json' in _data_columns(conn)
+    finally:
+        conn.close()
+
+
+def migrate_pickle_metadata(vector_store_path, remove_pickle=False):
+    """
+    One-time migration of metadata.pkl into metadata.db.
+
+    Args:
+        vector_store_path: Path to the vector store directory
+        remove_pickle: Delete metadata.pkl after a successful migration
+
+    Returns:
+        Path: Path to the written database
+    """
+    vector_store_path = Path(vector_store_path)
+    pickle_path = vector_store_path / LEGACY_METADATA_FILENAME
+    with open(pickle_path, 'rb') as f:
+        metadata = pickle.load(f)
+
+    info = {
+        key: value for key, value in metadata.items()
+        if key not in ('texts', 'dataframe')
+    }
+    db_path = create_metadata_store(
+        vector_store_path / METADATA_DB_FILENAME,
+        metadata['texts'], metadata['dataframe'], info)
+
+    if remove_pickle:
+        pickle_path.unlink()
+
+    return db_path
+
+
+if __name__ == "__main__":
+    from vectorstore import DEFAULT_VECTOR_STORE_PATH
+
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    path = Path(args[0]) if args else DEFAULT_VECTOR_STORE_PATH
+    db_path = migrate_pickle_metadata(
+        path, remove_pickle='--remove-pickle' in sys.argv)
+    print(f"✓ Migrated {path / LEGACY_METADATA_FILENAME} to {db_path}")
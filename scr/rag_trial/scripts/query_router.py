@@ -0,0 +1,203 @@
+"""
+Query Router
+Answers queries that are just a ticket number, Script_ID or KB_Article_ID
+with a direct lookup (vector store doc_key index, then the SQLite
+databases) instead of an embedding call and a vector search
+"""
+
+import os
+import re
+import sys
+import sqlite3
+from pathlib import Path
+
+# Add parent directory to path for db_scripts import
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from db_scripts import db_ticket, db_scripts, db_knowledge_articles
+from db_scripts.db_ticket import retrieve_ticket_by_id_string
+from db_scripts.db_scripts import retrieve_script
+from db_scripts.db_knowledge_articles import retrieve_kb
+from self_healing_pipeline import create_text_from_row, normalize_row_for_vector_store
+
+# Identifier formats, e.g. CS-00012345, SCRIPT-0715, KB-3FFBFE3C70
+ID_PATTERNS = {
+    'ticket': re.compile(r'CS-\d{8}', re.IGNORECASE),
+    'script': re.compile(r'SCRIPT-\d{4,}', re.IGNORECASE),
+    'kb': re.compile(r'KB-[0-9A-F]{6,}', re.IGNORECASE),
+}
+
+# Database holding each kind of identifier
+ID_DATABASES = {
+    'ticket': db_ticket,
+    'script': db_scripts,
+    'kb': db_knowledge_articles,
+}
+
+# Characters allowed around the identifiers of an identifier-only query
+SEPARATORS = re.compile(r'[\s,;]+')
+
+# realpage.db ticket columns -> vector store (final_ver3.xlsx) columns
+TICKET_COLUMNS = {
+    'ticket_id': 'Ticket_Number',
+    'conversation_id': 'Conversation_ID',
+    'channel': 'Channel',
+    'customer_role': 'Customer_Role',
+    'first_tier_agent': 'Agent_Name',
+    'product': 'Product_x',
+    'category': 'Category_x',
+    'issue_summary': 'Issue_Summary',
+    'transcript': 'Transcript',
+    'sentiment': 'Sentiment',
+    'priority': 'Priority',
+    'tier': 'Tier',
+    'module_generated_kb': 'Module_generated_kb',
+    'subject': 'Subject',
+    'description': 'Description',
+    'root_cause': 'Root_Cause',
+    'tags_generated_kb': 'Tags_generated_kb',
+    'kb_article_id': 'KB_Article_ID_x',
+    'script_id': 'Script_ID',
+    'generated_kb_article_id': 'Generated_KB_Article_ID',
+    'source_id': 'Source_ID',
+    'answer_type': 'Answer_Type',
+    'created_at': 'Created_Date',
+}
+
+
+def parse_identifiers(query):
+    """
+    Detect an identifier-only query.
+
+    Args:
+        query: Query text
+
+    Returns:
+        list: (kind, identifier) pairs, kind being 'ticket', 'script' or
+            'kb', or None if the query contains anything but identifiers
+    """
+    tokens = [token for token in SEPARATORS.split(query.strip()) if token]
+    identifiers = []
+    for token in tokens:
+        for kind, pattern in ID_PATTERNS.items():
+            if pattern.fullmatch(token):
+                identifiers.append((kind, token.upper()))
+                break
+        else:
+            return None
+    return identifiers or None
+
+
+def _ticket_to_row(ticket):
+    """Convert a realpage.db ticket to the vector store schema."""
+    row = {column: ticket.get(field) for field, column in TICKET_COLUMNS.items()}
+    row['Resolution'] = ticket.get('edited_resolution') or ticket.get('original_resolution')
+    return row
+
+
+def _lookup_database(kind, identifier):
+    """Fetch an identifier from its database, in the vector store schema."""
+    # sqlite3.connect would create a missing database file
+    if not os.path.exists(ID_DATABASES[kind].get_db_path()):
+        return None
+    if kind == 'ticket':
+        ticket = retrieve_ticket_by_id_string(identifier)
+        return _ticket_to_row(ticket) if ticket else None
+    if kind == 'script':
+        script = retrieve_script(identifier)
+        return normalize_row_for_vector_store(script, 'script') if script else None
+    kb = retrieve_kb(identifier)
+    return normalize_row_for_vector_store(kb, 'kb') if kb else None
+
+
+def lookup_identifier(store, kind, identifier, columns=None):
+    """
+    Resolve one identifier without embedding it.
+
+    The vector store's doc_key index is tried first. A near-duplicate
+    collapsed at ingest has no vector of its own: its own row comes from
+    the duplicates table, with index -1 and duplicate_of set to the
+    canonical vector id. Documents that were never embedded (e.g. a
+    ticket still pending) come from realpage.db, scripts.db or
+    knowledge_articles.db.
+
+    Args:
+        store: VectorStore
+        kind: 'ticket', 'script' or 'kb'
+        identifier: Ticket number, Script_ID or KB_Article_ID
+        columns: Metadata columns to return (default: all)
+
+    Returns:
+        dict: Document in the same shape as a search result (index,
+            distance, similarity_score, data, text, source), or None
+    """
+    metadata_store = store.metadata_store
+    ids = metadata_store.ids_for_keys([identifier])
+    if ids:
+        idx = ids[-1]
+        return {
+            'index': int(idx),
+            'distance': 0.0,
+            'similarity_score': 1.0,
+            'data': store.get_row(idx, columns=columns),
+            'text': store.get_text(idx),
+            'source': 'vector_store'
+        }
+
+    duplicate = metadata_store.get_duplicate(identifier)
+    if duplicate is not None:
+        row = duplicate['row']
+        return {
+            'index': -1,
+            'distance': 0.0,
+            'similarity_score': 1.0,
+            'data': {c: row.get(c) for c in columns} if columns else row,
+            'text': duplicate['text'],
+            'source': 'duplicate',
+            'duplicate_of': int(duplicate['canonical_id'])
+        }
+
+    try:
+        row = _lookup_database(kind, identifier)
+    except sqlite3.Error as e:
+        print(f"⚠ Could not look up {identifier}: {e}")
+        row = None
+    if row is None:
+        return None
+    return {
+        'index': -1,
+        'distance': 0.0,
+        'similarity_score': 1.0,
+        'data': {c: row.get(c) for c in columns} if columns else row,
+        'text': create_text_from_row(row),
+        'source': 'database'
+    }
+
+
+def route_query(store, query, columns=None):
+    """
+    Answer an identifier-only query by direct lookup.
+
+    Args:
+        store: VectorStore
+        query: Query text
+        columns: Metadata columns to return (default: all)
+
+    Returns:
+        list: Documents for the identifiers that were found, or None if
+            the query needs a vector search (it is not identifier-only, or
+            none of its identifiers were found)
+    """
+    identifiers = parse_identifiers(query)
+    if identifiers is None:
+        return None
+
+    documents = []
+    for kind, identifier in identifiers:
+        document = lookup_identifier(store, kind, identifier, columns)
+        if document is None:
+            print(f"⚠ {identifier} not found")
+        else:
+            documents.append(document)
+    return documents or None
@@ -1,92 +1,125 @@
-import os
 import sys
-import numpy as np
-import faiss
-import pickle
-from openai import OpenAI
 from dotenv import load_dotenv
 
+from vectorstore import get_vector_store, parse_filter_args, parse_mode_arg
+from query_router import route_query
+from embeddings import embed_query_for_store
+
 # Load environment variables
 load_dotenv()
 
-def query_vectorstore(query_text, top_k=5):
-    """Query the vector store and return the most similar documents."""
-
-    # Initialize OpenAI client
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-    client = OpenAI(api_key=api_key)
-
-    # Load the FAISS index
-    index_path = "vector_store/faiss_index.bin"
-    index = faiss.read_index(index_path)
-    print(f"Loaded index with {index.ntotal} vectors")
-
-    # Load metadata
-    metadata_path = "vector_store/metadata.pkl"
-    with open(metadata_path, 'rb') as f:
-        metadata = pickle.load(f)
-
-    # Create embedding for query
-    print(f"Creating embedding for query: '{query_text}'")
-    response = client.embeddings.create(
-        input=[query_text],
-        model=metadata['model']
-    )
-    query_embedding = np.array([response.data[0].embedding], dtype=np.float32)
+# Only these columns are read from the metadata store
+DISPLAY_COLUMNS = ['Ticket_Number', 'Product_x', 'Category_x', 'Issue_Summary', 'Resolution']
+
+def print_result(rank, result):
+    """Print the key fields of one result."""
+    doc_data = result['data']
+    if result.get('rrf_score') is not None:
+        print(f"Result {rank} (RRF score: {result['rrf_score']:.4f})")
+    else:
+        print(f"Result {rank} (Distance: {result['distance']:.4f})")
+    print("-" * 80)
+
+    # Display key information
+    if doc_data.get('Ticket_Number'):
+        print(f"Ticket: {doc_data['Ticket_Number']}")
+    if doc_data.get('Product_x'):
+        print(f"Product: {doc_data['Product_x']}")
+    if doc_data.get('Category_x'):
+        print(f"Category: {doc_data['Category_x']}")
+    if doc_data.get('Issue_Summary'):
+        print(f"Issue: {doc_data['Issue_Summary']}")
+    if doc_data.get('Resolution'):
+        print(f"Resolution: {doc_data['Resolution'][:200]}...")
+
+    print()
+
+def query_vectorstore(query_text, top_k=5, filters=None, mode='vector',
+                      vector_store_path=None, client=None):
+    """
+    Query the vector store and return the most similar documents.
+
+    filters restricts the search to documents with matching metadata,
+    e.g. {'Product_x': '...', 'Answer_Type': ['KB', 'Script']}.
+
+    mode is 'vector' (embedding search, the default), 'hybrid' (embedding
+    and BM25 keyword search, fused by rank; results carry an rrf_score
+    instead of a distance) or 'lexical' (keyword search only, no OpenAI
+    call).
+
+    A query that is only ticket numbers, Script_IDs or KB_Article_IDs is
+    answered by direct lookup, without an embedding call.
+
+    vector_store_path and client (an OpenAI-compatible embeddings client)
+    default to the shared store and the provider it was built with.
+    """
+
+    # Get the shared vector store (loaded once per process)
+    store = get_vector_store(vector_store_path)
+    print(f"Using index with {store.ntotal} vectors")
+
+    routed = route_query(store, query_text, columns=DISPLAY_COLUMNS)
+    if routed is not None:
+        print(f"\n{'='*80}")
+        print(f"Direct lookup for: '{query_text}'")
+        print(f"{'='*80}\n")
+        for i, result in enumerate(routed, 1):
+            print_result(i, result)
+        return routed
+
+    query_embedding = None
+    if mode != 'lexical':
+        # Create embedding for query
+        print(f"Creating embedding for query: '{query_text}'")
+        query_embedding = embed_query_for_store(client, store, query_text)
 
     # Search the index
-    distances, indices = index.search(query_embedding, top_k)
+    if mode == 'vector':
+        distances, indices = store.search(query_embedding, top_k, filters=filters)
+        scores = None
+    else:
+        scores, indices = store.hybrid_search(
+            query_embedding, [query_text], top_k, filters=filters, mode=mode)
 
     # Display results
     print(f"\n{'='*80}")
-    print(f"Top {top_k} results for: '{query_text}'")
+    print(f"Top {top_k} results ({mode}) for: '{query_text}'")
     print(f"{'='*80}\n")
 
     results = []
-    for i, (idx, distance) in enumerate(zip(indices[0], distances[0])):
-        print(f"Result {i+1} (Distance: {distance:.4f})")
-        print("-" * 80)
+    for i, idx in enumerate(indices[0]):
+        if idx < 0:
+            continue
 
         # Get the original data
-        doc_data = metadata['dataframe'][idx]
-        text = metadata['texts'][idx]
-
-        # Display key information
-        if doc_data.get('Ticket_Number'):
-            print(f"Ticket: {doc_data['Ticket_Number']}")
-        if doc_data.get('Product_x'):
-            print(f"Product: {doc_data['Product_x']}")
-        if doc_data.get('Category_x'):
-            print(f"Category: {doc_data['Category_x']}")
-        if doc_data.get('Issue_Summary'):
-            print(f"Issue: {doc_data['Issue_Summary']}")
-        if doc_data.get('Resolution'):
-            print(f"Resolution: {doc_data['Resolution'][:200]}...")
-
-        print()
-
-        results.append({
+        result = {
             'index': int(idx),
-            'distance': float(distance),
-            'data': doc_data,
-            'text': text
-        })
+            'distance': float(distances[0][i]) if scores is None else None,
+            'rrf_score': float(scores[0][i]) if scores is not None else None,
+            'data': store.get_row(idx, columns=DISPLAY_COLUMNS),
+            'text': store.get_text(idx)
+        }
+        print_result(i + 1, result)
+        results.append(result)
 
     return results
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python query_vectorstore.py 'your query here' [top_k]")
+    positional = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not positional:
+        print("Usage: python query_vectorstore.py 'your query here' [top_k] [filters]")
         print("\nExample: python query_vectorstore.py 'login issues' 5")
+        print("         python query_vectorstore.py 'login issues' 5 --answer-type=KB,Script")
+        print("         python query_vectorstore.py 'login issues' 5 --mode=lexical")
+        print("\nFilters: --product=NAME, --category=NAME, --answer-type=NAME[,NAME...]")
+        print("Mode: --mode=vector|hybrid|lexical (default: vector)")
         sys.exit(1)
 
-    query = sys.argv[1]
-    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    query = positional[0]
+    top_k = int(positional[1]) if len(positional) > 1 else 5
+    filters = parse_filter_args(sys.argv[1:])
 
-    results = query_vectorstore(query, top_k)
+    results = query_vectorstore(query, top_k, filters=filters, mode=parse_mode_arg(sys.argv[1:]))
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,6 @@
 import os
 import sys
 import sqlite3
-import pickle
-import numpy as np
-import faiss
 from openai import OpenAI
 from pathlib import Path
 from datetime import datetime
@@ -11,6 +8,16 @@ from dotenv import load_dotenv
 import uuid
 import json
 
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from vectorstore import get_vector_store
+from embeddings import embed_for_store
+from metadata_store import document_key
+from ingest_queue import submit_and_wait
+from db_scripts.db_knowledge_articles import retrieve_kb
+from db_scripts.db_scripts import retrieve_script
+
 # Load environment variables
 load_dotenv()
 
@@ -438,6 +445,12 @@ def update_vector_store(new_row_data, data_type, vector_store_path=None):
     Update the FAISS vector store by adding a new embedding for the new row.
     Expects new_row_data to be in the 24-field normalized format.
 
+    The write goes through the ingestion queue, so concurrent pipeline
+    runs (in any process) are applied one at a time by a single writer and
+    no update is lost. The row is upserted by its Script_ID /
+    KB_Article_ID, so an earlier vector for the same script or article is
+    replaced.
+
     Args:
         new_row_data: Dictionary containing the normalized 24-field row data
         data_type: Type of data ('script' or 'kb') - for logging only
@@ -446,74 +459,100 @@ def update_vector_store(new_row_data, data_type, vector_store_path=None):
     Returns:
         bool: True if successful, False otherwise
     """
-    # Set up paths
-    if vector_store_path is None:
-        script_dir = Path(__file__).parent
-        vector_store_path = script_dir.parent / "vector_store"
-
-    index_path = Path(vector_store_path) / "faiss_index.bin"
-    metadata_path = Path(vector_store_path) / "metadata.pkl"
-
     print(f"\n{'='*80}")
     print("UPDATING VECTOR STORE")
     print(f"{'='*80}")
     print(f"Data type: {data_type}")
-    print(f"Vector store: {vector_store_path}")
-
-    # Initialize OpenAI client
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-    client = OpenAI(api_key=api_key)
-
-    # Load existing FAISS index
-    print("Loading existing FAISS index...")
-    index = faiss.read_index(str(index_path))
-    print(f"  Current vectors: {index.ntotal}")
 
-    # Load metadata
-    print("Loading metadata...")
-    with open(metadata_path, 'rb') as f:
-        metadata = pickle.load(f)
+    # Get the shared vector store (loaded once per process)
+    store = get_vector_store(vector_store_path)
+    print(f"Vector store: {store.vector_store_path}")
+    print(f"  Current vectors: {store.ntotal}")
 
     # Create text representation using the same format as ingest_data.py
     print("Creating text representation...")
     text = create_text_from_row(new_row_data)
     print(f"  Text length: {len(text)} chars")
 
-    # Generate embedding
-    print(f"Generating embedding using {metadata['model']}...")
-    response = client.embeddings.create(
-        input=[text],
-        model=metadata['model']
-    )
-    embedding = np.array([response.data[0].embedding], dtype=np.float32)
+    # Generate embedding (in parallel with other runs; only the write is serialized)
+    print(f"Generating embedding using {store.model}...")
+    embedding = embed_for_store(None, store, [text])
     print(f"  Embedding dimension: {embedding.shape[1]}")
 
-    # Add to FAISS index (incremental update)
-    print("Adding embedding to FAISS index...")
-    index.add(embedding)
-    print(f"  New total vectors: {index.ntotal}")
+    # Submit to the single writer and wait for its acknowledgement
+    print("Submitting embedding to the ingestion queue...")
+    kind = 'add' if document_key(new_row_data) is None else 'upsert'
+    result = submit_and_wait(kind, embedding, [new_row_data], [text],
+                             vector_store_path=vector_store_path)
+    if result.get('deleted'):
+        print(f"  Replaced {result['deleted']} earlier vector(s)")
+    if result.get('duplicates'):
+        print("  Near-duplicate of an existing document; mapped to it instead of adding a vector")
 
-    # Update metadata
-    print("Updating metadata...")
-    metadata['texts'].append(text)
-    metadata['dataframe'].append(new_row_data)
-    metadata['total_vectors'] = index.ntotal
+    print(f"\n✓ Vector store updated successfully")
+    print(f"  Total vectors: {store.ntotal - store.n_deleted}")
 
-    # Save updated index
-    print("Saving updated FAISS index...")
-    faiss.write_index(index, str(index_path))
+    return True
 
-    # Save updated metadata
-    print("Saving updated metadata...")
-    with open(metadata_path, 'wb') as f:
-        pickle.dump(metadata, f)
 
-    print(f"\n✓ Vector store updated successfully")
-    print(f"  Total vectors: {index.ntotal}")
+def sync_knowledge_article(kb_id, vector_store_path=None):
+    """
+    Bring the vector store in line with knowledge_articles.db for one article.
+
+    update_kb() calls this after every successful update; call it
+    directly after changing knowledge_articles.db any other way. The
+    article's vector is replaced with one for
+    its current content, or deleted if the article is gone or its Status
+    is not 'Active'.
+
+    Args:
+        kb_id: KB_Article_ID of the article
+        vector_store_path: Path to vector store directory (optional)
+
+    Returns:
+        bool: True if the article is now searchable, False if it was removed
+    """
+    kb = retrieve_kb(kb_id)
+    if kb is None or kb.get('Status') != 'Active':
+        removed = submit_and_wait('delete', keys=[kb_id],
+                                  vector_store_path=vector_store_path)['deleted']
+        print(f"✓ Removed {removed} vector(s) for inactive KB article {kb_id}")
+        return False
+
+    update_vector_store(
+        normalize_row_for_vector_store(kb, 'kb'), 'kb', vector_store_path)
+    return True
 
+
+def sync_script(script_id, vector_store_path=None):
+    """
+    Bring the vector store in line with scripts.db for one script.
+
+    update_script() calls this after every successful update; call it
+    directly after changing scripts.db any other way. The script's vector is replaced with one
+    for its current content, or deleted if the script no longer exists.
+
+    Args:
+        script_id: Script_ID of the script
+        vector_store_path: Path to vector store directory (optional)
+
+    Returns:
+        bool: True if the script is now searchable, False if it was removed
+    """
+    store = get_vector_store(vector_store_path)
+    script = retrieve_script(script_id)
+    if script is None:
+        removed = submit_and_wait('delete', keys=[script_id],
+                                  vector_store_path=vector_store_path)['deleted']
+        print(f"✓ Removed {removed} vector(s) for deleted script {script_id}")
+        return False
+
+    # Keep the issue summary the script was originally generated for
+    current = store.get_document(script_id, columns=['Issue_Summary']) or {}
+    update_vector_store(
+        normalize_row_for_vector_store(
+            script, 'script', current.get('Issue_Summary') or ''),
+        'script', vector_store_path)
     return True
 
 
@@ -0,0 +1,2165 @@
+"""
+Shared Vector Store for RAG System
+Loads the FAISS index and metadata once per process and serves every caller
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import faiss
+
+from metadata_store import (
+    MetadataStore, METADATA_DB_FILENAME, document_key, needs_migration,
+    migrate_pickle_metadata
+)
+
+DEFAULT_VECTOR_STORE_PATH = Path(__file__).parent.parent / "vector_store"
+INDEX_FILENAME = "faiss_index.bin"
+VECTORS_FILENAME = "vectors.npy"
+DELTA_FILENAME = "delta.wal"
+PCA_FILENAME = "pca.bin"
+SHARDS_DIRNAME = "shards"
+
+# Versioned layout: vector_store/CURRENT names the live directory under
+# vector_store/generations/. Older generations are kept briefly for readers
+# that have not switched yet.
+CURRENT_FILENAME = "CURRENT"
+GENERATIONS_DIRNAME = "generations"
+KEEP_GENERATIONS = 3
+REFRESH_INTERVAL = 2.0
+
+# Shard by a metadata column, or spread vectors evenly by id
+SHARD_BY_OPTIONS = {'product': 'Product_x', 'hash': None}
+UNASSIGNED_SHARD = "_unassigned"
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'sq8', 'ivfpq')
+# Lossy index types: candidates are re-ranked against the full vectors
+COMPRESSED_INDEX_TYPES = ('sq8', 'ivfpq')
+DEFAULT_RERANK_FACTOR = 4
+
+# Filtered searches over at most this many vectors skip the index and
+# compute exact distances on the matching full vectors
+EXACT_FILTER_THRESHOLD = 2048
+FILTER_CACHE_SIZE = 256
+
+# Ways to store embeddings below the model's full dimension: ask the API for
+# fewer `dimensions` (text-embedding-3 models), or project with a PCA
+# matrix fitted at ingest
+REDUCTION_METHODS = ('api', 'pca')
+
+# Near-duplicate collapse is opt-in (ingest_data.py --dedup-threshold):
+# documents whose embedding is within the threshold's squared L2 distance
+# of an earlier one are collapsed into it at ingest, and on later adds.
+# 0.02 is ~0.99 cosine similarity for unit-length OpenAI embeddings
+DEFAULT_DEDUP_THRESHOLD = 0
+SUGGESTED_DEDUP_THRESHOLD = 0.02
+
+# Hybrid retrieval: each retriever contributes HYBRID_CANDIDATES ranked ids
+# (or top_k if larger), fused with reciprocal rank fusion
+RETRIEVAL_MODES = ('vector', 'hybrid', 'lexical')
+RRF_K = 60
+HYBRID_CANDIDATES = 50
+
+# Zero-copy mapping of index data where supported (faiss >= 1.10)
+MMAP_IO_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+
+# The delta segment is folded into the base index in the background once it
+# holds COMPACT_MAX_DELTA vectors or its oldest vector is COMPACT_MAX_AGE
+# seconds old (checked every COMPACT_CHECK_INTERVAL seconds)
+COMPACT_MAX_DELTA = 1024
+COMPACT_MAX_AGE = 300
+COMPACT_CHECK_INTERVAL = 30
+
+
+class StoreGeneration:
+    """
+    One immutable snapshot of the vector store on disk, and its loaded state.
+
+    A generation directory holds the base index (or shards), vectors.npy,
+    metadata.db, delta.wal and, for PCA-reduced stores, pca.bin. Rebuilds
+    and compactions write a new generation and publish it by atomically
+    replacing the CURRENT pointer file, so a reader never opens a
+    half-written index/metadata pair.
+    Stores created before generations existed are a single generation
+    stored directly in the vector store directory (name None).
+    """
+
+    def __init__(self, path, name=None):
+        """
+        Args:
+            path: Generation directory
+            name: Generation name from CURRENT (None for a legacy store)
+        """
+        self.path = Path(path)
+        self.name = name
+        self.index_path = self.path / INDEX_FILENAME
+        self.metadata_db_path = self.path / METADATA_DB_FILENAME
+        self.vectors_path = self.path / VECTORS_FILENAME
+        self.delta_path = self.path / DELTA_FILENAME
+        self.pca_path = self.path / PCA_FILENAME
+
+        self.index = None
+        self.pca = None
+        self.metadata = None
+        self.metadata_store = None
+        self.vectors = None
+        self.delta = None
+        self.deleted = _Tombstones()
+        self.index_is_mapped = False
+        self.filter_cache = {}
+        self._disk_state = None
+
+    @property
+    def index_params(self):
+        return (self.metadata or {}).get('index', {'index_type': 'flat'})
+
+    @property
+    def is_compressed(self):
+        return self.index_params.get('index_type') in COMPRESSED_INDEX_TYPES
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal + len(self.delta)
+
+    def load(self, mmap=False, index=None):
+        """
+        Open the generation's index, vectors, metadata and delta log.
+
+        Args:
+            mmap: Memory-map the index
+            index: Already-built index for this generation (used by
+                compaction to skip re-reading the file it just wrote)
+
+        Returns:
+            StoreGeneration: self
+        """
+        # Taken first, so a write that lands during the load is caught up on
+        self._disk_state = self.disk_state()
+        self.metadata_store = MetadataStore(self.metadata_db_path)
+        # Store-level info only (model, dimension, index, ...); rows are lazy
+        self.metadata = self.metadata_store.get_info()
+
+        if index is not None:
+            pass
+        elif 'shards' in self.metadata:
+            # Shards are opened lazily, on the first search that needs them
+            index = ShardedIndex(self.path, self.metadata['shards'], mmap=mmap)
+        elif not self.index_path.exists():
+            raise FileNotFoundError(
+                f"FAISS index not found at {self.index_path}")
+        elif mmap:
+            index = faiss.read_index(str(self.index_path), MMAP_IO_FLAG)
+            self.index_is_mapped = True
+        else:
+            index = faiss.read_index(str(self.index_path))
+
+        # Full vectors are only read for re-ranking, so keep them on disk
+        if self.vectors_path.exists():
+            self.vectors = np.load(self.vectors_path, mmap_mode='r')
+        elif self.is_compressed:
+            raise FileNotFoundError(
+                f"Full vectors for re-ranking not found at {self.vectors_path}")
+
+        # Projection from the model's output to the index dimension
+        if self.pca_path.exists():
+            self.pca = faiss.read_VectorTransform(str(self.pca_path))
+
+        # Replay vectors added since the base index was last compacted
+        self.delta = DeltaSegment(self.delta_path, index.d)
+        self.delta.replay(index.ntotal, self.metadata_store.count())
+        self.deleted = _Tombstones(self.metadata_store.deleted_ids())
+        self.index = index
+        return self
+
+    def disk_state(self):
+        """Size and modification time of the files writers append to."""
+        state = []
+        for path in (self.delta_path, self.metadata_db_path):
+            try:
+                stat = path.stat()
+                state.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def changed_on_disk(self):
+        """True if a writer has appended to this generation since it was loaded or caught up."""
+        return self.disk_state() != self._disk_state
+
+    def catch_up(self):
+        """
+        Pick up rows, delta vectors and tombstones written since the load.
+
+        Writers in other processes append to the same generation's log and
+        metadata.db without publishing a new generation, so readers replay
+        what was appended instead of waiting for the next compaction.
+
+        Returns:
+            int: Number of delta vectors added
+        """
+        self._disk_state = self.disk_state()
+        self.metadata_store.clear_cache()
+        n_added = self.delta.catch_up(self.metadata_store.count())
+        self.deleted = _Tombstones(self.metadata_store.deleted_ids())
+        self.metadata['total_vectors'] = self.ntotal
+        self.filter_cache.clear()
+        return n_added
+
+    def describe(self, mmap=False):
+        """One-line summary for load messages."""
+        mode = " (memory-mapped)" if mmap else ""
+        if isinstance(self.index, ShardedIndex):
+            mode += f" in {len(self.index.shard_names)} lazy shards"
+        if len(self.delta):
+            mode += f", {len(self.delta)} in the delta segment"
+        if len(self.deleted):
+            mode += f", {len(self.deleted)} deleted"
+        if self.name:
+            mode += f" [{self.name}]"
+        return f"{self.ntotal} documents{mode}"
+
+
+class VectorStore:
+    """
+    Long-lived wrapper around the FAISS index and its metadata.
+
+    The index is deserialized once, on first use, and then reused for every
+    search. Metadata rows live in metadata.db and are fetched lazily by
+    vector id. Use get_vector_store() to obtain the shared instance instead
+    of constructing one directly.
+
+    With mmap=True the index is mapped read-only with FAISS IO_FLAG_MMAP,
+    so startup is near-instant and the OS shares the pages between worker
+    processes on the same host.
+
+    add() appends to a small DeltaSegment (and its write-ahead log) instead
+    of rewriting the index; searches merge base and delta results, and a
+    background thread compacts the delta into the base index.
+
+    Documents are addressed by a stable key (ticket number, KB article id
+    or script id). upsert() and delete() tombstone the vectors of replaced
+    or removed documents, and tombstoned vectors are never returned.
+
+    The files on disk are versioned in generations (see StoreGeneration).
+    Searches check the CURRENT pointer every REFRESH_INTERVAL seconds; a
+    new generation is loaded in the background and swapped in with one
+    reference assignment, so in-flight searches finish on the old one.
+    Vectors, rows and tombstones that another process appended to the
+    current generation are replayed at the same check.
+    """
+
+    def __init__(self, vector_store_path=None, mmap=False):
+        """
+        Initialize the vector store.
+
+        Args:
+            vector_store_path: Path to the vector store directory
+                (defaults to rag_trial/vector_store)
+            mmap: Memory-map the index (read-only until the first add())
+        """
+        self.vector_store_path = Path(
+            vector_store_path or DEFAULT_VECTOR_STORE_PATH)
+        self.mmap = mmap
+
+        self._generation = None
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compact_event = threading.Event()
+        self._compactor = None
+        self._refresh_checked_at = 0.0
+        self._refreshing = False
+
+        # Set to False when an external single writer (ingest_queue.py)
+        # decides when to compact
+        self.auto_compact = True
+
+        # The ingest_queue.IngestWriter holding the writer lock in this
+        # process; the store may only be mutated while it is set
+        self.writer = None
+
+    def load(self):
+        """Load the current generation if not already loaded."""
+        if self._generation is not None:
+            return self
+
+        with self._lock:
+            if self._generation is not None:
+                return self
+
+            name = read_current_generation(self.vector_store_path)
+            if name is None and needs_migration(self.vector_store_path):
+                print("Migrating metadata.pkl to metadata.db (one-time)...")
+                migrate_pickle_metadata(self.vector_store_path)
+
+            generation = StoreGeneration(
+                generation_path(self.vector_store_path, name), name).load(self.mmap)
+            self._generation = generation
+            self._refresh_checked_at = time.time()
+            print(f"✓ Loaded vector store with {generation.describe(self.mmap)}")
+
+        return self
+
+    # The current generation's state, for callers and tools that inspect it
+
+    @property
+    def generation(self):
+        """Name of the loaded generation (None for a legacy, unversioned store)."""
+        return self.load()._generation.name
+
+    @property
+    def index(self):
+        return self.load()._generation.index
+
+    @property
+    def vectors(self):
+        return self.load()._generation.vectors
+
+    @property
+    def delta(self):
+        return self.load()._generation.delta
+
+    @property
+    def metadata(self):
+        return self.load()._generation.metadata
+
+    @property
+    def metadata_store(self):
+        return self.load()._generation.metadata_store
+
+    @property
+    def index_path(self):
+        return self.load()._generation.index_path
+
+    @property
+    def metadata_db_path(self):
+        return self.load()._generation.metadata_db_path
+
+    @property
+    def vectors_path(self):
+        return self.load()._generation.vectors_path
+
+    @property
+    def model(self):
+        """Embedding model the index was built with."""
+        return self.metadata.get('model', 'text-embedding-3-small')
+
+    @property
+    def dimension(self):
+        """Embedding dimension of the index."""
+        return self.index.d
+
+    @property
+    def embedding_dimensions(self):
+        """`dimensions` to request from the embeddings API (None: the model's full output)."""
+        return self.metadata.get('embedding_dimensions')
+
+    def reduce_embeddings(self, embeddings):
+        """
+        Bring embeddings to the index dimension.
+
+        Full-size model output is projected with the store's PCA matrix,
+        or truncated and re-normalized for stores built with the API's
+        `dimensions` option (what the API itself does for text-embedding-3
+        models). Embeddings already at the index dimension are unchanged.
+
+        Args:
+            embeddings: Array of shape (n, model or index dimension)
+
+        Returns:
+            numpy.ndarray of shape (n, self.dimension)
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        dimension = self.dimension
+        if embeddings.shape[1] == dimension:
+            return embeddings
+
+        pca = self.load()._generation.pca
+        if pca is not None and embeddings.shape[1] == pca.d_in:
+            return pca.apply(embeddings)
+        reduction = self.metadata.get('reduction') or {}
+        if reduction.get('method') == 'api' and embeddings.shape[1] > dimension:
+            return truncate_embeddings(embeddings, dimension)
+        raise ValueError(
+            f"Embedding dimension {embeddings.shape[1]} does not match the "
+            f"index dimension {dimension}")
+
+    @property
+    def ntotal(self):
+        """Number of vectors in the base index and delta segment (including deleted ones)."""
+        return self.load()._generation.ntotal
+
+    @property
+    def n_deleted(self):
+        """Number of tombstoned vectors."""
+        return len(self.load()._generation.deleted)
+
+    @property
+    def n_indexed(self):
+        """Number of live (not deleted) vectors in the base index, excluding the delta segment."""
+        generation = self.load()._generation
+        base = generation.index.ntotal
+        return base - int(np.count_nonzero(generation.deleted.ids < base))
+
+    @property
+    def is_sharded(self):
+        """True if the index is split into per-product or hashed shards."""
+        return isinstance(self.index, ShardedIndex)
+
+    @property
+    def index_params(self):
+        """Index type and build settings recorded at ingest time."""
+        return self.load()._generation.index_params
+
+    @property
+    def is_compressed(self):
+        """True if the index stores lossy codes that need re-ranking."""
+        return self.load()._generation.is_compressed
+
+    def refresh(self):
+        """
+        Switch to the newest published generation, if there is one.
+
+        The new generation is loaded before it is swapped in, so searches
+        running meanwhile are not blocked.
+
+        Returns:
+            bool: True if a new generation was loaded
+        """
+        self.load()
+        name = read_current_generation(self.vector_store_path)
+        if name == self._generation.name:
+            return False
+
+        generation = StoreGeneration(
+            generation_path(self.vector_store_path, name), name).load(self.mmap)
+        with self._lock:
+            if self._generation.name == name:
+                return False
+            self._generation = generation
+        print(f"✓ Switched to vector store {generation.describe(self.mmap)}")
+        return True
+
+    def _maybe_refresh(self):
+        """
+        Pick up other processes' writes (checked at most every REFRESH_INTERVAL).
+
+        Appends to the current generation are replayed in place; a new
+        generation (CURRENT changed) is loaded in the background.
+        """
+        now = time.time()
+        if self._refreshing or now - self._refresh_checked_at < REFRESH_INTERVAL:
+            return
+        self._refresh_checked_at = now
+        generation = self._generation
+        if read_current_generation(self.vector_store_path) == generation.name:
+            if generation.changed_on_disk():
+                with self._lock:
+                    generation.catch_up()
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠ Could not load the new vector store generation: {e}")
+            finally:
+                self._refreshing = False
+
+        self._refreshing = True
+        threading.Thread(target=run, name="vector-store-refresh", daemon=True).start()
+
+    def _reader_generation(self):
+        """Generation this thread last searched, so its result ids resolve consistently."""
+        self.load()
+        return getattr(self._local, 'generation', None) or self._generation
+
+    def search(self, query_embeddings, top_k=5, filters=None):
+        """
+        Search the index for the nearest neighbours of each query.
+
+        Compressed indexes (SQ8 / IVF-PQ) fetch extra candidates and
+        re-rank them by exact distance against the stored full vectors.
+
+        Args:
+            query_embeddings: Array of shape (n_queries, dimension)
+            top_k: Number of results per query
+            filters: Metadata filters, e.g. {'Product_x': 'PropertySuite',
+                'Answer_Type': ['KB', 'Script']}. A scalar value is an
+                equality filter, a list/tuple/set is an IN filter; all
+                filters must match. Only matching vectors are searched.
+
+        Returns:
+            Tuple (distances, indices) as returned by faiss, both of
+            shape (n_queries, top_k). Missing results have index -1.
+            get_row()/get_rows() in the same thread resolve the indices
+            against the same generation, even if a newer one is swapped in.
+        """
+        self.load()._maybe_refresh()
+        generation = self._generation
+        self._local.generation = generation
+
+        query_embeddings = self.reduce_embeddings(query_embeddings)
+
+        ids = None
+        if filters:
+            ids = self.matching_ids(filters, generation)
+            if len(ids) == 0:
+                return (np.full((len(query_embeddings), top_k), np.inf, dtype=np.float32),
+                        np.full((len(query_embeddings), top_k), -1, dtype=np.int64))
+
+        delta = generation.delta
+        deleted = generation.deleted
+        results = self._search_base(generation, query_embeddings, top_k, filters, ids, deleted)
+        if len(delta) == 0:
+            return results
+        # Filtered ids already exclude tombstones
+        exclude = deleted.ids if ids is None else None
+        return merge_results(
+            [results, delta.search(query_embeddings, top_k, ids, exclude)], top_k)
+
+    def lexical_search(self, query_texts, top_k=5, filters=None):
+        """
+        BM25 keyword search over the embedded texts (no embeddings needed).
+
+        Args:
+            query_texts: Query strings
+            top_k: Number of results per query
+            filters: Metadata filters (see search())
+
+        Returns:
+            Tuple (scores, indices) of shape (n_queries, top_k): BM25
+            scores (higher is better) and vector ids, -1 if missing
+        """
+        self.load()._maybe_refresh()
+        generation = self._generation
+        self._local.generation = generation
+        return self._lexical_search(generation, query_texts, top_k, filters)
+
+    def _lexical_search(self, generation, query_texts, top_k, filters=None):
+        scores = np.zeros((len(query_texts), top_k), dtype=np.float32)
+        indices = np.full((len(query_texts), top_k), -1, dtype=np.int64)
+        for q, text in enumerate(query_texts):
+            hits = generation.metadata_store.lexical_search(text, top_k, filters)
+            for rank, (idx, bm25) in enumerate(hits):
+                # SQLite's bm25() is negated so that lower sorts first
+                scores[q, rank] = -bm25
+                indices[q, rank] = idx
+        return scores, indices
+
+    def hybrid_search(self, query_embeddings, query_texts, top_k=5, filters=None,
+                      mode='hybrid'):
+        """
+        Search with vectors and keywords and fuse the rankings.
+
+        The vector and BM25 result lists are combined with reciprocal
+        rank fusion, so documents that share exact error strings or
+        product names with the query are found even when their embedding
+        is not among the nearest neighbours.
+
+        Args:
+            query_embeddings: Array of shape (n_queries, dimension), or
+                None in 'lexical' mode
+            query_texts: Query strings (same order as query_embeddings)
+            top_k: Number of results per query
+            filters: Metadata filters (see search())
+            mode: 'hybrid' (vector + BM25) or 'lexical' (BM25 only, for
+                when the embedding API is slow or unavailable)
+
+        Returns:
+            Tuple (scores, indices) of shape (n_queries, top_k). Scores are
+            fused RRF scores scaled to (0, 1]; 1 means ranked first by
+            every retriever. Missing results have index -1.
+        """
+        if mode not in ('hybrid', 'lexical'):
+            raise ValueError(f"Unknown hybrid search mode: {mode}")
+        depth = max(top_k, HYBRID_CANDIDATES)
+
+        rankings = []
+        if mode == 'hybrid':
+            rankings.append(self.search(query_embeddings, depth, filters=filters)[1])
+            generation = self._local.generation
+        else:
+            self.load()._maybe_refresh()
+            generation = self._generation
+            self._local.generation = generation
+        rankings.append(self._lexical_search(generation, query_texts, depth, filters)[1])
+
+        return reciprocal_rank_fusion(rankings, top_k)
+
+    def _search_base(self, generation, query_embeddings, top_k, filters=None, ids=None,
+                     deleted=None):
+        """Search the base index (optionally only the given filtered ids)."""
+        index = generation.index
+        if filters:
+            return self._filtered_search(
+                generation, index, query_embeddings, top_k, filters, ids)
+
+        params = None
+        if deleted is not None and len(deleted):
+            params = search_parameters(index, deleted.selector)
+
+        if generation.is_compressed:
+            return search_with_rerank(
+                index, generation.vectors, query_embeddings, top_k,
+                generation.index_params.get('rerank_factor', DEFAULT_RERANK_FACTOR),
+                params=params)
+
+        if params is not None:
+            return index.search(query_embeddings, top_k, params=params)
+        return index.search(query_embeddings, top_k)
+
+    def matching_ids(self, filters, generation=None):
+        """
+        Get the vector ids whose metadata matches the filters.
+
+        Args:
+            filters: Metadata filters (see search())
+            generation: Generation to filter (default: current)
+
+        Returns:
+            numpy.ndarray: Sorted int64 vector ids
+        """
+        generation = generation or self.load()._generation
+        key = tuple(sorted(
+            (column, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+            for column, value in filters.items()))
+
+        ids = generation.filter_cache.get(key)
+        if ids is None:
+            ids = np.array(generation.metadata_store.filter_ids(filters), dtype=np.int64)
+            with self._lock:
+                if len(generation.filter_cache) >= FILTER_CACHE_SIZE:
+                    generation.filter_cache.clear()
+                generation.filter_cache[key] = ids
+        return ids
+
+    def _filtered_search(self, generation, index, query_embeddings, top_k, filters, ids):
+        """Search only the base vectors whose metadata matches the filters."""
+        # Ids past the base index live in the delta segment
+        ids = ids[ids < index.ntotal]
+        if len(ids) == 0:
+            return (np.full((len(query_embeddings), top_k), np.inf, dtype=np.float32),
+                    np.full((len(query_embeddings), top_k), -1, dtype=np.int64))
+
+        # Small subsets: exact search over just those vectors beats any index
+        if generation.vectors is not None and len(ids) <= EXACT_FILTER_THRESHOLD:
+            return exact_subset_search(generation.vectors, ids, query_embeddings, top_k)
+
+        if isinstance(index, ShardedIndex):
+            # A filter on the shard column only needs the matching shards
+            index = index.subset(index.shards_for_filters(filters))
+
+        selector = faiss.IDSelectorBatch(ids)
+        params = search_parameters(index, selector)
+
+        if generation.is_compressed:
+            return search_with_rerank(
+                index, generation.vectors, query_embeddings, top_k,
+                generation.index_params.get('rerank_factor', DEFAULT_RERANK_FACTOR),
+                params=params)
+
+        return index.search(query_embeddings, top_k, params=params)
+
+    def get_rows(self, indices, columns=None):
+        """
+        Get the metadata rows stored for a set of vectors.
+
+        Args:
+            indices: Vector positions, e.g. a row of search() indices
+                (negative "no result" entries are skipped)
+            columns: Columns to fetch (default: all)
+
+        Returns:
+            list: Metadata dicts, in the order of indices
+        """
+        return self._reader_generation().metadata_store.get_rows(
+            [i for i in indices if i >= 0], columns)
+
+    def get_row(self, idx, columns=None):
+        """
+        Get the metadata row stored for a vector.
+
+        Args:
+            idx: Vector position in the index
+            columns: Columns to fetch (default: all)
+
+        Returns:
+            dict: Original dataframe record for the vector
+        """
+        return self._reader_generation().metadata_store.get_row(idx, columns)
+
+    def get_document(self, key, columns=None):
+        """
+        Get the current metadata row of a document by its stable key.
+
+        Args:
+            key: Document key (ticket number, "<ticket>/<answer id>", KB
+                article id or script id)
+            columns: Columns to fetch (default: all)
+
+        Returns:
+            dict: Metadata row of the live vector, or for a collapsed
+                near-duplicate its own row (recorded at collapse time), or
+                None if not found
+        """
+        metadata_store = self.metadata_store
+        ids = metadata_store.ids_for_keys([key])
+        if ids:
+            return metadata_store.get_row(ids[-1], columns)
+        duplicate = metadata_store.get_duplicate(key)
+        if duplicate is None:
+            return None
+        row = duplicate['row']
+        return {c: row.get(c) for c in columns} if columns else row
+
+    def get_text(self, idx):
+        """
+        Get the text that was embedded for a vector.
+
+        Args:
+            idx: Vector position in the index
+
+        Returns:
+            str: Embedded text
+        """
+        return self._reader_generation().metadata_store.get_text(idx)
+
+    def index_file_size(self):
+        """Size in bytes of the index file(s) on disk."""
+        index = self.index
+        if isinstance(index, ShardedIndex):
+            return index.file_size()
+        return os.path.getsize(self.index_path)
+
+    def _writable_generation(self):
+        """
+        The newest generation, for a write (caller holds self._lock).
+
+        A writer must never append to a generation that has been
+        superseded (e.g. by a re-ingest), or its writes would be lost.
+        """
+        self.load()
+        if read_current_generation(self.vector_store_path) != self._generation.name:
+            self.refresh()
+        return self._generation
+
+    def _check_writer(self):
+        """
+        Refuse a write unless this process holds the ingestion writer lock.
+
+        New ids are assigned from this process's view of the store, which
+        is only guaranteed to be current under that lock.
+        """
+        if self.writer is None:
+            raise RuntimeError(
+                "Vector store writes require the writer lock; submit them with "
+                "ingest_queue.submit_and_wait() or through an IngestWriter")
+
+    def add(self, embeddings, rows, texts, compact=False):
+        """
+        Add new vectors with their metadata rows.
+
+        The vectors are appended to the delta segment's write-ahead log, so
+        the cost does not grow with the corpus; the base index is rewritten
+        later by compaction. If the store was built with deduplication
+        (ingest_data.py --dedup-threshold), rows whose embedding nearly
+        matches a live vector are recorded as its duplicates instead of
+        being added.
+
+        Args:
+            embeddings: Array of shape (n, dimension)
+            rows: List of n metadata dictionaries
+            texts: List of n embedded texts
+            compact: If True, fold the delta into the base index now
+                instead of waiting for background compaction
+
+        Returns:
+            int: Total number of vectors after the insert
+
+        Raises:
+            RuntimeError: If this process does not hold the writer lock
+        """
+        self._check_writer()
+        return self._add(embeddings, rows, texts, compact)[0]
+
+    def _add(self, embeddings, rows, texts, compact=False, replaces=()):
+        """
+        add(), also returning how many rows were collapsed as duplicates.
+
+        replaces are ids about to be tombstoned by upsert(); they are never
+        treated as the canonical copy of a new row.
+        """
+        embeddings = self.reduce_embeddings(embeddings)
+        if not (len(embeddings) == len(rows) == len(texts)):
+            raise ValueError(
+                "embeddings, rows and texts must have the same length")
+
+        with self._lock:
+            generation = self._writable_generation()
+            start_id = generation.ntotal
+
+            duplicates = []
+            threshold = generation.metadata.get('dedup_threshold')
+            if threshold:
+                targets, distances = self._duplicate_targets(
+                    embeddings, threshold, start_id, replaces)
+                duplicates = [(targets[i], distances[i], texts[i], rows[i])
+                              for i in np.flatnonzero(targets >= 0)]
+                keep = targets < 0
+                embeddings = embeddings[keep]
+                rows = [row for row, k in zip(rows, keep) if k]
+                texts = [text for text, k in zip(texts, keep) if k]
+
+            ids = np.arange(start_id, start_id + len(embeddings), dtype=np.int64)
+
+            # Vectors reach the log before their rows, so a crash in between
+            # leaves log records without rows, which replay() drops
+            if len(ids):
+                generation.delta.append(ids, embeddings)
+            total = generation.ntotal
+            generation.metadata['total_vectors'] = total
+            generation.metadata_store.add(
+                start_id, texts, rows, info={'total_vectors': total},
+                duplicates=duplicates)
+            generation.filter_cache.clear()
+
+        if compact:
+            self.compact()
+        else:
+            self._schedule_compaction()
+
+        return total, len(duplicates)
+
+    def _duplicate_targets(self, embeddings, threshold, start_id, replaces=()):
+        """
+        Find the vector each new embedding should collapse into.
+
+        Returns:
+            Tuple (targets, distances): the vector id of the canonical copy
+            (an existing live vector, or an earlier new vector numbered
+            from start_id as if only kept ones were added), -1 to keep it
+        """
+        # Near-duplicates among the new vectors themselves
+        canonical, distances = find_near_duplicates(embeddings, threshold)
+        targets = np.full(len(embeddings), -1, dtype=np.int64)
+        firsts = np.flatnonzero(canonical == np.arange(len(embeddings)))
+
+        # ...and against the live store (nearest vector that is not being replaced)
+        if self.ntotal:
+            replaces = set(int(i) for i in replaces)
+            found_distances, found = self.search(embeddings[firsts], 1 + len(replaces))
+            for row, i in enumerate(firsts):
+                for idx, distance in zip(found[row], found_distances[row]):
+                    if idx >= 0 and int(idx) not in replaces:
+                        if distance < threshold:
+                            targets[i] = idx
+                            distances[i] = distance
+                        break
+
+        # Keep first occurrences that matched nothing; map later copies to them
+        new_ids = {}
+        for i in range(len(embeddings)):
+            first = canonical[i]
+            if first != i:
+                targets[i] = targets[first] if targets[first] >= 0 else new_ids[first]
+            elif targets[i] < 0:
+                new_ids[i] = start_id + len(new_ids)
+        return targets, distances
+
+    def upsert(self, embeddings, rows, texts, compact=False):
+        """
+        Insert or replace documents by their stable key.
+
+        Each row's key names that one row (see metadata_store.document_key):
+        a seed ticket's rows are keyed by ticket number and answer id, a
+        self-healing KB article or script by its article / script id. The
+        new vector is added and any earlier vectors with the same key are
+        tombstoned. Rows with a
+        Status other than 'Active' are deleted instead of inserted. A row
+        that nearly duplicates another live document is collapsed into it
+        (see add()).
+
+        Args:
+            embeddings: Array of shape (n, dimension)
+            rows: List of n metadata dictionaries
+            texts: List of n embedded texts
+            compact: Passed to add()
+
+        Returns:
+            dict: {'added': n, 'deleted': n, 'duplicates': n} counts;
+                'added' includes rows collapsed as duplicates
+
+        Raises:
+            RuntimeError: If this process does not hold the writer lock
+        """
+        self._check_writer()
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+
+        keys = [document_key(row) for row in rows]
+        if None in keys:
+            raise ValueError(
+                "upsert() rows need a Ticket_Number, KB_Article_ID_x or Script_ID")
+
+        active = [i for i, row in enumerate(rows)
+                  if row.get('Status') in (None, '', 'Active')]
+
+        with self._lock:
+            generation = self._writable_generation()
+            generation.metadata_store.ensure_schema()
+            metadata_store = generation.metadata_store
+            old_ids_by_key = {key: metadata_store.ids_for_keys([key]) for key in set(keys)}
+            old_ids = sorted(i for ids in old_ids_by_key.values() for i in ids)
+            metadata_store.remove_duplicates(keys)
+            # Add before deleting, so a crash in between leaves a duplicate
+            # rather than a missing document
+            n_duplicates = 0
+            if active:
+                n_duplicates = self._add(
+                    embeddings[active], [rows[i] for i in active],
+                    [texts[i] for i in active], compact=compact, replaces=old_ids)[1]
+
+                # Documents collapsed into a replaced vector follow its key
+                for key in {keys[i] for i in active}:
+                    old = old_ids_by_key[key]
+                    current = ([i for i in metadata_store.ids_for_keys([key]) if i not in old]
+                               or metadata_store.canonical_ids_for_keys([key]))
+                    if old and current:
+                        metadata_store.move_duplicates(old, current[-1])
+            self._delete_ids(old_ids)
+
+        return {'added': len(active), 'deleted': len(old_ids), 'duplicates': n_duplicates}
+
+    def delete(self, keys):
+        """
+        Delete documents by their stable key.
+
+        Only the rows with these keys are removed: deleting a ticket
+        number keeps the ticket's conversation and script rows, and
+        deleting a script id keeps the seed ticket rows answered by it.
+
+        Args:
+            keys: Document keys (see metadata_store.document_key)
+
+        Returns:
+            int: Number of documents removed (tombstoned vectors plus
+                collapsed duplicates)
+
+        Raises:
+            RuntimeError: If this process does not hold the writer lock
+        """
+        self._check_writer()
+        with self._lock:
+            generation = self._writable_generation()
+            generation.metadata_store.ensure_schema()
+            ids = generation.metadata_store.ids_for_keys(keys)
+            self._delete_ids(ids)
+            n_duplicates = generation.metadata_store.remove_duplicates(keys)
+        return len(ids) + n_duplicates
+
+    def _delete_ids(self, ids):
+        """Tombstone vector ids in metadata.db and in this process."""
+        if not ids:
+            return
+        generation = self._generation
+        generation.metadata_store.delete(ids)
+        generation.deleted = generation.deleted.union(ids)
+        generation.filter_cache.clear()
+
+    def sync(self):
+        """
+        Pick up writes made by other processes since this store was loaded.
+
+        Switches to the newest generation and replays what was appended to
+        its delta log and tombstones. Searches do this on their own every
+        REFRESH_INTERVAL; a writer calls it after taking the ingestion
+        writer lock, so it assigns ids after everything already written.
+        """
+        with self._lock:
+            self._writable_generation().catch_up()
+        return self
+
+    def compact(self):
+        """
+        Fold the delta segment into the base index as a new generation.
+
+        The new base index is built while searches and adds continue on
+        the current generation. Under the write lock, the metadata and the
+        rest of the delta are copied over, CURRENT is switched and the new
+        generation is swapped in; old generations are then pruned.
+
+        Returns:
+            int: Number of vectors compacted
+
+        Raises:
+            RuntimeError: If this process does not hold the writer lock
+        """
+        self._check_writer()
+        with self._compact_lock:
+            with self._lock:
+                generation = self._writable_generation()
+            ids, vectors = generation.delta.snapshot()
+            if len(ids) == 0:
+                return 0
+
+            path = new_generation_path(self.vector_store_path)
+
+            # The new base: old base vectors plus the compacted delta
+            if generation.vectors is not None:
+                save_vectors(np.concatenate(
+                    [generation.vectors[:generation.index.ntotal], vectors]),
+                    path / VECTORS_FILENAME)
+            if generation.pca is not None:
+                _link_or_copy(generation.pca_path, path / PCA_FILENAME)
+
+            index = generation.index
+            if isinstance(index, ShardedIndex):
+                column = index.manifest.get('column')
+                rows = (generation.metadata_store.get_rows(ids, columns=[column])
+                        if column else [{}] * len(ids))
+                index = index.fork(path)
+                index.add_rows(vectors, ids, [row or {} for row in rows])
+                index.save()
+            else:
+                index = _copy_index(
+                    index, generation.index_path, generation.index_is_mapped)
+                index.add(vectors)
+                write_index(index, path / INDEX_FILENAME)
+                if self.mmap:
+                    index = None
+
+            with self._lock:
+                # Rows, tombstones and vectors added meanwhile go with the copy
+                generation.metadata_store.copy_to(path / METADATA_DB_FILENAME)
+                generation.delta.fork(path / DELTA_FILENAME, int(ids[-1]) + 1)
+                if isinstance(index, ShardedIndex):
+                    MetadataStore(path / METADATA_DB_FILENAME, read_only=False).set_info(
+                        {'shards': index.manifest})
+
+                publish_generation(self.vector_store_path, path)
+                self._generation = StoreGeneration(path, path.name).load(
+                    self.mmap, index=index)
+
+            prune_generations(self.vector_store_path)
+            print(f"✓ Compacted {len(ids)} delta vectors into generation {path.name}")
+            return len(ids)
+
+    def _schedule_compaction(self):
+        """Start the background compactor and wake it if the delta is full."""
+        if not self.auto_compact:
+            return
+        with self._lock:
+            if self._compactor is None:
+                self._compactor = threading.Thread(
+                    target=self._compaction_loop, name="vector-store-compactor",
+                    daemon=True)
+                self._compactor.start()
+        if len(self.delta) >= COMPACT_MAX_DELTA:
+            self._compact_event.set()
+
+    def _compaction_loop(self):
+        """Compact whenever the delta segment is too large or too old."""
+        while True:
+            self._compact_event.wait(timeout=COMPACT_CHECK_INTERVAL)
+            self._compact_event.clear()
+            if self.writer is None or not self.delta.is_due(COMPACT_MAX_DELTA, COMPACT_MAX_AGE):
+                continue
+            try:
+                self.compact()
+            except Exception as e:
+                # The write-ahead log still holds the vectors; retry next time
+                print(f"⚠ Delta compaction failed: {e}")
+
+
+class DeltaSegment:
+    """
+    Append-only segment of vectors added since the base index was written.
+
+    Every append is written to a write-ahead log (one record of int64 id +
+    float32 vector per vector) and fsynced before it is visible. The
+    segment is small, so it is searched exactly. The in-memory arrays are
+    replaced, never modified, so searches can read them without a lock.
+    """
+
+    def __init__(self, path, dimension):
+        """
+        Args:
+            path: Path to the write-ahead log (delta.wal)
+            dimension: Vector dimension
+        """
+        self.path = Path(path)
+        self.dimension = dimension
+        self.record_dtype = np.dtype(
+            [('id', '<i8'), ('vector', '<f4', (dimension,))])
+        self._segment = (np.empty(0, dtype=np.int64),
+                         np.empty((0, dimension), dtype=np.float32))
+        self.created_at = None
+        # Bytes of the log already reflected in the segment
+        self._offset = 0
+
+    def __len__(self):
+        return len(self._segment[0])
+
+    def snapshot(self):
+        """Current (ids, vectors) arrays."""
+        return self._segment
+
+    def replay(self, min_id, max_id):
+        """
+        Load the log, keeping records with min_id <= id < max_id.
+
+        Lower ids were already compacted into the base index; higher ids
+        never had their metadata rows committed. A torn trailing record
+        from a crash mid-write is ignored.
+        """
+        if not self.path.exists():
+            return
+        records = self._read_records(0)
+        uncommitted = np.flatnonzero(records['id'] >= max_id)
+        self._offset = (uncommitted[0] if len(uncommitted) else len(records)) \
+            * self.record_dtype.itemsize
+        keep = (records['id'] >= min_id) & (records['id'] < max_id)
+        self._segment = _latest_by_id(records['id'][keep], records['vector'][keep])
+        if len(self):
+            self.created_at = time.time()
+
+    def catch_up(self, max_id):
+        """
+        Load records appended to the log (e.g. by another process) since
+        replay() or the last catch_up(), up to the first id >= max_id.
+
+        Records from that id on have no committed metadata row yet and are
+        read again on the next call.
+
+        Returns:
+            int: Number of records loaded
+        """
+        if not self.path.exists():
+            return 0
+        records = self._read_records(self._offset)
+        uncommitted = np.flatnonzero(records['id'] >= max_id)
+        if len(uncommitted):
+            records = records[:uncommitted[0]]
+        if len(records) == 0:
+            return 0
+        self._offset += len(records) * self.record_dtype.itemsize
+
+        current_ids, current_vectors = self._segment
+        self._segment = _latest_by_id(
+            np.concatenate([current_ids, records['id']]),
+            np.concatenate([current_vectors, records['vector']]))
+        if self.created_at is None:
+            self.created_at = time.time()
+        return len(records)
+
+    def _read_records(self, offset):
+        """Whole records in the log from byte offset on (a torn last record is left out)."""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        n_records = len(data) // self.record_dtype.itemsize
+        return np.frombuffer(
+            data[:n_records * self.record_dtype.itemsize], dtype=self.record_dtype)
+
+    def append(self, ids, vectors):
+        """Durably append vectors to the log, then make them searchable."""
+        records = np.empty(len(ids), dtype=self.record_dtype)
+        records['id'] = ids
+        records['vector'] = vectors
+
+        with open(self.path, 'ab') as f:
+            # Drop a torn record left by a crash so records stay aligned
+            size = os.fstat(f.fileno()).st_size
+            if size % self.record_dtype.itemsize:
+                size -= size % self.record_dtype.itemsize
+                f.truncate(size)
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # Only skip past our own records if nothing unread precedes them
+        if self._offset == size:
+            self._offset = size + records.nbytes
+
+        current_ids, current_vectors = self._segment
+        self._segment = (np.concatenate([current_ids, records['id']]),
+                         np.concatenate([current_vectors, records['vector']]))
+        if self.created_at is None:
+            self.created_at = time.time()
+
+    def fork(self, path, up_to_id):
+        """
+        New segment at path holding only the vectors with id >= up_to_id.
+
+        Used by compaction: lower ids are in the new generation's base index.
+        """
+        ids, vectors = self._segment
+        keep = ids >= up_to_id
+
+        fork = DeltaSegment(path, self.dimension)
+        fork._segment = (ids[keep], vectors[keep])
+        fork.created_at = self.created_at if keep.any() else None
+        fork._offset = int(keep.sum()) * self.record_dtype.itemsize
+
+        records = np.empty(int(keep.sum()), dtype=self.record_dtype)
+        records['id'] = ids[keep]
+        records['vector'] = vectors[keep]
+        tmp_path = fork.path.with_name(fork.path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, fork.path)
+        return fork
+
+    def is_due(self, max_size, max_age):
+        """True if the segment should be compacted."""
+        if len(self) == 0:
+            return False
+        return len(self) >= max_size or time.time() - self.created_at >= max_age
+
+    def search(self, queries, k, ids=None, exclude=None):
+        """
+        Exact search over the segment.
+
+        Args:
+            queries: Array of shape (n_queries, dimension)
+            k: Number of results per query
+            ids: Only search these global vector ids (optional)
+            exclude: Never return these global vector ids (optional)
+
+        Returns:
+            Tuple (distances, indices) in global vector ids
+        """
+        segment_ids, vectors = self._segment
+        positions = np.arange(len(segment_ids))
+        if ids is not None:
+            positions = positions[np.isin(segment_ids[positions], ids)]
+        if exclude is not None and len(exclude):
+            positions = positions[~np.isin(segment_ids[positions], exclude)]
+        if len(positions) == 0:
+            return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+
+        distances, found = exact_subset_search(vectors, positions, queries, k)
+        indices = np.where(found >= 0, segment_ids[np.maximum(found, 0)], -1)
+        return distances, indices
+
+
+def _latest_by_id(ids, vectors):
+    """
+    Keep the last record for each id, in id order.
+
+    A crash between logging a vector and committing its row leaves a
+    record whose id the next add reuses; the later record wins.
+    """
+    _, last = np.unique(ids[::-1], return_index=True)
+    keep = len(ids) - 1 - last
+    return ids[keep], np.ascontiguousarray(vectors[keep])
+
+
+class _Tombstones:
+    """
+    Immutable set of deleted vector ids with a FAISS selector excluding them.
+
+    The selector objects are kept referenced here, since FAISS only holds
+    raw pointers to them.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = np.unique(np.asarray(ids, dtype=np.int64))
+        self._batch = faiss.IDSelectorBatch(self.ids)
+        self.selector = faiss.IDSelectorNot(self._batch)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def union(self, ids):
+        return _Tombstones(np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)]))
+
+
+class ShardedIndex:
+    """
+    A set of per-shard FAISS indexes searched in parallel.
+
+    Each shard is an IndexIDMap holding global vector ids, so results from
+    all shards merge into one global top-k and metadata/vectors lookups are
+    unchanged. Shards are read from disk on first use, so a worker only
+    holds the shards its traffic touches. Implements the parts of the
+    faiss index interface that VectorStore uses (ntotal, d, search).
+    """
+
+    def __init__(self, vector_store_path, manifest, mmap=False, indexes=None,
+                 max_workers=None):
+        """
+        Open a sharded index.
+
+        Args:
+            vector_store_path: Path to the vector store directory
+            manifest: Shard manifest from store_info['shards']
+            mmap: Memory-map shards when loading them
+            indexes: Already-built shard indexes by name (used at ingest)
+            max_workers: Threads for parallel shard search (default: 16)
+        """
+        self.shards_path = Path(vector_store_path) / SHARDS_DIRNAME
+        self.manifest = manifest
+        self.mmap = mmap
+        self._indexes = dict(indexes or {})
+        self._mapped = set()
+        self._dirty = set(self._indexes)
+        self._source_path = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or 16,
+            thread_name_prefix="shard-search")
+
+    @property
+    def shard_names(self):
+        return list(self.manifest['shards'])
+
+    @property
+    def ntotal(self):
+        return sum(shard['count'] for shard in self.manifest['shards'].values())
+
+    @property
+    def d(self):
+        return self.manifest['dimension']
+
+    @property
+    def loaded_shards(self):
+        """Names of the shards currently held in memory."""
+        return sorted(self._indexes)
+
+    def shard_path(self, name):
+        return self.shards_path / f"{name}.bin"
+
+    def _shard_file(self, name):
+        """Where a shard can be read from (a fork reads unsaved shards from its source)."""
+        path = self.shard_path(name)
+        if self._source_path is not None and not path.exists():
+            return self._source_path / path.name
+        return path
+
+    def fork(self, vector_store_path):
+        """
+        Copy of this index for a new generation directory.
+
+        Loaded shards are shared with the original, which is safe because
+        add_rows() never modifies a shard in place. save() writes the
+        shards changed in the fork and hard-links the others.
+        """
+        fork = ShardedIndex.__new__(ShardedIndex)
+        fork.__dict__.update(self.__dict__)
+        fork.shards_path = Path(vector_store_path) / SHARDS_DIRNAME
+        fork.manifest = json.loads(json.dumps(self.manifest))
+        fork._indexes = dict(self._indexes)
+        fork._mapped = set(self._mapped)
+        fork._dirty = set()
+        fork._source_path = self.shards_path
+        fork._lock = threading.Lock()
+        return fork
+
+    def get_shard(self, name):
+        """Get a shard's index, reading it from disk on first use."""
+        index = self._indexes.get(name)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(name)
+                if index is None:
+                    path = str(self._shard_file(name))
+                    if self.mmap:
+                        index = faiss.read_index(path, MMAP_IO_FLAG)
+                        self._mapped.add(name)
+                    else:
+                        index = faiss.read_index(path)
+                    self._indexes[name] = index
+        return index
+
+    def shards_for_filters(self, filters):
+        """Shards that can contain rows matching the filters."""
+        column = self.manifest.get('column')
+        if not column or column not in filters:
+            return self.shard_names
+
+        wanted = filters[column]
+        if not isinstance(wanted, (list, tuple, set)):
+            wanted = [wanted]
+        wanted = {str(value) for value in wanted}
+        return [name for name, shard in self.manifest['shards'].items()
+                if str(shard.get('value')) in wanted]
+
+    def subset(self, names):
+        """A view of this index that searches only the named shards."""
+        view = ShardedIndex.__new__(ShardedIndex)
+        view.__dict__.update(self.__dict__)
+        view.manifest = dict(self.manifest, shards={
+            name: self.manifest['shards'][name] for name in names})
+        return view
+
+    def search(self, queries, k, params=None):
+        """
+        Search every shard in parallel and merge into a global top-k.
+
+        Args:
+            queries: Array of shape (n_queries, d)
+            k: Number of results per query
+            params: faiss SearchParameters; only its ID selector is used,
+                re-wrapped for each shard's index type
+
+        Returns:
+            Tuple (distances, indices) in global vector ids
+        """
+        selector = params.sel if params is not None else None
+        names = [name for name in self.shard_names
+                 if self.manifest['shards'][name]['count'] > 0]
+
+        def search_shard(name):
+            index = self.get_shard(name)
+            if selector is not None:
+                return index.search(queries, k, params=search_parameters(index, selector))
+            return index.search(queries, k)
+
+        n_queries = len(queries)
+        if not names:
+            return (np.full((n_queries, k), np.inf, dtype=np.float32),
+                    np.full((n_queries, k), -1, dtype=np.int64))
+
+        return merge_results(list(self._executor.map(search_shard, names)), k)
+
+    def shard_for(self, vector_id, row):
+        """Name of the shard a new vector belongs to."""
+        column = self.manifest.get('column')
+        if column is None:
+            return str(int(vector_id) % self.manifest['n_shards'])
+
+        value = row.get(column)
+        for name, shard in self.manifest['shards'].items():
+            if shard.get('value') == value:
+                return name
+        return None
+
+    def add_rows(self, embeddings, ids, rows):
+        """
+        Route new vectors to their shards.
+
+        A product not seen at ingest time gets a new flat shard.
+
+        Args:
+            embeddings: Array of shape (n, d)
+            ids: Global vector ids, shape (n,)
+            rows: Metadata rows, used to pick the shard
+        """
+        groups = {}
+        for position, (vector_id, row) in enumerate(zip(ids, rows)):
+            name = self.shard_for(vector_id, row)
+            if name is None:
+                value = row.get(self.manifest['column'])
+                name = shard_name(value, self.manifest['shards'])
+                self.manifest['shards'][name] = {'value': value, 'count': 0}
+                self._indexes[name] = faiss.IndexIDMap(faiss.IndexFlatL2(self.d))
+            groups.setdefault(name, []).append(position)
+
+        for name, positions in groups.items():
+            # Add to a copy and swap it in, so searches never see a shard
+            # being modified (FAISS cannot grow a mapped index anyway)
+            index = _copy_index(
+                self.get_shard(name), self._shard_file(name), name in self._mapped)
+            index.add_with_ids(embeddings[positions], ids[positions])
+            self._indexes[name] = index
+            self._mapped.discard(name)
+            self.manifest['shards'][name]['count'] = int(index.ntotal)
+            self._dirty.add(name)
+
+    def save(self):
+        """Write shards changed since the last save (a fork links the others)."""
+        os.makedirs(self.shards_path, exist_ok=True)
+        for name in sorted(self._dirty):
+            write_index(self._indexes[name], self.shard_path(name))
+        self._dirty.clear()
+
+        if self._source_path is not None:
+            for name in self.shard_names:
+                if not self.shard_path(name).exists():
+                    _link_or_copy(self._source_path / self.shard_path(name).name,
+                                  self.shard_path(name))
+
+    def file_size(self):
+        """Total size in bytes of the shard files."""
+        return sum(os.path.getsize(self.shard_path(name))
+                   for name in self.shard_names if self.shard_path(name).exists())
+
+
+def shard_name(value, existing=()):
+    """File-safe, unique shard name for a metadata value."""
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value == '':
+        return UNASSIGNED_SHARD
+    base = re.sub(r'[^A-Za-z0-9]+', '_', str(value)).strip('_').lower() or 'shard'
+    name, n = base, 1
+    while name in existing:
+        n += 1
+        name = f"{base}_{n}"
+    return name
+
+
+def search_parameters(index, selector):
+    """
+    Build search parameters carrying an ID selector for an index type.
+
+    IndexIDMap passes parameters through to the index it wraps, so those
+    must match the inner index type.
+    """
+    inner = index
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_sharded_index(embeddings, rows, vector_store_path, shard_by='product',
+                        n_shards=8, **index_kwargs):
+    """
+    Build one index per shard over the embeddings.
+
+    Args:
+        embeddings: Array of shape (n, dimension)
+        rows: Metadata rows in vector order (used for product sharding)
+        vector_store_path: Path to the vector store directory
+        shard_by: 'product' (one shard per Product_x) or 'hash'
+            (vector id modulo n_shards)
+        n_shards: Number of shards for hash sharding
+        **index_kwargs: Passed to build_index for every shard
+
+    Returns:
+        Tuple (ShardedIndex, index_params) with unsaved shards
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    column = SHARD_BY_OPTIONS[shard_by]
+
+    groups = {}
+    shards = {}
+    for vector_id, row in enumerate(rows):
+        if column is None:
+            name = str(vector_id % n_shards)
+            shards.setdefault(name, {'value': int(name), 'count': 0})
+        else:
+            value = row.get(column)
+            if isinstance(value, float) and math.isnan(value):
+                value = None
+            name = next((n for n, shard in shards.items() if shard['value'] == value),
+                        None) or shard_name(value, shards)
+            shards.setdefault(name, {'value': value, 'count': 0})
+        groups.setdefault(name, []).append(vector_id)
+
+    indexes = {}
+    index_params = None
+    for name, ids in groups.items():
+        ids = np.array(ids, dtype=np.int64)
+        index, index_params = build_index(embeddings[ids], ids=ids, **index_kwargs)
+        indexes[name] = index
+        shards[name]['count'] = len(ids)
+
+    manifest = {
+        'by': shard_by,
+        'column': column,
+        'n_shards': len(shards),
+        'dimension': embeddings.shape[1],
+        'shards': shards
+    }
+    sharded = ShardedIndex(vector_store_path, manifest, indexes=indexes)
+    return sharded, dict(index_params, sharded=True)
+
+
+def read_current_generation(vector_store_path):
+    """
+    Name of the published generation.
+
+    Returns:
+        str: Generation name, or None for a legacy (unversioned) store
+    """
+    try:
+        return (Path(vector_store_path) / CURRENT_FILENAME).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def generation_path(vector_store_path, name):
+    """Directory of a generation (the store directory itself for name None)."""
+    if name is None:
+        return Path(vector_store_path)
+    return Path(vector_store_path) / GENERATIONS_DIRNAME / name
+
+
+def _generation_names(vector_store_path):
+    root = Path(vector_store_path) / GENERATIONS_DIRNAME
+    if not root.exists():
+        return []
+    return sorted(p.name for p in root.iterdir()
+                  if p.is_dir() and re.fullmatch(r'gen-\d+', p.name))
+
+
+def new_generation_path(vector_store_path):
+    """
+    Create the directory for the next generation.
+
+    Returns:
+        Path: Empty generation directory (not visible to readers until
+            publish_generation())
+    """
+    names = _generation_names(vector_store_path)
+    number = int(names[-1].split('-')[1]) + 1 if names else 1
+    while True:
+        path = generation_path(vector_store_path, f"gen-{number:06d}")
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            number += 1
+
+
+def publish_generation(vector_store_path, path):
+    """
+    Atomically make a fully written generation the current one.
+
+    Args:
+        vector_store_path: Path to the vector store directory
+        path: Generation directory from new_generation_path()
+    """
+    current = Path(vector_store_path) / CURRENT_FILENAME
+    tmp_path = current.with_name(CURRENT_FILENAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(Path(path).name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current)
+
+
+def prune_generations(vector_store_path, keep=KEEP_GENERATIONS):
+    """Delete all but the newest `keep` generations (never the current one)."""
+    current = read_current_generation(vector_store_path)
+    for name in _generation_names(vector_store_path)[:-keep]:
+        if name != current:
+            shutil.rmtree(generation_path(vector_store_path, name), ignore_errors=True)
+
+
+def _copy_index(index, path, is_mapped):
+    """Owned, writable copy of an index (re-read from disk if it is mapped)."""
+    if is_mapped:
+        return faiss.read_index(str(path))
+    return faiss.clone_index(index)
+
+
+def _link_or_copy(source, target):
+    """Hard-link an immutable file into another directory (copy if linking fails)."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def write_index(index, index_path):
+    """Write a FAISS index via a temporary file, so readers never see a partial file."""
+    index_path = Path(index_path)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, index_path)
+
+
+def merge_results(results, k):
+    """
+    Merge several (distances, indices) search results into one top-k.
+
+    A vector id found in more than one result is kept once.
+
+    Args:
+        results: List of (distances, indices) tuples for the same queries
+        k: Number of results per query
+
+    Returns:
+        Tuple (distances, indices) of shape (n_queries, k)
+    """
+    all_distances = np.hstack([d for d, _ in results]).astype(np.float32)
+    all_indices = np.hstack([i for _, i in results])
+    # Missing results (-1) sort last
+    all_distances = np.where(all_indices < 0, np.inf, all_distances)
+
+    order = np.argsort(all_distances, axis=1, kind='stable')
+    all_distances = np.take_along_axis(all_distances, order, axis=1)
+    all_indices = np.take_along_axis(all_indices, order, axis=1)
+
+    distances = np.full((len(all_indices), k), np.inf, dtype=np.float32)
+    indices = np.full((len(all_indices), k), -1, dtype=np.int64)
+    for q, (row_distances, row_indices) in enumerate(zip(all_distances, all_indices)):
+        _, first = np.unique(row_indices, return_index=True)
+        keep = np.sort(first)
+        keep = keep[row_indices[keep] >= 0][:k]
+        distances[q, :len(keep)] = row_distances[keep]
+        indices[q, :len(keep)] = row_indices[keep]
+    return distances, indices
+
+
+def truncate_embeddings(embeddings, dimension):
+    """
+    Keep the first dimension components and re-normalize to unit length.
+
+    Equivalent to requesting `dimensions` from text-embedding-3 models.
+    """
+    reduced = np.ascontiguousarray(embeddings[:, :dimension], dtype=np.float32)
+    faiss.normalize_L2(reduced)
+    return reduced
+
+
+def fit_pca(embeddings, dimension):
+    """
+    Fit a PCA projection from the model's output to dimension components.
+
+    Args:
+        embeddings: Training vectors of shape (n, model dimension)
+        dimension: Target dimension
+
+    Returns:
+        faiss.PCAMatrix; apply() it to document and query embeddings
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if dimension >= embeddings.shape[1]:
+        raise ValueError(
+            f"PCA dimension {dimension} must be below the model dimension "
+            f"{embeddings.shape[1]}")
+    if len(embeddings) < dimension:
+        raise ValueError(
+            f"PCA to {dimension} dimensions needs at least {dimension} training "
+            f"vectors, got {len(embeddings)}; use a lower dimension or --reduction api")
+    pca = faiss.PCAMatrix(embeddings.shape[1], dimension)
+    pca.train(embeddings)
+    return pca
+
+
+def find_near_duplicates(embeddings, threshold):
+    """
+    Group near-identical vectors with a FAISS range search.
+
+    Vectors are visited in order; each vector not yet claimed becomes
+    canonical and claims every unclaimed vector within threshold of it,
+    so clusters do not chain through a series of small differences.
+
+    Args:
+        embeddings: Array of shape (n, dimension)
+        threshold: Squared L2 distance below which vectors are duplicates
+
+    Returns:
+        Tuple (canonical, distances): canonical[i] is the position of the
+        vector i collapses into (i itself if it is kept), distances[i]
+        its squared L2 distance to that vector
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors = len(embeddings)
+    canonical = np.arange(n_vectors)
+    distances = np.zeros(n_vectors, dtype=np.float32)
+    if n_vectors < 2 or not threshold:
+        return canonical, distances
+
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    lims, found_distances, found = index.range_search(embeddings, float(threshold))
+
+    claimed = np.zeros(n_vectors, dtype=bool)
+    for i in range(n_vectors):
+        if claimed[i]:
+            continue
+        claimed[i] = True
+        for j, distance in zip(found[lims[i]:lims[i + 1]], found_distances[lims[i]:lims[i + 1]]):
+            if not claimed[j]:
+                claimed[j] = True
+                canonical[j] = i
+                distances[j] = distance
+    return canonical, distances
+
+
+def collapse_near_duplicates(embeddings, texts, rows, threshold):
+    """
+    Drop near-duplicate documents before building a new store.
+
+    Args:
+        embeddings: Array of shape (n, dimension)
+        texts: n embedded texts
+        rows: n metadata rows
+        threshold: Squared L2 distance below which documents are duplicates
+
+    Returns:
+        Tuple (embeddings, texts, rows, duplicates) for the canonical
+        documents, duplicates being (canonical_id, distance, text, row)
+        tuples for create_metadata_store()
+    """
+    canonical, distances = find_near_duplicates(embeddings, threshold)
+    keep = canonical == np.arange(len(canonical))
+    # Vector id of each kept document in the collapsed store
+    new_ids = np.cumsum(keep) - 1
+
+    duplicates = [(int(new_ids[canonical[i]]), float(distances[i]), texts[i], rows[i])
+                  for i in np.flatnonzero(~keep)]
+    return (np.ascontiguousarray(embeddings[keep]),
+            [text for text, k in zip(texts, keep) if k],
+            [row for row, k in zip(rows, keep) if k],
+            duplicates)
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """
+    Fuse ranked id lists: each id scores sum(1 / (rrf_k + rank)).
+
+    Args:
+        rankings: List of index arrays of shape (n_queries, depth), best
+            first, -1 for missing results
+        k: Number of results per query
+        rrf_k: Rank offset; larger values flatten the rank weighting
+
+    Returns:
+        Tuple (scores, indices) of shape (n_queries, k), scores scaled so
+        that an id ranked first in every list scores 1.0
+    """
+    n_queries = len(rankings[0])
+    best = len(rankings) / (rrf_k + 1)
+    scores = np.zeros((n_queries, k), dtype=np.float32)
+    indices = np.full((n_queries, k), -1, dtype=np.int64)
+
+    for q in range(n_queries):
+        fused = {}
+        for ranking in rankings:
+            for rank, idx in enumerate(ranking[q], 1):
+                if idx >= 0:
+                    fused[int(idx)] = fused.get(int(idx), 0.0) + 1.0 / (rrf_k + rank)
+        top = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        for i, (idx, score) in enumerate(top):
+            indices[q, i] = idx
+            scores[q, i] = score / best
+    return scores, indices
+
+
+def save_vectors(vectors, vectors_path):
+    """
+    Write full float32 vectors to an .npy file.
+
+    Writes to a temporary file and renames it, so readers that have the
+    old file memory-mapped keep a valid mapping.
+    """
+    vectors_path = Path(vectors_path)
+    tmp_path = vectors_path.with_name(vectors_path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+    os.replace(tmp_path, vectors_path)
+
+
+def search_with_rerank(index, vectors, queries, top_k,
+                       rerank_factor=DEFAULT_RERANK_FACTOR, params=None):
+    """
+    Search a lossy index, then re-rank candidates by exact L2 distance.
+
+    Args:
+        index: Compressed FAISS index
+        vectors: Full vectors (array or memmap) in index order
+        queries: Array of shape (n_queries, dimension)
+        top_k: Number of results per query
+        rerank_factor: Candidates fetched per result before re-ranking
+        params: faiss SearchParameters (e.g. an ID selector), optional
+
+    Returns:
+        Tuple (distances, indices) with exact distances, shape
+        (n_queries, top_k). Missing results have index -1.
+    """
+    if params is not None:
+        _, candidates = index.search(queries, top_k * rerank_factor, params=params)
+    else:
+        _, candidates = index.search(queries, top_k * rerank_factor)
+
+    distances = np.full((len(queries), top_k), np.inf, dtype=np.float32)
+    indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+
+    for q, (query, ids) in enumerate(zip(queries, candidates)):
+        ids = ids[ids >= 0]
+        if len(ids) == 0:
+            continue
+        # Sorted reads keep memmap access sequential
+        ids = np.sort(ids)
+        exact = ((np.asarray(vectors[ids]) - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:top_k]
+        distances[q, :len(order)] = exact[order]
+        indices[q, :len(order)] = ids[order]
+
+    return distances, indices
+
+
+def exact_subset_search(vectors, ids, queries, top_k):
+    """
+    Exact L2 search restricted to a subset of vectors.
+
+    Args:
+        vectors: Full vectors (array or memmap) in index order
+        ids: Sorted vector ids to search
+        queries: Array of shape (n_queries, dimension)
+        top_k: Number of results per query
+
+    Returns:
+        Tuple (distances, indices) in global vector ids, shape
+        (n_queries, top_k). Missing results have index -1.
+    """
+    subset = faiss.IndexFlatL2(vectors.shape[1])
+    subset.add(np.ascontiguousarray(vectors[ids], dtype=np.float32))
+    distances, positions = subset.search(queries, top_k)
+    indices = np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+    return distances, indices
+
+
+def default_nlist(n_vectors):
+    """
+    Pick a number of IVF lists for a corpus size.
+
+    Uses the usual 4 * sqrt(n) rule, capped so every list gets at least
+    39 training points (the FAISS k-means minimum).
+    """
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def default_pq_m(dimension):
+    """Pick PQ sub-quantizers: ~24 dims each, dividing the dimension."""
+    m = max(1, dimension // 24)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def build_index(embeddings, index_type='flat', nlist=None, nprobe=8,
+                hnsw_m=32, ef_construction=40, ef_search=64,
+                pq_m=None, pq_nbits=8, rerank_factor=DEFAULT_RERANK_FACTOR,
+                ids=None):
+    """
+    Build a FAISS index of the requested type over the embeddings.
+
+    Args:
+        embeddings: Array of shape (n, dimension)
+        index_type: 'flat' (exact), 'ivf' (IVF-Flat), 'hnsw',
+            'sq8' (8-bit scalar quantizer) or 'ivfpq' (IVF + product
+            quantizer)
+        nlist: Number of IVF lists (default: derived from corpus size)
+        nprobe: IVF lists scanned per query
+        hnsw_m: HNSW neighbours per node
+        ef_construction: HNSW candidate list size while building
+        ef_search: HNSW candidate list size while searching
+        pq_m: PQ sub-quantizers (default: ~24 dims each)
+        pq_nbits: Bits per PQ code (lowered for small corpora)
+        rerank_factor: Candidates per result re-ranked exactly for
+            compressed index types
+        ids: Global vector ids for the embeddings; if given, the index is
+            wrapped in an IndexIDMap and returns these ids (used by shards)
+
+    Returns:
+        Tuple (index, index_params) where index_params records the
+        settings used, for storing in the metadata
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors, dimension = embeddings.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+        params = {}
+
+    elif index_type == 'ivf':
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        index.train(embeddings)
+        index.nprobe = min(nprobe, nlist)
+        params = {'nlist': nlist, 'nprobe': index.nprobe}
+
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+        params = {'M': hnsw_m, 'efConstruction': ef_construction,
+                  'efSearch': ef_search}
+
+    elif index_type == 'sq8':
+        index = faiss.IndexScalarQuantizer(
+            dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        index.train(embeddings)
+        params = {'rerank_factor': rerank_factor}
+
+    elif index_type == 'ivfpq':
+        nlist = nlist or default_nlist(n_vectors)
+        pq_m = pq_m or default_pq_m(dimension)
+        if dimension % pq_m:
+            raise ValueError(
+                f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        # k-means needs ~39 points per centroid; shrink codes for tiny corpora
+        pq_nbits = max(1, min(pq_nbits, int(math.log2(max(2, n_vectors // 39)))))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+        index.train(embeddings)
+        index.nprobe = min(nprobe, nlist)
+        params = {'nlist': nlist, 'nprobe': index.nprobe, 'pq_m': pq_m,
+                  'pq_nbits': pq_nbits, 'rerank_factor': rerank_factor}
+
+    else:
+        raise ValueError(
+            f"Unknown index type: {index_type} (expected one of {INDEX_TYPES})")
+
+    if ids is not None:
+        index = faiss.IndexIDMap(index)
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(embeddings)
+    params['index_type'] = index_type
+    return index, params
+
+
+def evaluate_recall(index, embeddings, k=10, n_queries=200, seed=42,
+                    rerank_factor=None):
+    """
+    Measure recall@k of an index against exact brute-force search.
+
+    A random sample of stored vectors is used as held-out queries: each
+    query's own vector is dropped from both result lists, so the numbers
+    reflect retrieval of *other* documents, as in real traffic.
+
+    Args:
+        index: Index to evaluate (must contain embeddings in order)
+        embeddings: Array of shape (n, dimension) the index was built from
+        k: Number of neighbours to compare
+        n_queries: Size of the query sample
+        seed: Random seed for the sample
+        rerank_factor: If set, re-rank candidates against embeddings as
+            VectorStore.search does for compressed indexes
+
+    Returns:
+        dict with recall_at_k, k, n_queries and per-query latency (ms)
+        for the exact and evaluated index
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors = len(embeddings)
+    k = min(k, n_vectors - 1)
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(
+        n_vectors, size=min(n_queries, n_vectors), replace=False)
+    queries = embeddings[query_ids]
+
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+
+    start = time.perf_counter()
+    _, exact_ids = exact.search(queries, k + 1)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    start = time.perf_counter()
+    if rerank_factor:
+        _, ann_ids = search_with_rerank(
+            index, embeddings, queries, k + 1, rerank_factor)
+    else:
+        _, ann_ids = index.search(queries, k + 1)
+    ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    hits = 0
+    for qid, truth, found in zip(query_ids, exact_ids, ann_ids):
+        truth = [i for i in truth if i != qid][:k]
+        found = [i for i in found if i != qid and i >= 0][:k]
+        hits += len(set(truth) & set(found))
+
+    return {
+        'recall_at_k': hits / (k * len(queries)),
+        'k': k,
+        'n_queries': len(queries),
+        'exact_ms_per_query': exact_ms,
+        'index_ms_per_query': ann_ms
+    }
+
+
+# CLI flags accepted by parse_filter_args and the metadata column they filter
+FILTER_FLAGS = {
+    '--product': 'Product_x',
+    '--category': 'Category_x',
+    '--answer-type': 'Answer_Type',
+}
+
+
+def parse_filter_args(argv):
+    """
+    Parse metadata filter flags from a command line.
+
+    Accepts --product=NAME, --category=NAME and --answer-type=NAME; a
+    comma-separated value becomes an IN filter (e.g. --answer-type=KB,Script).
+
+    Args:
+        argv: Command line arguments
+
+    Returns:
+        dict: Filters for VectorStore.search (empty if none given)
+    """
+    filters = {}
+    for arg in argv:
+        flag, _, value = arg.partition('=')
+        if flag in FILTER_FLAGS and value:
+            values = [v.strip() for v in value.split(',') if v.strip()]
+            filters[FILTER_FLAGS[flag]] = values if len(values) > 1 else values[0]
+    return filters
+
+
+def parse_mode_arg(argv, default='vector'):
+    """
+    Parse --mode=vector|hybrid|lexical from a command line.
+
+    Args:
+        argv: Command line arguments
+        default: Mode when the flag is absent
+
+    Returns:
+        str: Retrieval mode
+    """
+    for arg in argv:
+        flag, _, value = arg.partition('=')
+        if flag == '--mode':
+            if value not in RETRIEVAL_MODES:
+                raise ValueError(
+                    f"--mode must be one of {', '.join(RETRIEVAL_MODES)}, got '{value}'")
+            return value
+    return default
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(vector_store_path=None, mmap=False):
+    """
+    Get the shared VectorStore for a directory, loading it on first use.
+
+    Args:
+        vector_store_path: Path to the vector store directory (optional)
+        mmap: Memory-map the index. Memory-mapped and in-memory callers
+            get separate instances, so a caller always gets the mode it
+            asked for whatever was imported first; each instance picks up
+            the other's writes like any other reader (see catch_up()).
+
+    Returns:
+        VectorStore: Loaded store shared by all callers in this process
+            with the same path and mmap setting
+    """
+    key = (Path(vector_store_path or DEFAULT_VECTOR_STORE_PATH).resolve(), bool(mmap))
+
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = VectorStore(key[0], mmap=mmap)
+            _stores[key] = store
+
+    return store.load()
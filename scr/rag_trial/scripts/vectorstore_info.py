@@ -1,73 +1,129 @@
 import os
-import faiss
-import pickle
-from collections import Counter
+
+from vectorstore import get_vector_store, evaluate_recall
+
+
+def show_compression_info(store):
+    """Display memory saved by a compressed index and its recall cost."""
+    index_type = store.index_params.get('index_type', 'flat')
+    # Only live vectors in the index file: delta vectors are not in it yet,
+    # and tombstoned ones would not be kept by a rebuild
+    flat_bytes = store.n_indexed * store.dimension * 4
+    index_bytes = store.index_file_size()
+
+    print("\n" + "=" * 80)
+    print("INDEX COMPRESSION")
+    print("=" * 80)
+    print(f"\nIndex Type: {index_type}")
+    print(f"Index Parameters: {store.index_params}")
+    print(f"Flat float32 Size: {flat_bytes / (1024*1024):.2f} MB "
+          f"({store.n_indexed} live indexed vectors)")
+    print(f"Index Size: {index_bytes / (1024*1024):.2f} MB")
+    if flat_bytes:
+        print(f"Memory Saved: {(1 - index_bytes / flat_bytes) * 100:.1f}% "
+              f"({flat_bytes / max(index_bytes, 1):.1f}x smaller)")
+
+    if index_type == 'flat' or store.vectors is None or store.ntotal < 2:
+        return
+
+    # Recall cost, measured on the stored full vectors
+    vectors = store.vectors
+    raw = evaluate_recall(store.index, vectors, k=10, n_queries=100)
+    print(f"\nRecall@{raw['k']} (index only): {raw['recall_at_k']:.4f}")
+    if store.is_compressed:
+        reranked = evaluate_recall(
+            store.index, vectors, k=10, n_queries=100,
+            rerank_factor=store.index_params.get('rerank_factor'))
+        print(f"Recall@{reranked['k']} (with re-ranking): {reranked['recall_at_k']:.4f}")
+        print(f"Search Latency: {reranked['index_ms_per_query']:.3f} ms/query "
+              f"(exact flat: {reranked['exact_ms_per_query']:.3f} ms/query)")
+    else:
+        print(f"Search Latency: {raw['index_ms_per_query']:.3f} ms/query "
+              f"(exact flat: {raw['exact_ms_per_query']:.3f} ms/query)")
+
 
 def show_vectorstore_info():
     """Display information about the vector store."""
 
-    # Load the FAISS index
-    index_path = "vector_store/faiss_index.bin"
-    if not os.path.exists(index_path):
+    # Load the shared vector store
+    try:
+        store = get_vector_store()
+    except FileNotFoundError:
         print("Vector store not found. Run ingest_data.py first.")
         return
 
-    index = faiss.read_index(index_path)
-
-    # Load metadata
-    metadata_path = "vector_store/metadata.pkl"
-    with open(metadata_path, 'rb') as f:
-        metadata = pickle.load(f)
+    metadata = store.metadata
 
     print("=" * 80)
     print("VECTOR STORE INFORMATION")
     print("=" * 80)
-    print(f"\nModel: {metadata['model']}")
+    print(f"\nGeneration: {store.generation or 'unversioned (legacy layout)'}")
+    print(f"Model: {metadata['model']}")
     print(f"Embedding Dimension: {metadata['dimension']}")
+    reduction = metadata.get('reduction')
+    if reduction:
+        print(f"Dimension Reduction: {reduction['method']} "
+              f"(from {reduction['source_dimension'] or 'unknown'})")
     print(f"Total Documents: {metadata['total_vectors']}")
-    print(f"Index Size: {os.path.getsize(index_path) / (1024*1024):.2f} MB")
-    print(f"Metadata Size: {os.path.getsize(metadata_path) / (1024*1024):.2f} MB")
+    if store.n_deleted:
+        print(f"Deleted Documents: {store.n_deleted} (tombstoned until the next re-ingest)")
+    n_duplicates = store.metadata_store.count_duplicates()
+    if n_duplicates:
+        print(f"Collapsed Near-Duplicates: {n_duplicates} "
+              f"(threshold {store.metadata.get('dedup_threshold')})")
+    print(f"Index Size: {store.index_file_size() / (1024*1024):.2f} MB")
+    print(f"Metadata Size: {os.path.getsize(store.metadata_db_path) / (1024*1024):.2f} MB")
+    if store.vectors_path.exists():
+        print(f"Full Vectors Size: {os.path.getsize(store.vectors_path) / (1024*1024):.2f} MB")
+
+    if store.is_sharded:
+        shards = store.index.manifest
+        print(f"\nShards: {len(store.index.shard_names)} (by {shards['by']})")
+        for name, shard in shards['shards'].items():
+            print(f"  - {name}: {shard['count']} vectors")
+
+    show_compression_info(store)
 
-    # Analyze the data
-    df_records = metadata['dataframe']
+    # Analyze the data (aggregated in SQL, rows are never loaded)
+    metadata_store = store.metadata_store
 
     print("\n" + "=" * 80)
     print("DATA STATISTICS")
     print("=" * 80)
 
     # Product distribution
-    products = [r.get('Product_x') for r in df_records if r.get('Product_x')]
+    products = metadata_store.value_counts('Product_x', limit=5)
     if products:
         print(f"\nTop 5 Products:")
-        for product, count in Counter(products).most_common(5):
+        for product, count in products:
             print(f"  - {product}: {count}")
 
     # Category distribution
-    categories = [r.get('Category_x') for r in df_records if r.get('Category_x')]
+    categories = metadata_store.value_counts('Category_x', limit=5)
     if categories:
         print(f"\nTop 5 Categories:")
-        for category, count in Counter(categories).most_common(5):
+        for category, count in categories:
             print(f"  - {category}: {count}")
 
     # Sentiment distribution
-    sentiments = [r.get('Sentiment') for r in df_records if r.get('Sentiment')]
+    sentiments = metadata_store.value_counts('Sentiment')
     if sentiments:
         print(f"\nSentiment Distribution:")
-        for sentiment, count in Counter(sentiments).most_common():
+        for sentiment, count in sentiments:
             print(f"  - {sentiment}: {count}")
 
     # Priority distribution
-    priorities = [r.get('Priority') for r in df_records if r.get('Priority')]
+    priorities = metadata_store.value_counts('Priority')
     if priorities:
         print(f"\nPriority Distribution:")
-        for priority, count in Counter(priorities).most_common():
+        for priority, count in priorities:
             print(f"  - {priority}: {count}")
 
     # Answer type distribution
-    answer_types = [r.get('Answer_Type') for r in df_records if r.get('Answer_Type')]
+    answer_types = metadata_store.value_counts('Answer_Type')
     if answer_types:
         print(f"\nAnswer Type Distribution:")
-        for answer_type, count in Counter(answer_types).most_common():
+        for answer_type, count in answer_types:
             print(f"  - {answer_type}: {count}")
 
     print("\n" + "=" * 80)
@@ -0,0 +1,82 @@
+"""
+Shared test fixtures: small vector stores built offline with the hashing
+embedder (no OpenAI calls, no network)
+"""
+
+import sys
+import contextlib
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# Same import layout as the scripts themselves
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "scripts"))
+
+import ingest_data
+from embeddings import hash_embedding
+from self_healing_pipeline import create_text_from_row
+
+TOPICS = [
+    ('Date advance fails', 'backend voucher reference invalid during month end close'),
+    ('Annual recertification missing income', 'household income verification not attached'),
+    ('HAP voucher total incorrect', 'assistance payment miscalculated after a retroactive adjustment'),
+    ('TRACS file transmission error', 'MAT record field length exceeds the TRACS specification'),
+    ('User cannot log in', 'password reset email blocked by the spam filter'),
+    ('Report export times out', 'large date range exceeds the report row limit'),
+    ('Resident ledger balance wrong', 'late fee posted twice by the nightly batch'),
+    ('Move in certification rejected', 'unit number mismatch between certification and lease'),
+]
+
+
+def make_rows(n=len(TOPICS)):
+    """n distinct seed tickets in the final_ver3.xlsx layout."""
+    rows = []
+    for i in range(n):
+        subject, root_cause = TOPICS[i % len(TOPICS)]
+        ticket = f"CS-{i + 1:08d}"
+        rows.append({
+            'Ticket_Number': ticket,
+            'Product_x': 'ExampleCo PropertySuite Affordable',
+            'Category_x': 'General',
+            'Issue_Summary': f"{subject} for site {i}",
+            'Subject': subject,
+            'Description': f"Customer at site {i} reports: {subject.lower()}; {root_cause}.",
+            'Resolution': f"Fixed {root_cause} for site {i}",
+            'Root_Cause': root_cause,
+            'KB_Article_ID_x': None,
+            'Script_ID': None,
+            'Source_ID': ticket,
+            'Answer_Type': 'SEED_KB',
+        })
+    return rows
+
+
+def embed_rows(rows):
+    """Texts and hashing embeddings for rows, as ingest_data.py builds them."""
+    texts = [create_text_from_row(row) for row in rows]
+    return texts, [hash_embedding(text) for text in texts]
+
+
+@pytest.fixture
+def build_store(tmp_path):
+    """
+    Factory that ingests rows into a new vector store directory.
+
+    Returns:
+        callable(rows=None, *extra_args) -> Path of the vector store
+    """
+    def build(rows=None, *extra_args, name="store"):
+        data_path = tmp_path / f"{name}.csv"
+        pd.DataFrame(rows if rows is not None else make_rows()).to_csv(data_path, index=False)
+        store_path = tmp_path / name
+        with open(tmp_path / f"{name}.log", 'w') as log, contextlib.redirect_stdout(log), \
+                contextlib.redirect_stderr(log):
+            ingest_data.main([
+                '--data', str(data_path), '--vector-store', str(store_path),
+                '--embedder', 'hashing', *extra_args
+            ])
+        return store_path
+
+    return build
@@ -0,0 +1,26 @@
+import asyncio
+
+import numpy as np
+
+from embeddings import HashingEmbeddingClient, create_embeddings, hash_embedding
+
+TEXTS = [f"voucher {i} rejected at month end" for i in range(6)]
+
+
+def embed(texts):
+    client = HashingEmbeddingClient()
+    # One text per request, so the requests run on the asyncio pipeline
+    return create_embeddings(client, texts, client.embedding_model, batch_size=1,
+                             cache=False, concurrency=4)
+
+
+def test_concurrent_batches_keep_input_order():
+    np.testing.assert_allclose(embed(TEXTS), [hash_embedding(text) for text in TEXTS],
+                               rtol=1e-6)
+
+
+def test_can_be_called_from_a_running_event_loop():
+    async def handler():
+        return embed(TEXTS)
+
+    np.testing.assert_allclose(asyncio.run(handler()), embed(TEXTS), rtol=1e-6)
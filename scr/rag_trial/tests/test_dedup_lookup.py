@@ -0,0 +1,39 @@
+from conftest import make_rows
+from query_router import lookup_identifier
+from vectorstore import VectorStore
+
+
+def rows_with_duplicate():
+    """Seed rows plus a second ticket that differs from the first only by number."""
+    rows = make_rows()
+    rows.append(dict(rows[0], Ticket_Number='CS-00000099', Source_ID='CS-00000099'))
+    return rows
+
+
+def test_dedup_is_opt_in(build_store):
+    store = VectorStore(build_store(rows_with_duplicate())).load()
+    assert store.ntotal == 9
+    assert store.metadata_store.count_duplicates() == 0
+
+
+def test_lookup_of_collapsed_duplicate_returns_its_own_row(build_store):
+    store = VectorStore(build_store(rows_with_duplicate(), '--dedup-threshold', '0.05')).load()
+    assert store.ntotal == 8
+    assert store.metadata_store.count_duplicates() == 1
+
+    assert store.get_document('CS-00000099')['Ticket_Number'] == 'CS-00000099'
+    assert store.get_document('CS-00000099', columns=['Ticket_Number']) == {
+        'Ticket_Number': 'CS-00000099'}
+
+    result = lookup_identifier(store, 'ticket', 'CS-00000099')
+    assert result['source'] == 'duplicate'
+    assert result['index'] == -1
+    assert result['duplicate_of'] == 0
+    assert result['data']['Ticket_Number'] == 'CS-00000099'
+    assert 'Ticket: CS-00000099' in result['text']
+
+    # The canonical document itself is still an ordinary exact match
+    canonical = lookup_identifier(store, 'ticket', 'CS-00000001')
+    assert canonical['source'] == 'vector_store'
+    assert canonical['index'] == 0
+    assert canonical['data']['Ticket_Number'] == 'CS-00000001'
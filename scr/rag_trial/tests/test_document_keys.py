@@ -0,0 +1,76 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from conftest import make_rows, embed_rows
+from ingest_queue import IngestWriter
+from metadata_store import document_key
+from vectorstore import VectorStore
+
+
+def ticket_with_siblings():
+    """Seed rows where ticket 1 also has a conversation row and a script row."""
+    rows = make_rows()
+    ticket = rows[0]['Ticket_Number']
+    rows[1].update(Ticket_Number=ticket, Source_ID='CONV-ABC123')
+    rows[2].update(Ticket_Number=ticket, Source_ID='SCRIPT-0007', Script_ID='SCRIPT-0007',
+                   Answer_Type='Script')
+    return rows
+
+
+def test_document_key_is_unique_per_row():
+    rows = ticket_with_siblings()
+    assert [document_key(row) for row in rows[:3]] == [
+        'CS-00000001', 'CS-00000001/CONV-ABC123', 'CS-00000001/SCRIPT-0007']
+    assert document_key({'Ticket_Number': 'CS-1', 'Source_ID': float('nan')}) == 'CS-1'
+    assert document_key({'Ticket_Number': None, 'KB_Article_ID_x': 'KB-1',
+                         'Source_ID': 'KB-1'}) == 'KB-1'
+
+
+@pytest.fixture
+def sibling_store(build_store):
+    """The shared store built from ticket_with_siblings(), writer lock held."""
+    with IngestWriter(build_store(ticket_with_siblings(), '--dedup-threshold', '0')) as writer:
+        yield writer.store
+
+
+def test_delete_ticket_keeps_sibling_rows(sibling_store):
+    store = sibling_store
+    assert store.delete(['CS-00000001']) == 1
+    assert store.get_document('CS-00000001') is None
+    assert store.get_document('CS-00000001/CONV-ABC123')['Source_ID'] == 'CONV-ABC123'
+    assert store.get_document('CS-00000001/SCRIPT-0007')['Script_ID'] == 'SCRIPT-0007'
+
+
+def test_upsert_script_keeps_seed_ticket_rows(sibling_store):
+    store = sibling_store
+    # A self-healing script row, as normalize_row_for_vector_store builds it
+    row = dict(make_rows()[2], Ticket_Number=None, Script_ID='SCRIPT-0007',
+               Source_ID='SCRIPT-0007', Answer_Type='Script',
+               Resolution="Run the updated voucher script")
+    texts, embeddings = embed_rows([row])
+    assert store.upsert(np.array(embeddings), [row], texts)['deleted'] == 0
+    assert store.upsert(np.array(embeddings), [row], texts)['deleted'] == 1
+
+    assert store.metadata_store.ids_for_keys(['SCRIPT-0007']) == [store.ntotal - 1]
+    assert store.get_document('SCRIPT-0007')['Resolution'] == "Run the updated voucher script"
+    # The seed ticket answered with that script is a different document
+    assert store.get_document('CS-00000001/SCRIPT-0007')['Ticket_Number'] == 'CS-00000001'
+    assert store.delete(['SCRIPT-0007']) == 1
+    assert store.get_document('CS-00000001/SCRIPT-0007') is not None
+
+
+def test_older_ticket_keys_are_rekeyed(build_store):
+    path = build_store(ticket_with_siblings(), '--dedup-threshold', '0')
+    db_path = next(path.rglob('metadata.db'))
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE documents SET doc_key = Ticket_Number")
+    conn.execute("DELETE FROM store_info WHERE key = 'doc_key_version'")
+    conn.commit()
+    conn.close()
+
+    store = VectorStore(path).load()
+    store.metadata_store.ensure_schema()
+    assert store.metadata_store.ids_for_keys(['CS-00000001']) == [0]
+    assert store.metadata_store.ids_for_keys(['CS-00000001/CONV-ABC123']) == [1]
@@ -0,0 +1,72 @@
+import sqlite3
+
+import numpy as np
+
+import embeddings
+from embeddings import EmbeddingCache
+
+MODEL = 'text-embedding-3-small'
+
+
+def vector(seed, dimension=4):
+    return np.random.default_rng(seed).random(dimension, dtype=np.float32)
+
+
+def last_used(cache, text):
+    conn = sqlite3.connect(cache.path)
+    try:
+        return conn.execute("SELECT last_used FROM embeddings WHERE key = ?",
+                            (cache.key(MODEL, None, text),)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_hits_and_misses(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.db")
+    cache.put_many(MODEL, None, ['a', 'b'], np.stack([vector(0), vector(1)]))
+
+    found = cache.get_many(MODEL, None, ['b', 'missing', 'a', 'b'])
+    assert sorted(found) == [0, 2, 3]
+    np.testing.assert_array_equal(found[0], vector(1))
+    np.testing.assert_array_equal(found[2], vector(0))
+    # Other dimensions are a different embedding
+    assert cache.get_many(MODEL, 256, ['a']) == {}
+
+    # Re-putting an entry neither duplicates it nor changes the size
+    cache.put_many(MODEL, None, ['a'], vector(0)[None])
+    assert cache.total_bytes() == 2 * 4 * 4
+    assert cache.stats() == {MODEL: {'entries': 2, 'bytes': 32}}
+
+
+def test_hits_refresh_last_used_at_most_once_per_interval(tmp_path, monkeypatch):
+    cache = EmbeddingCache(tmp_path / "cache.db")
+    cache.put_many(MODEL, None, ['a'], vector(0)[None])
+    stored = last_used(cache, 'a')
+
+    cache.get_many(MODEL, None, ['a'])
+    assert last_used(cache, 'a') == stored
+
+    monkeypatch.setattr(embeddings, 'CACHE_TOUCH_INTERVAL', 0)
+    cache.get_many(MODEL, None, ['a'])
+    assert last_used(cache, 'a') > stored
+
+
+def test_eviction_drops_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, 'CACHE_TOUCH_INTERVAL', 0)
+    # Room for three 16-byte vectors; a fourth evicts down to 90% (50 bytes)
+    cache = EmbeddingCache(tmp_path / "cache.db", max_bytes=56)
+    for seed, text in enumerate(['a', 'b', 'c']):
+        cache.put_many(MODEL, None, [text], vector(seed)[None])
+    cache.get_many(MODEL, None, ['a'])
+
+    cache.put_many(MODEL, None, ['d'], vector(3)[None])
+    assert sorted(cache.get_many(MODEL, None, ['a', 'b', 'c', 'd'])) == [0, 2, 3]
+    assert cache.total_bytes() == 48
+
+    # The running total matches the table, also from another process's view
+    reopened = EmbeddingCache(tmp_path / "cache.db", max_bytes=56)
+    assert reopened.total_bytes() == sum(s['bytes'] for s in reopened.stats().values())
+
+    cache.clear()
+    assert cache.total_bytes() == 0
+    assert cache.get_many(MODEL, None, ['a', 'c', 'd']) == {}
@@ -0,0 +1,37 @@
+import embeddings
+from embeddings import (
+    HashingEmbeddingClient, LocalEmbeddingClient, embed_query_for_store, get_embedding_client
+)
+from vectorstore import VectorStore
+
+
+def test_clients_are_created_once_per_model(monkeypatch):
+    monkeypatch.setattr(embeddings, '_embedding_clients', {})
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+
+    openai_client = get_embedding_client('text-embedding-3-small')
+    assert get_embedding_client('text-embedding-3-small') is openai_client
+    assert get_embedding_client('text-embedding-3-large') is not openai_client
+
+    hashing_client = get_embedding_client('hashing-1536')
+    assert get_embedding_client('hashing-1536') is hashing_client
+    assert get_embedding_client('hashing-256').embedding_model == 'hashing-256'
+
+
+def test_caller_client_is_used_as_is(monkeypatch):
+    monkeypatch.setattr(embeddings, '_embedding_clients', {})
+    own = HashingEmbeddingClient()
+    assert get_embedding_client(own.embedding_model, own) is own
+    assert embeddings._embedding_clients == {}
+
+
+def test_local_queries_skip_the_coalescer(build_store, monkeypatch):
+    assert LocalEmbeddingClient.cacheable is False
+
+    def coalescer(*args):
+        raise AssertionError("non-cacheable clients must not be coalesced")
+    monkeypatch.setattr(embeddings, 'get_embedding_coalescer', coalescer)
+
+    store = VectorStore(build_store()).load()
+    query = embed_query_for_store(None, store, "Date advance fails")
+    assert query.shape == (1, store.dimension)
@@ -0,0 +1,123 @@
+import sys
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from conftest import make_rows, embed_rows
+from ingest_queue import IngestQueue, IngestWriter, submit_and_wait
+from vectorstore import get_vector_store
+
+TRY_ACQUIRE = """
+import sys
+sys.path.append({scripts!r})
+from ingest_queue import IngestWriter
+print(IngestWriter({path!r}).acquire(blocking=False))
+"""
+
+
+@pytest.fixture
+def store_path(build_store):
+    return build_store(None, '--dedup-threshold', '0')
+
+
+def test_jobs_are_applied_in_submission_order(store_path):
+    queue = IngestQueue(store_path)
+    rows = make_rows(9)[8:]
+    texts, embeddings = embed_rows(rows)
+    changed = [dict(rows[0], Resolution="Reissued the voucher")]
+    changed_texts, changed_embeddings = embed_rows(changed)
+
+    job_ids = [
+        queue.submit('add', np.array(embeddings), rows, texts),
+        queue.submit('upsert', np.array(changed_embeddings), changed, changed_texts),
+        queue.submit('delete', keys=['CS-00000009']),
+    ]
+    assert [job['id'] for job in queue.pending()] == job_ids
+
+    writer = IngestWriter(store_path)
+    assert writer.acquire(blocking=False)
+    try:
+        assert writer.drain() == 3
+    finally:
+        writer.release()
+
+    # Each acknowledgement reflects the jobs applied before it
+    assert queue.wait(job_ids[0]) == {'added': 1, 'total_vectors': 9}
+    assert queue.wait(job_ids[1]) == {'added': 1, 'deleted': 1, 'duplicates': 0}
+    assert queue.wait(job_ids[2]) == {'deleted': 1}
+    assert queue.pending() == []
+
+
+def test_failed_job_is_acknowledged_with_its_error(store_path):
+    queue = IngestQueue(store_path)
+    row = dict(make_rows(1)[0], Ticket_Number=None, Source_ID=None)
+    texts, embeddings = embed_rows([row])
+    failing = queue.submit('upsert', np.array(embeddings), [row], texts)
+    following = queue.submit('delete', keys=['CS-00000001'])
+
+    writer = IngestWriter(store_path)
+    writer.acquire()
+    try:
+        writer.drain()
+    finally:
+        writer.release()
+
+    assert queue.status(failing)['status'] == 'failed'
+    with pytest.raises(RuntimeError, match="upsert\\(\\) rows need"):
+        queue.wait(failing)
+    # A failure does not hold up the jobs behind it
+    assert queue.wait(following) == {'deleted': 1}
+
+
+def test_submit_and_wait_drains_inline_without_a_writer(store_path):
+    result = submit_and_wait('delete', keys=['CS-00000003'], vector_store_path=store_path)
+    assert result == {'deleted': 1}
+    assert IngestQueue(store_path).pending() == []
+
+
+def test_writer_lock_excludes_other_processes(store_path):
+    script = TRY_ACQUIRE.format(scripts=str(Path(__file__).parent.parent / "scripts"),
+                                path=str(store_path))
+
+    def other_process_acquires():
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                text=True, check=True)
+        return result.stdout.split()[-1] == 'True'
+
+    with IngestWriter(store_path):
+        assert not other_process_acquires()
+    assert other_process_acquires()
+
+
+def test_store_writes_require_the_writer_lock(store_path):
+    store = get_vector_store(store_path)
+    rows = make_rows(9)[8:]
+    texts, embeddings = embed_rows(rows)
+    for write in (lambda: store.add(np.array(embeddings), rows, texts),
+                  lambda: store.upsert(np.array(embeddings), rows, texts),
+                  lambda: store.delete(['CS-00000001']),
+                  store.compact):
+        with pytest.raises(RuntimeError, match="writer lock"):
+            write()
+
+    with IngestWriter(store_path) as writer:
+        assert writer.store is store
+        assert store.add(np.array(embeddings), rows, texts) == 9
+    with pytest.raises(RuntimeError, match="writer lock"):
+        store.delete(['CS-00000009'])
+
+
+def test_release_restores_auto_compact(store_path):
+    store = get_vector_store(store_path)
+    writer = IngestWriter(store_path)
+    assert writer.acquire(blocking=False)
+    assert not store.auto_compact
+    writer.release()
+    assert store.auto_compact
+
+    store.auto_compact = False
+    with IngestWriter(store_path):
+        pass
+    assert not store.auto_compact
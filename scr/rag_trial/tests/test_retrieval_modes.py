@@ -0,0 +1,32 @@
+import inspect
+
+import pytest
+
+import classification_agent
+from vectorstore import VectorStore, parse_mode_arg
+
+
+def test_vector_is_the_default_mode():
+    assert parse_mode_arg([]) == 'vector'
+    assert parse_mode_arg(['--mode=hybrid']) == 'hybrid'
+    for method in (classification_agent.ClassificationAgent.classify_query,
+                   classification_agent.ClassificationAgent._retrieve_similar_documents):
+        assert inspect.signature(method).parameters['mode'].default == 'vector'
+
+
+def test_fused_results_keep_rrf_score_apart_from_similarity(build_store):
+    agent = classification_agent.ClassificationAgent.__new__(
+        classification_agent.ClassificationAgent)
+    agent.vector_store = VectorStore(build_store()).load()
+
+    vector_docs = agent._build_documents([0, -1], [0.25, 0.0])
+    assert len(vector_docs) == 1
+    assert vector_docs[0]['distance'] == 0.25
+    assert vector_docs[0]['similarity_score'] == pytest.approx(0.8)
+    assert vector_docs[0]['rrf_score'] is None
+
+    fused_docs = agent._build_documents([1, 0], [0.969, 0.5], fused=True)
+    assert [doc['index'] for doc in fused_docs] == [1, 0]
+    assert fused_docs[0]['rrf_score'] == pytest.approx(0.969)
+    assert fused_docs[0]['distance'] is None
+    assert fused_docs[0]['similarity_score'] is None
@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+import self_healing_pipeline
+from conftest import make_rows
+from db_scripts import db_scripts
+from vectorstore import VectorStore
+
+SCRIPT = {
+    'Script_ID': 'SCRIPT-0007',
+    'Script_Title': 'Reset voucher reference',
+    'Script_Purpose': 'Clear an invalid backend voucher reference before date advance',
+    'Script_Inputs': 'property_id',
+    'Module': 'Compliance',
+    'Category': 'Date Advance',
+    'Source': 'SELF_HEALING',
+    'Script_Text_Sanitized': 'UPDATE voucher SET reference = NULL WHERE property_id = @property_id',
+}
+
+
+@pytest.fixture
+def scripts_db(tmp_path, monkeypatch):
+    """A scripts.db holding SCRIPT, used by db_scripts and the pipeline."""
+    path = tmp_path / "scripts.db"
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE scripts_master ({', '.join(SCRIPT)})")
+    conn.execute(f"INSERT INTO scripts_master VALUES ({', '.join('?' * len(SCRIPT))})",
+                 list(SCRIPT.values()))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db_scripts, 'get_db_path', lambda: path)
+    return path
+
+
+@pytest.fixture
+def seed_store(build_store):
+    """Seed store where ticket 1 also has a script row answered by SCRIPT-0007."""
+    rows = make_rows()
+    rows[2].update(Ticket_Number='CS-00000001', Source_ID='SCRIPT-0007',
+                   Script_ID='SCRIPT-0007', Answer_Type='Script')
+    return build_store(rows)
+
+
+def test_sync_script_replaces_only_the_scripts_own_vector(scripts_db, seed_store):
+    assert self_healing_pipeline.sync_script('SCRIPT-0007', seed_store)
+    db_scripts.update_script('SCRIPT-0007', sync_vector_store=False,
+                             Script_Title='Reset voucher reference (v2)')
+    assert self_healing_pipeline.sync_script('SCRIPT-0007', seed_store)
+
+    store = VectorStore(seed_store).load()
+    assert store.get_document('SCRIPT-0007')['Subject'] == 'Reset voucher reference (v2)'
+    assert store.n_deleted == 1
+    seed = store.get_document('CS-00000001/SCRIPT-0007')
+    assert seed['Ticket_Number'] == 'CS-00000001'
+    assert seed['Answer_Type'] == 'Script'
+
+
+def test_sync_script_removes_a_deleted_script(scripts_db, seed_store):
+    self_healing_pipeline.sync_script('SCRIPT-0007', seed_store)
+    conn = sqlite3.connect(scripts_db)
+    conn.execute("DELETE FROM scripts_master")
+    conn.commit()
+    conn.close()
+
+    assert not self_healing_pipeline.sync_script('SCRIPT-0007', seed_store)
+    store = VectorStore(seed_store).load()
+    assert store.get_document('SCRIPT-0007') is None
+    assert store.get_document('CS-00000001/SCRIPT-0007') is not None
+
+
+def test_update_script_syncs_the_vector_store(scripts_db, monkeypatch):
+    synced = []
+    monkeypatch.setattr(self_healing_pipeline, 'sync_script', synced.append)
+
+    assert db_scripts.update_script('SCRIPT-0007', Script_Title='New title')
+    assert db_scripts.update_script('SCRIPT-0007', sync_vector_store=False,
+                                    Script_Title='Newer title')
+    assert not db_scripts.update_script('SCRIPT-9999', Script_Title='Missing')
+    assert synced == ['SCRIPT-0007']
+
+
+def test_failed_sync_keeps_the_database_update(scripts_db, monkeypatch, capsys):
+    def fail(script_id):
+        raise ConnectionError("embedding API unavailable")
+    monkeypatch.setattr(self_healing_pipeline, 'sync_script', fail)
+
+    assert db_scripts.update_script('SCRIPT-0007', Script_Title='New title')
+    assert db_scripts.retrieve_script('SCRIPT-0007')['Script_Title'] == 'New title'
+    assert "its vector was not: embedding API unavailable" in capsys.readouterr().out
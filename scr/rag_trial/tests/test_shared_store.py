@@ -0,0 +1,14 @@
+from vectorstore import get_vector_store
+
+
+def test_shared_store_is_keyed_by_path_and_mmap(build_store):
+    path = build_store()
+
+    in_memory = get_vector_store(path)
+    mapped = get_vector_store(path, mmap=True)
+
+    assert get_vector_store(str(path)) is in_memory
+    assert get_vector_store(path, mmap=True) is mapped
+    assert mapped is not in_memory
+    assert mapped.mmap and not in_memory.mmap
+    assert mapped.ntotal == in_memory.ntotal == 8
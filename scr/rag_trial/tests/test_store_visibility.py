@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import vectorstore
+from conftest import make_rows, embed_rows
+from ingest_queue import IngestWriter
+from vectorstore import VectorStore
+
+
+@pytest.fixture
+def two_stores(build_store, monkeypatch):
+    """A writer and a reader opened on the same store, as two processes would."""
+    monkeypatch.setattr(vectorstore, 'REFRESH_INTERVAL', 0)
+    path = build_store(None, '--dedup-threshold', '0')
+    reader = VectorStore(path).load()
+    with IngestWriter(path) as writer:
+        yield writer.store, reader
+
+
+def top_id(store, embedding):
+    _, indices = store.search(np.array([embedding], dtype=np.float32), top_k=1)
+    return int(indices[0][0])
+
+
+def test_reader_sees_add_without_compaction(two_stores):
+    writer, reader = two_stores
+    rows = make_rows(9)[8:]
+    texts, embeddings = embed_rows(rows)
+    writer.add(np.array(embeddings), rows, texts)
+
+    assert top_id(reader, embeddings[0]) == 8
+    assert reader.ntotal == 9
+    assert reader.get_document('CS-00000009')['Issue_Summary'] == rows[0]['Issue_Summary']
+    assert reader.generation == writer.generation
+
+
+def test_reader_sees_upsert_and_delete(two_stores):
+    writer, reader = two_stores
+    rows = make_rows()
+    _, old_embeddings = embed_rows(rows)
+    assert top_id(reader, old_embeddings[0]) == 0
+
+    changed = [dict(rows[0], Resolution="Escalated to tier 3")]
+    texts, embeddings = embed_rows(changed)
+    writer.upsert(np.array(embeddings), changed, texts)
+    writer.delete(['CS-00000002'])
+
+    assert top_id(reader, embeddings[0]) == 8
+    assert reader.n_deleted == 2
+    assert reader.get_document('CS-00000001')['Resolution'] == "Escalated to tier 3"
+    assert reader.get_document('CS-00000002') is None
+    _, indices = reader.search(np.array(old_embeddings, dtype=np.float32), top_k=8)
+    assert not np.isin(indices, [0, 1]).any()
+
+
+def test_reader_waits_for_committed_rows(two_stores):
+    writer, reader = two_stores
+    rows = make_rows(9)[8:]
+    _, embeddings = embed_rows(rows)
+
+    # A vector logged before its row is committed stays invisible
+    writer.delta.append(np.array([8]), np.array(embeddings, dtype=np.float32))
+    reader.search(np.array(embeddings, dtype=np.float32), top_k=1)
+    assert reader.ntotal == 8
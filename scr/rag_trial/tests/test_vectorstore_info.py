@@ -0,0 +1,42 @@
+import numpy as np
+
+from conftest import make_rows, embed_rows
+from embeddings import HashingEmbeddingClient
+from ingest_queue import IngestWriter
+from vectorstore import VectorStore
+from vectorstore_info import show_compression_info
+
+
+def test_compression_info_counts_only_live_indexed_vectors(build_store, capsys):
+    path = build_store(None, '--dedup-threshold', '0')
+    store = VectorStore(path).load()
+    assert store.n_indexed == 8
+
+    # Replacing a document tombstones its indexed vector and adds one to the delta
+    rows = make_rows()[:1]
+    rows[0]['Resolution'] = "Escalated to tier 3"
+    texts, embeddings = embed_rows(rows)
+    with IngestWriter(path) as writer:
+        writer.store.upsert(np.array(embeddings), rows, texts)
+    store.sync()
+    assert store.ntotal == 9
+    assert store.n_deleted == 1
+    assert store.n_indexed == 7
+
+    capsys.readouterr()
+    show_compression_info(store)
+    flat_mb = 7 * store.dimension * 4 / (1024 * 1024)
+    assert f"Flat float32 Size: {flat_mb:.2f} MB (7 live indexed vectors)" in capsys.readouterr().out
+
+
+def test_api_reduction_records_source_dimension_without_an_extra_call(build_store, monkeypatch):
+    calls = []
+    create = HashingEmbeddingClient.create
+    monkeypatch.setattr(HashingEmbeddingClient, 'create',
+                        lambda self, input, **kwargs: calls.append(kwargs) or
+                        create(self, input, **kwargs))
+
+    store = VectorStore(build_store(None, '--dimension', '256')).load()
+    assert store.dimension == 256
+    assert store.metadata['reduction'] == {'method': 'api', 'source_dimension': 1536}
+    assert calls and all(call.get('dimensions') == 256 for call in calls)